@@ -1,51 +1,280 @@
+import argparse
+import hashlib
 import json
 import os
+import re
+import sys
+import time
+
 import chromadb
-from chromadb.config import Settings
+import PyPDF2
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_client import embedding_client_from_env
 
+# Load environment variables
+load_dotenv()
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(script_dir, "embedding_results.json")
-
-# Load the embedding results
-with open(file_path, "r") as f:
-    embedding_results = json.load(f)
-
-# Initialize ChromaDB client - Updated to use the new client initialization
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-
-# Create a collection
-collection_name = "constitution_embeddings"
-collection = chroma_client.get_or_create_collection(name=collection_name)
-
-print(f"Created collection: {collection_name}")
-
-# Process and add each document embedding
-for item in embedding_results:
-    filename = item["filename"]
-    
-    # Extract embedding data - adjusting for the actual structure in your file
-    try:
-        embedding_data = item["response"]["result"]["data"][0]
-        
-        # For document content, you would ideally have the original text
-        # but since we just have the embedding, we'll use the filename for now
-        document_content = f"Embedding for {filename}"
-        
-        # Store in ChromaDB
+pdf_path = os.path.join(script_dir, "Constitution", "Constitution.pdf")
+checkpoint_path = os.path.join(script_dir, "ingest_checkpoint.json")
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+COLLECTION_NAME = "constitution_embeddings"
+EMBEDDING_MODEL = "@cf/baai/bge-large-en-v1.5"
+
+# Cloudflare accepts up to 100 texts per bge call; Chroma is happiest with a few hundred rows per add
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "50"))
+# Batches in flight at once; the embedding client retries 429s with backoff
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+ADD_BATCH_SIZE = int(os.getenv("INGEST_ADD_BATCH_SIZE", "500"))
+MAX_CHUNK_CHARS = int(os.getenv("INGEST_MAX_CHUNK_CHARS", "1800"))
+MAX_ARTICLE_GAP = 25
+
+# "21. Protection of life...", "2[21A. Right to education.—", "368. 1[Power of Parliament..."
+ARTICLE_HEADING = re.compile(r"^(?:\d*\[)?(\d{1,3}[A-Z]{0,3})\.\s*(?:\d*\[)?[A-Z]")
+# Schedule headings open a page too, glued to its number and any footnote: "2731[FOURTH SCHEDULE"
+SCHEDULE_HEADING = re.compile(r"^\d*\[?([A-Z]+(?:-[A-Z]+)?\s+SCHEDULE)\b")
+# Part headings open a page and carry its number: "6PART III"
+PART_HEADING = re.compile(r"^\d*PART\s*([IVX]+[A-Z]?)\b")
+# Footnotes reuse the "1. " numbering, but nearly always cite the amending instrument
+FOOTNOTE = re.compile(r"\b(ins\.|subs\.|omitted|added|rep\.|renumbered|see)\b|\bw\.e\.f\.|the Constitution \(", re.IGNORECASE)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_checkpoint():
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint):
+    # Write-then-rename so an interrupted run never leaves a half-written checkpoint
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def iter_pages(path, body_marker="PREAMBLE"):
+    """Yield (page_number, lines) one page at a time, without the running page header"""
+    reader = PyPDF2.PdfReader(path)
+    in_body = body_marker is None
+    for page_number, page in enumerate(reader.pages, start=1):
+        lines = [line.strip() for line in (page.extract_text() or "").splitlines()]
+        lines = [line for line in lines if line]
+        # Every body page starts with "THE CONSTITUTION OF INDIA" and a "(Part ...)NN" running head
+        if lines and lines[0].replace(" ", "").upper() == "THECONSTITUTIONOFINDIA":
+            lines = lines[2:] if len(lines) > 1 and lines[1].startswith("(") else lines[1:]
+        # The preface and table of contents list every article heading; indexing them would
+        # shadow the real text, so skip everything before the body starts
+        if not in_body:
+            if not lines or lines[0] != body_marker:
+                continue
+            in_body = True
+        yield page_number, lines
+
+
+def iter_chunks(pages, source):
+    """Split the page stream into article/schedule-aware chunks of at most MAX_CHUNK_CHARS"""
+    part = ""
+    schedule = ""
+    article_number = 0
+    section = "Preamble"
+    buffer = []
+    buffer_len = 0
+    page_start = None
+    page_end = None
+    seq = 0
+
+    def is_heading(match, line):
+        if FOOTNOTE.search(line):
+            return False
+        if schedule:
+            return True
+        # Articles only ever count upwards in small steps; a lower number is a page footnote,
+        # a big jump is a footnote marker glued to the number ("1[32A." extracts as "132A.")
+        number = int(re.match(r"\d+", match.group(1)).group())
+        return article_number <= number <= article_number + MAX_ARTICLE_GAP
+
+    def flush():
+        nonlocal buffer, buffer_len, page_start, seq
+        text = "\n".join(buffer).strip()
+        buffer, buffer_len = [], 0
+        if not text:
+            return None
+        seq += 1
+        chunk = {
+            "text": text,
+            "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "metadata": {
+                "source": source,
+                "part": part,
+                "section": section,
+                "page_start": page_start,
+                "page_end": page_end,
+                "seq": seq,
+            },
+        }
+        page_start = None
+        return chunk
+
+    for page_number, lines in pages:
+        for line in lines:
+            heading = None
+            match = ARTICLE_HEADING.match(line)
+            if match and is_heading(match, line):
+                # Numbered paragraphs inside a schedule are entries, not articles
+                if schedule:
+                    heading = f"{schedule}, item {match.group(1)}"
+                else:
+                    article_number = int(re.match(r"\d+", match.group(1)).group())
+                    heading = f"Article {match.group(1)}"
+            elif SCHEDULE_HEADING.match(line):
+                schedule = SCHEDULE_HEADING.match(line).group(1).title()
+                part = ""
+                heading = schedule
+            elif PART_HEADING.match(line):
+                part = f"Part {PART_HEADING.match(line).group(1)}"
+                heading = f"{schedule}, {part}" if schedule else part
+
+            if (heading and buffer) or buffer_len + len(line) > MAX_CHUNK_CHARS:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+            if heading:
+                section = heading
+
+            if page_start is None:
+                page_start = page_number
+            page_end = page_number
+            buffer.append(line)
+            buffer_len += len(line) + 1
+
+    chunk = flush()
+    if chunk:
+        yield chunk
+
+
+def existing_chunks(collection, source):
+    # Chunk ids are content hashes, so the collection itself records what has already been
+    # embedded; the stored metadata shows whether an unchanged chunk has since moved
+    existing = collection.get(where={"source": source}, include=["metadatas"])
+    return dict(zip(existing["ids"], existing["metadatas"]))
+
+
+def ingest(path, reset=False):
+    source = os.path.basename(path)
+    source_sha = file_sha256(path)
+    checkpoint = {} if reset else load_checkpoint()
+
+    if reset:
         try:
-            collection.add(
-                embeddings=[embedding_data],
-                documents=[document_content],
-                metadatas=[{"source": filename}],
-                ids=[filename.replace(".pdf", "")]
-            )
-            print(f"Successfully stored embedding for {filename}")
-        except Exception as e:
-            print(f"Error storing embedding for {filename}: {e}")
-    except KeyError as e:
-        print(f"Skipping {filename} because could not extract embedding data: {e}")
-        print(f"Response structure: {item['response']}")
-
-print("\nEmbeddings stored successfully in ChromaDB!")
-print(f"Collection Info: {collection.count()} documents stored")
\ No newline at end of file
+            chroma_client.delete_collection(COLLECTION_NAME)
+        except Exception:
+            pass
+    collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+
+    if checkpoint.get("source_sha256") == source_sha and checkpoint.get("completed"):
+        print(f"{source} unchanged since last ingestion ({collection.count()} chunks stored), nothing to do")
+        return collection
+
+    known = existing_chunks(collection, source)
+    print(f"Ingesting {source}: {len(known)} chunks already stored")
+
+    # A rerun after an interruption re-reads the PDF, which is cheap, and skips every chunk
+    # already stored by its content hash, so only the embedding left undone is paid for again
+    checkpoint = {"source": source, "source_sha256": source_sha, "completed": False}
+    save_checkpoint(checkpoint)
+
+    seen = set()
+    pending = []
+    to_add = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    to_update = {"ids": [], "metadatas": []}
+    stats = {"chunks": 0, "embedded": 0, "skipped": 0, "moved": 0, "last_page": 0}
+    started = time.monotonic()
+
+    def embed_pending():
+        if not pending:
+            return
+        embeddings = embedding_client.embed_many([chunk["text"] for chunk in pending])
+        for chunk, embedding in zip(pending, embeddings):
+            to_add["ids"].append(chunk["hash"])
+            to_add["embeddings"].append(embedding)
+            to_add["documents"].append(chunk["text"])
+            to_add["metadatas"].append(chunk["metadata"])
+        stats["embedded"] += len(pending)
+        pending.clear()
+
+    def add_pending():
+        for batch, write in ((to_add, collection.add), (to_update, collection.update)):
+            if batch["ids"]:
+                write(**batch)
+                for values in batch.values():
+                    values.clear()
+        elapsed = time.monotonic() - started
+        print(f"page {stats['last_page']}: {stats['chunks']} chunks, {stats['embedded']} embedded, "
+              f"{stats['skipped']} unchanged, {stats['moved']} moved ({elapsed:.1f}s)")
+
+    for chunk in iter_chunks(iter_pages(path), source):
+        stats["chunks"] += 1
+        stats["last_page"] = chunk["metadata"]["page_end"]
+        # Identical text (e.g. repeated oath forms) maps to the same id; store it once
+        if chunk["hash"] in seen:
+            continue
+        seen.add(chunk["hash"])
+        if chunk["hash"] in known:
+            stats["skipped"] += 1
+            # Text inserted or removed earlier in the document shifts seq and the pages of
+            # the chunks after it
+            if known[chunk["hash"]] != chunk["metadata"]:
+                to_update["ids"].append(chunk["hash"])
+                to_update["metadatas"].append(chunk["metadata"])
+                stats["moved"] += 1
+        else:
+            pending.append(chunk)
+        if len(pending) >= EMBED_BATCH_SIZE * EMBED_CONCURRENCY:
+            embed_pending()
+        if len(to_add["ids"]) >= ADD_BATCH_SIZE or len(to_update["ids"]) >= ADD_BATCH_SIZE:
+            add_pending()
+
+    embed_pending()
+    add_pending()
+
+    # Only prune once the whole document went through, so a crash never drops live chunks
+    stale = sorted(set(known) - seen)
+    for i in range(0, len(stale), ADD_BATCH_SIZE):
+        collection.delete(ids=stale[i:i + ADD_BATCH_SIZE])
+    if stale:
+        print(f"Removed {len(stale)} stale chunks")
+
+    checkpoint["completed"] = True
+    checkpoint["chunks"] = len(seen)
+    save_checkpoint(checkpoint)
+    return collection
+
+
+# Initialize ChromaDB client and the batching embedding client (pooled, bounded concurrency).
+# EMBEDDING_BACKEND=local embeds with the in-process model; the app must then use it too.
+chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+embedding_client = embedding_client_from_env(max_batch=EMBED_BATCH_SIZE, max_concurrency=EMBED_CONCURRENCY,
+                                             timeout=60)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk, embed and store the Constitution in ChromaDB")
+    parser.add_argument("--pdf", default=pdf_path, help="PDF to ingest")
+    parser.add_argument("--reset", action="store_true", help="drop the collection and re-embed everything")
+    args = parser.parse_args()
+
+    collection = ingest(args.pdf, reset=args.reset)
+    print("\nEmbeddings stored successfully in ChromaDB!")
+    print(f"Collection Info: {collection.count()} documents stored")
@@ -1,9 +1,14 @@
 import os
+import sys
 import json
 import requests
 import chromadb
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_cache import cache_from_env
+from embedding_client import EmbeddingError, embedding_client_from_env
+
 # Load environment variables
 load_dotenv()
 
@@ -41,24 +46,20 @@ CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
 chroma_client = chromadb.PersistentClient(path="./chroma_db")
 collection = chroma_client.get_collection(name="constitution_embeddings")
 
+embedding_cache = cache_from_env()
+# Cloudflare by default; EMBEDDING_BACKEND=local runs bge in-process
+embedding_client = embedding_client_from_env()
+
 def get_embedding(text):
-    """Generate embedding for text using Cloudflare AI API"""
-    model = "@cf/baai/bge-large-en-v1.5"
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/{model}"
-    
-    payload = json.dumps({"text": text})
-    headers = {
-        "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    response = requests.request(method="POST", url=url, headers=headers, data=payload)
-    result = response.json()
-    
-    if result.get("success") and result.get("result") and result["result"].get("data"):
-        return result["result"]["data"][0]
-    else:
-        print(f"Error getting embedding: {result.get('errors', 'Unknown error')}")
+    """Generate embedding for text, serving repeats from the embedding cache"""
+    return embedding_cache.get_or_compute(embedding_client.model, text, fetch_embedding)
+
+def fetch_embedding(text):
+    """Generate embedding for text with the configured embedding backend"""
+    try:
+        return embedding_client.embed(text)
+    except EmbeddingError as e:
+        print(f"Error getting embedding: {str(e)}")
         return None
 
 def generate_answer(question, context):
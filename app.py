@@ -1,33 +1,47 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 import os
 from dotenv import load_dotenv
-from groq import Groq
-import certifi
-import httpx
-import io
-import PyPDF2
-import docx
-import requests
-import chromadb
-from werkzeug.utils import secure_filename
-import tempfile
-import os.path
+import contextvars
+import json
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
 
 # Import your prompt utility
-from prompt_utils import usecase_prompt
+from prompt_utils import with_system_prompt
+from embedding_cache import cache_from_env
+from embedding_client import EmbeddingError, embedding_client_from_env
+from semantic_cache import answer_cache_from_env
+from document_extraction import DocumentTooLarge, extract_file_in_pool, extract_text
+from context_builder import ContextBuilder, count_tokens, split_into_chunks
+from conversation_store import conversation_store_from_env
+from document_analysis import MapReduceAnalyzer, analysis_cache_from_env
+from corpus_registry import MultiCorpusRetriever, parse_filters, registry_from_env
+from hybrid_retrieval import reranker_from_env
+from session_index import session_index_from_env
+from upload_jobs import QueueFull, upload_queue_from_env
+from startup import LazyResource, initialize
+import metrics
+import tracing
+import upstream
+from tracing import stage
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 
+CORS_ORIGINS = ["https://legal-chatbot-deploy-git-main-kathan-s-projects.vercel.app/", 
+                "https://legal-chatbot-deploy-kathan-s-projects.vercel.app/",
+                "https://legal-chatbot-deploy-seven.vercel.app/"]
+
 # Update CORS configuration
 CORS(app, resources={
     r"/api/*": {
-        "origins": ["https://legal-chatbot-deploy-git-main-kathan-s-projects.vercel.app/", 
-                   "https://legal-chatbot-deploy-kathan-s-projects.vercel.app/",
-                   "https://legal-chatbot-deploy-seven.vercel.app/"],
+        "origins": CORS_ORIGINS,
         "methods": ["GET", "POST", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"],
         "supports_credentials": True,
@@ -46,34 +60,56 @@ def chat():
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response, 204
     
-    data = request.json
-    conversation_history = data.get('conversation_history', [])
-    
-    if not conversation_history or conversation_history[-1]['role'] != 'user':
-        return jsonify({"error": "Invalid conversation history"}), 400
-    
-    # Add instruction to preserve formatting in the system prompt
-    last_system_prompt_index = -1
-    for i, msg in enumerate(conversation_history):
-        if msg['role'] == 'system':
-            last_system_prompt_index = i
-    
-    if last_system_prompt_index >= 0:
-        # Update existing system prompt
-        conversation_history[last_system_prompt_index]['content'] += "\n\nPlease ensure your response preserves formatting like spacing, indentation, and structure, especially for content like emails, code, or formal documents. Use proper paragraph breaks and maintain the intended layout."
-    else:
-        # Add new system prompt at the beginning
-        formatting_prompt = {"role": "system", "content": usecase_prompt() + "\n\nPlease ensure your response preserves formatting like spacing, indentation, and structure, especially for content like emails, code, or formal documents. Use proper paragraph breaks and maintain the intended layout."}
-        conversation_history.insert(0, formatting_prompt)
+    with stage("parse"):
+        data = request.json
+        session_id = None
+        if 'message' in data or 'session_id' in data:
+            # Session mode: the server keeps the history, the client sends only the new message
+            if not data.get('message'):
+                return jsonify({"error": "Missing message"}), 400
+            session_id, conversation_history = open_session(data.get('session_id'))
+            if conversation_history is None:
+                return jsonify({"error": "Unknown or expired session"}), 404
+            conversation_history.append({"role": "user", "content": data['message']})
+        else:
+            conversation_history = data.get('conversation_history', [])
+
+        if not conversation_history or conversation_history[-1]['role'] != 'user':
+            return jsonify({"error": "Invalid conversation history"}), 400
+
+        try:
+            filters = parse_filters(data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    question = conversation_history[-1]['content']
+    on_complete = lambda answer: record_turn(session_id, question, answer)
+    scope = {"session_id": session_id, "filters": filters}
 
-    ai_response = fetch_ai_response(groq_client, conversation_history)
+    if wants_stream(data):
+        return sse_response(stream_ai_response(
+            groq_client, conversation_history, "response",
+            {"session_id": session_id} if session_id else None, on_complete=on_complete, scope=scope,
+            degrade=True
+        ))
+
+    try:
+        ai_response = fetch_ai_response(groq_client, conversation_history, scope=scope)
+    except upstream.UpstreamError as e:
+        return degraded_response(e, conversation_history, scope, session_id)
+    except Exception as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        return jsonify({"error": "Failed to get AI response"}), 500
     
     if not ai_response:
         return jsonify({"error": "Failed to get AI response"}), 500
-    
-    return jsonify({
-        "response": ai_response
-    })
+
+    on_complete(ai_response)
+    result = {"response": ai_response}
+    if session_id:
+        result["session_id"] = session_id
+    with stage("serialize"):
+        return jsonify(result)
 
 @app.route('/api/upload', methods=['POST', 'OPTIONS'])
 def upload_file():
@@ -84,60 +120,382 @@ def upload_file():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
     
-    conversation_history = request.form.get('conversation_history', '[]')
-    import json
-    try:
-        conversation_history = json.loads(conversation_history)
-    except json.JSONDecodeError:
-        conversation_history = []
-    
-    # Create temp file
-    temp_dir = tempfile.gettempdir()
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(temp_dir, filename)
-    file.save(file_path)
-    
-    # Process the file
-    file_type = file.content_type
-    extracted_text = process_uploaded_file(file_path, file_type)
-
-    system_prompt_added = False
-    for i, msg in enumerate(conversation_history):
-        if msg['role'] == 'system':
-            conversation_history[i]['content'] += "\n\nPlease ensure your response preserves formatting like spacing, indentation, and structure, especially for content like emails, code, or formal documents."
-            system_prompt_added = True
-            break
-    
-    if not system_prompt_added:
-        formatting_prompt = {"role": "system", "content": usecase_prompt() + "\n\nPlease ensure your response preserves formatting like spacing, indentation, and structure, especially for content like emails, code, or formal documents."}
-        conversation_history.insert(0, formatting_prompt)
-    
-    # Remove temp file
-    os.remove(file_path)
+    session_id = None
+    if 'conversation_history' in request.form:
+        conversation_history = request.form.get('conversation_history', '[]')
+        try:
+            conversation_history = json.loads(conversation_history)
+        except json.JSONDecodeError:
+            conversation_history = []
+    else:
+        session_id, conversation_history = open_session(request.form.get('session_id'))
+        if conversation_history is None:
+            return jsonify({"error": "Unknown or expired session"}), 404
+    # An optional question sent with the file; without one the document is reviewed
+    question = request.form.get('question', '').strip() or None
+
+    if wants_async(request.form):
+        # Answer straight away with a job id; a background worker does the rest
+        try:
+            job_id = upload_jobs.submit(file.stream, file.filename, file.content_type,
+                                        {"conversation_history": conversation_history, "session_id": session_id,
+                                         "question": question})
+        except DocumentTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        except QueueFull as e:
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = str(UPLOAD_RETRY_AFTER)
+            return response, 503
+        result = {
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/upload/jobs/{job_id}",
+            "events_url": f"/api/upload/jobs/{job_id}/events",
+        }
+        if session_id:
+            result["session_id"] = session_id
+        return jsonify(result), 202
     
-    # Add the extracted text as a user message
-    conversation_history.append({"role": "user", "content": extracted_text})
+    # Process the file straight from the upload stream
+    try:
+        with stage("extract"):
+            extracted_text = extract_text(file.stream, file.content_type)
+    except DocumentTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+
+    on_complete = prepare_upload(extracted_text, file.filename, conversation_history, session_id, question)
+
+    if wants_stream(request.form):
+        metadata = {"extracted_text": extracted_text}
+        if session_id:
+            metadata["session_id"] = session_id
+        if uses_map_reduce(extracted_text):
+            return sse_response(stream_document_analysis(extracted_text, conversation_history, question, metadata,
+                                                         on_complete))
+        return sse_response(stream_ai_response(
+            groq_client, conversation_history, "ai_response", metadata,
+            use_answer_cache=False, on_complete=on_complete
+        ))
     
-    # Get AI response
-    ai_response = fetch_ai_response(groq_client, conversation_history)
+    try:
+        ai_response, analysis = answer_document(extracted_text, conversation_history, question)
+    except upstream.UpstreamError as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        return jsonify({"error": "Failed to get AI response"}), e.status
+    except Exception as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        return jsonify({"error": "Failed to get AI response"}), 500
     
     if not ai_response:
         return jsonify({"error": "Failed to get AI response"}), 500
-    
-    return jsonify({
+
+    on_complete(ai_response)
+    result = {
         "extracted_text": extracted_text,
         "ai_response": ai_response
-    })
+    }
+    if session_id:
+        result["session_id"] = session_id
+    if analysis:
+        result["analysis"] = analysis
+    with stage("serialize"):
+        return jsonify(result)
+
+@app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+def upload_job_status(job_id):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job)
+
+@app.route('/api/upload/jobs/<job_id>/events', methods=['GET'])
+def upload_job_events(job_id):
+    # The stream holds a worker for as long as the job runs. On sync workers (gunicorn's
+    # default) poll /api/upload/jobs/<job_id> instead, or serve through asgi_app.py, which
+    # streams these events from the event loop
+    if upload_jobs.get(job_id) is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return sse_response(job_events(job_id))
+
+def job_events(job_id):
+    """A "progress" event whenever the job moves on, then one "done" or "error" event"""
+    yield ": stream open\n\n"
+    state = {"last": None, "sent": time.monotonic()}
+    while True:
+        text, finished = poll_job_events(job_id, state)
+        if text:
+            yield text
+        if finished:
+            return
+        time.sleep(UPLOAD_JOB_POLL_SECONDS)
+
+def poll_job_events(job_id, state):
+    """One look at the job for its event stream: (text to send or None, whether the stream
+    is over). `state` carries what was sent last, and when, between polls"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return sse_event("error", {"error": "Unknown or expired job"}), True
+    if job["status"] in ("done", "failed"):
+        return sse_event("done" if job["status"] == "done" else "error", job), True
+    now = time.monotonic()
+    current = (job["status"], job["stage"], job["progress"], job.get("queue_position"))
+    if current != state["last"]:
+        state.update(last=current, sent=now)
+        return sse_event("progress", job), False
+    if now - state["sent"] >= UPLOAD_JOB_KEEPALIVE_SECONDS:
+        # A map-reduce stage can run for minutes without moving; proxies and browsers drop
+        # streams that stay silent that long
+        state["sent"] = now
+        return ": keep-alive\n\n", False
+    return None, False
+
+def prepare_upload(extracted_text, filename, conversation_history, session_id, question=None):
+    """Add the document (and the question sent with it) to the conversation; returns the
+    callback that records the turn"""
+    recorded_text = None
+    if session_id and SESSION_DOCUMENT_INDEX:
+        # Follow-up questions retrieve from the session's index, so the stored turn is a stub
+        # rather than the whole document re-sent with every later prompt
+        recorded_text = index_session_document(session_id, filename, extracted_text)
+    if uses_map_reduce(extracted_text):
+        recorded_text = with_question(
+            recorded_text or f"[Uploaded document: {filename}, analysed part by part]", question)
+        return lambda answer: record_turn(session_id, recorded_text, answer)
+    # Long documents are cut down to the excerpts most relevant to the question sent with the
+    # upload (or to a general review), unless the map-reduce analysis reads all of them.
+    # The question shares the document's message: as a message of its own it would make the
+    # document an older turn, which fit() cuts to a quarter of the prompt budget
+    document_text = with_question(
+        context_builder.select_document(extracted_text, question, get_embeddings), question)
+    conversation_history.append({"role": "user", "content": document_text})
+    if recorded_text:
+        recorded_text = with_question(recorded_text, question)
+    return lambda answer: record_turn(session_id, recorded_text or document_text, answer,
+                                      document=recorded_text is None)
+
+def with_question(text, question):
+    return f"{text}\n\n{question}" if question else text
+
+def run_upload_job(job, progress):
+    """The /api/upload pipeline for a queued job; PDF and DOCX parsing is CPU-bound, so it
+    runs in the extraction process pool rather than on the job thread"""
+    session_id = job["params"]["session_id"]
+    conversation_history = job["params"]["conversation_history"]
+    question = job["params"].get("question")
+    progress("extracting", 0.1)
+    with stage("extract"):
+        extracted_text = extract_file_in_pool(job["path"], job["content_type"])
+    progress("indexing", 0.4)
+    on_complete = prepare_upload(extracted_text, job["filename"], conversation_history, session_id, question)
+    progress("analyzing", 0.6)
+    ai_response, analysis = answer_document(
+        extracted_text, conversation_history, question,
+        lambda done, total: progress("analyzing", 0.6 + 0.35 * done / max(total, 1)))
+    if not ai_response:
+        raise RuntimeError("Failed to get AI response")
+    on_complete(ai_response)
+    result = {"extracted_text": extracted_text, "ai_response": ai_response}
+    if session_id:
+        result["session_id"] = session_id
+    if analysis:
+        result["analysis"] = analysis
+    return result
+
+def uses_map_reduce(extracted_text):
+    return LONG_DOCUMENT_MODE == "map-reduce" and \
+        count_tokens(extracted_text) > max(MAP_REDUCE_MIN_TOKENS, context_builder.document_budget)
+
+def answer_document(extracted_text, conversation_history, question=None, on_progress=None):
+    """Answer an upload: (answer or None, map-reduce report or None); raises
+    upstream.UpstreamError when Groq cannot be reached"""
+    if not uses_map_reduce(extracted_text):
+        # Documents are never answered from the semantic cache, since bge only sees their
+        # first 512 tokens and two contracts can share a preamble
+        return fetch_ai_response(groq_client, conversation_history, use_answer_cache=False), None
+    # Only a question sent with the upload steers the reduce prompt; the previous chat turn
+    # was about something else, so without one the document gets the general review
+    try:
+        report = document_analyzer.analyze(extracted_text, question, conversation_history, on_progress)
+    except upstream.UpstreamError:
+        raise
+    except Exception as e:
+        print(f"Error analysing document: {str(e)}")
+        return None, None
+    return report.pop("answer"), report
+
+def stream_document_analysis(extracted_text, conversation_history, question, metadata, on_complete):
+    """Server-sent events for a map-reduce upload: "progress" events as chunks are analysed,
+    then the answer as one "token" event and a "done" event carrying the report"""
+    yield ": stream open\n\n"
+    events = queue.Queue()
+
+    def run():
+        try:
+            answer, report = answer_document(
+                extracted_text, conversation_history, question,
+                lambda done, total: events.put(("progress", {"done": done, "total": total})))
+        except Exception as e:
+            print(f"Error communicating with Groq API: {str(e)}")
+            answer, report = None, None
+        events.put(("result", (answer, report)))
+
+    # copy_context keeps the map and reduce stages in this request's trace
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+    while True:
+        kind, payload = events.get()
+        if kind == "progress":
+            yield sse_event("progress", payload)
+            continue
+        answer, report = payload
+        if not answer:
+            yield sse_event("error", {"error": "Failed to get AI response"})
+            return
+        on_complete(answer)
+        yield sse_event("token", {"content": answer})
+        yield sse_event("done", dict(metadata, ai_response=answer, analysis=report))
+        return
+
+def open_session(session_id):
+    """Return (session_id, stored history); a new session when no id is given, and a
+    None history when the id is unknown or expired"""
+    if not session_id:
+        return conversation_store.create(), []
+    return session_id, conversation_store.history(session_id)
+
+def index_session_document(session_id, filename, text):
+    """Chunk, embed and index an upload for the session; returns the turn to record instead"""
+    chunks = split_into_chunks(text)
+    # select_document embeds the same chunks next, straight from the embedding cache
+    vectors = get_embeddings(chunks) if chunks else None
+    session_documents.add(session_id, filename, chunks, vectors)
+    return f"[Uploaded document: {filename}, {len(chunks)} sections indexed for follow-up questions]"
+
+def record_turn(session_id, user_content, answer, document=False):
+    # Only session-mode requests are stored; legacy clients keep sending their own history
+    if session_id and answer:
+        conversation_store.record(session_id, user_content, answer, document=document)
+
+def wants_stream(payload):
+    # Clients opt in with "stream": true (JSON or form field), ?stream=1 or Accept: text/event-stream
+    flag = request.args.get('stream', payload.get('stream') if payload else None)
+    if flag in (True, 1) or str(flag).lower() in ("1", "true", "yes"):
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+def wants_async(payload):
+    # Uploads opt in to background processing with "async": 1 (form field) or ?async=1
+    flag = request.args.get('async', payload.get('async') if payload else None)
+    return str(flag).lower() in ("1", "true", "yes")
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    # The request's trace ends when the stream does, not when the view returns
+    g.trace_streaming = True
+    return Response(
+        stream_with_context(traced_stream(events, g.trace, g.trace_token, request.method)),
+        mimetype="text/event-stream",
+        # Stop proxies (nginx, Render) from buffering the stream until it completes
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def traced_stream(events, trace, token, method):
+    try:
+        yield from events
+    finally:
+        tracing.end(trace, token, method, 200)
+
+@app.errorhandler(Exception)
+def handle_exception(e):
+    # The frontend reads {"error": ...}; Flask's default would be an HTML page
+    if isinstance(e, HTTPException):
+        return jsonify({"error": e.description}), e.code
+    print(f"Unhandled error on {request.path}: {type(e).__name__}: {str(e)}")
+    return jsonify({"error": "Internal server error"}), 500
 
 @app.before_request
 def check_content_length():
     cl = request.content_length
     print(f"Incoming request size: {cl} bytes")
 
+@app.before_request
+def start_trace():
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.trace, g.trace_token = tracing.begin(route)
+
+@app.before_request
+def start_budget():
+    # Chat requests share REQUEST_BUDGET_SECONDS across their upstream calls; uploads and
+    # background jobs are bounded by the per-stage timeouts alone
+    chat_route = request.url_rule is not None and request.url_rule.rule == '/api/chat'
+    g.budget_token = upstream.start_budget() if chat_route else None
+
+@app.after_request
+def finish_trace(response):
+    trace = g.get("trace")
+    if trace is not None and tracing.SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    if trace is not None and not g.get("trace_streaming"):
+        tracing.end(trace, g.trace_token, request.method, response.status_code)
+        g.trace = None
+    return response
+
+@app.teardown_request
+def end_budget(error):
+    # Runs once a streamed response has finished, so streams keep their budget
+    if g.get("budget_token") is not None:
+        upstream.end_budget(g.budget_token)
+        g.budget_token = None
+
+@app.teardown_request
+def abandon_trace(error):
+    # Views that raised never reach after_request
+    trace = g.get("trace")
+    if trace is not None and not g.get("trace_streaming"):
+        tracing.end(trace, g.trace_token, request.method, 500)
+        g.trace = None
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus text format; set METRICS_TOKEN to require "Authorization: Bearer <token>"
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    # Never waits for a resource to load: "status" is liveness, "ready" is readiness
+    warm = retriever.peek()
+    return jsonify({
+        "status": "ok",
+        "ready": all(resource.ready for resource in startup_resources),
+        "startup": {resource.name: resource.status() for resource in startup_resources},
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "session_documents": session_documents.stats(),
+        "upload_jobs": upload_jobs.stats(),
+        "document_analysis": document_analyzer.stats(),
+        "context_budget": context_builder.stats(),
+        "conversations": conversation_store.stats(),
+        "retrieval": warm.stats() if warm else None,
+        "corpora": corpus_registry.describe(),
+        "embedding_client": embedding_client.stats(),
+        "upstreams": {"groq": groq_breaker.stats(), "embeddings": embedding_client.breaker.stats()},
+    })
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
     return jsonify({"status": "ok"})
 
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    # 503 until the vector store and Groq client are open, so the load balancer holds traffic
+    ready = all(resource.ready for resource in startup_resources)
+    body = {"ready": ready, "startup": {resource.name: resource.status() for resource in startup_resources}}
+    return jsonify(body), 200 if ready else 503
+
 @app.route('/')
 def index():
     return jsonify({
@@ -145,53 +503,133 @@ def index():
         "message": "Legal Chatbot API is running. Available endpoints: /api/chat, /api/upload, /api/health"
     })
 
-# ChromaDB & Cloudflare setup
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_collection(name="constitution_embeddings")
+CLOUDFLARE_API_BASE = os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4")
+
+# Repeated questions skip the Cloudflare round-trip entirely
+embedding_cache = cache_from_env()
+# Near-duplicate questions skip the Groq completion
+answer_cache = answer_cache_from_env()
+# Server-side histories for clients that send a session_id
+conversation_store = conversation_store_from_env()
+# Caps every Groq prompt at PROMPT_TOKEN_BUDGET tokens
+context_builder = ContextBuilder()
+# Uploads in session mode, chunked for retrieval by follow-up questions
+SESSION_DOCUMENT_INDEX = os.getenv("SESSION_DOCUMENT_INDEX", "1") == "1"
+session_documents = session_index_from_env()
+
+# EMBEDDING_BACKEND picks Cloudflare (micro-batched calls) or a local ONNX model; its
+# expected dimension is filled in once the collection is open
+embedding_client = embedding_client_from_env(CLOUDFLARE_API_BASE)
+
+# CORPORA_CONFIG lists the corpora (the Constitution collection alone by default); each is a
+# Chroma collection or a read-only VECTOR_INDEX_PATH export (vector_index.py)
+corpus_registry = registry_from_env()
+
+def open_retriever():
+    # chromadb takes most of a cold start to import, so it is only loaded here. The stored
+    # vectors fix the dimension every query embedding must have
+    embedding_client.expected_dimension = corpus_registry.open(reranker_from_env())
+    return MultiCorpusRetriever(corpus_registry)
+
+# BM25 + dense retrieval per corpus, with a direct path for questions naming an article or
+# schedule. Opened on first use or by the warm-up thread (STARTUP_MODE)
+retriever = LazyResource("vector_store", open_retriever)
 
 def get_embedding(text):
-    model = "@cf/baai/bge-large-en-v1.5"
-    url = f"https://api.cloudflare.com/client/v4/accounts/{os.getenv('CLOUDFLARE_ACCOUNT_ID')}/ai/run/{model}"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('CLOUDFLARE_API_TOKEN')}",
-        "Content-Type": "application/json"
-    }
-    response = requests.post(url, headers=headers, json={"text": text})
-    result = response.json()
-    if result.get("success") and result.get("result") and result["result"].get("data"):
-        return result["result"]["data"][0]
-    return None
-
-def get_context_from_chroma(question):
-    embedding = get_embedding(question)
-    if not embedding:
-        return "No relevant context found."
-    result = collection.query(query_embeddings=[embedding], n_results=3)
-    if result["documents"]:
-        return "\n\n".join(result["documents"][0])
-    return "No relevant documents found."
+    return embedding_cache.get_or_compute(embedding_client.model, text, fetch_embedding)
+
+def fetch_embedding(text):
+    # Waits no longer than the embed stage allows; retrieval then falls back to BM25
+    try:
+        with stage("embed"):
+            return embedding_client.submit(text).result(timeout=upstream.timeout_for("embed"))
+    except FutureTimeout:
+        print("Error getting embedding: timed out")
+        upstream.abandon("embed")
+        return None
+    except (EmbeddingError, upstream.DeadlineExceeded) as e:
+        print(f"Error getting embedding: {str(e)}")
+        return None
+
+def get_embeddings(texts):
+    """Embed many texts, sending only the cache misses; None if any batch fails"""
+    embeddings = [embedding_cache.get(embedding_client.model, text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    try:
+        with stage("embed"):
+            fetched = embedding_client.embed_many([texts[i] for i in missing])
+    except EmbeddingError as e:
+        print(f"Error getting embeddings: {str(e)}")
+        return None
+    for i, embedding in zip(missing, fetched):
+        embedding_cache.put(embedding_client.model, texts[i], embedding)
+        embeddings[i] = embedding
+    return embeddings
+
+def get_context_from_chroma(question, scope=None):
+    # Questions naming an article or schedule skip the embedding call; the hybrid search
+    # falls back to BM25 alone when it fails. `scope` carries the request's corpus filters
+    # and session, whose uploaded documents are searched too
+    scope = scope or {}
+    embedding = None
+    with stage("retrieve"):
+        documents = retriever.lookup(question, scope.get("filters"))
+    if not documents:
+        embedding = get_embedding(question)
+        with stage("retrieve"):
+            documents = retriever.search(question, embedding, scope.get("filters"))
+    excerpts = []
+    if session_documents.has_documents(scope.get("session_id")):
+        if embedding is None:
+            embedding = get_embedding(question)
+        with stage("retrieve"):
+            excerpts = session_documents.search(scope["session_id"], question, embedding)
+    return context_from_documents(documents, excerpts)
+
+def context_from_documents(documents, excerpts=None):
+    sections = []
+    if excerpts:
+        sections.append("From the user's uploaded document:\n" + "\n[...]\n".join(excerpts))
+    if documents:
+        sections.append("\n\n".join(documents))
+    return "\n\n".join(sections) or NO_CONTEXT
+
+NO_CONTEXT = "No relevant documents found."
 
 # Function to initialize the Groq client
 def setup_groq_client(api_key):
+    import certifi
+    import httpx
+    from groq import Groq
+
     # Configure SSL certificate
     os.environ['SSL_CERT_FILE'] = certifi.where()
     
-    # Create httpx client with SSL verification
-    http_client = httpx.Client(verify=certifi.where())
+    # Create httpx client with SSL verification, a bounded keep-alive pool and timeouts; each
+    # call passes a tighter one from the request's budget
+    http_client = httpx.Client(verify=certifi.where(), timeout=upstream.http_timeout(),
+                               limits=upstream.http_limits())
     
-    # Initialize Groq client with custom HTTP client
-    return Groq(api_key=api_key, http_client=http_client)
+    # Initialize Groq client with custom HTTP client. Retries happen in upstream.call, inside
+    # the request's budget, rather than in the SDK
+    return Groq(api_key=api_key, http_client=http_client, max_retries=0)
 
-def fetch_ai_response(client, conversation_history):
-    try:
-        # Get the last user message
-        last_user_message = next((m["content"] for m in reversed(conversation_history) if m["role"] == "user"), "")
-        
-        # Retrieve context from ChromaDB
-        context = get_context_from_chroma(last_user_message)
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+def get_last_user_message(conversation_history):
+    return next((m["content"] for m in reversed(conversation_history) if m["role"] == "user"), "")
+
+def build_messages(conversation_history, scope=None):
+    # Get the last user message
+    last_user_message = get_last_user_message(conversation_history)
+    
+    # Retrieve context from ChromaDB
+    context = get_context_from_chroma(last_user_message, scope)
+    return assemble_messages(conversation_history, last_user_message, context)
 
-        # Enrich the user message with ChromaDB context
-        context_prefixed_message = f"""Use the following legal context to answer the user's question:
+def assemble_messages(conversation_history, last_user_message, context):
+    # Enrich the user message with ChromaDB context
+    context_prefixed_message = f"""Use the following legal context to answer the user's question:
 
 Context:
 {context}
@@ -200,59 +638,210 @@ Question:
 {last_user_message}
 """
 
-        # Replace the last user message with the enriched one
-        modified_history = [
-            m if m["role"] != "user" or m["content"] != last_user_message
-            else {"role": "user", "content": context_prefixed_message}
-            for m in conversation_history
-        ]
+    # Replace the last user message with the enriched one
+    modified_history = [
+        m if m["role"] != "user" or m["content"] != last_user_message
+        else {"role": "user", "content": context_prefixed_message}
+        for m in conversation_history
+    ]
+
+    # Single precomputed system prompt, then keep the whole prompt inside the token budget
+    with stage("prompt"):
+        messages, report = context_builder.fit(with_system_prompt(modified_history))
+    print(f"Prompt tokens: {report['tokens_in']} -> {report['tokens_out']} "
+          f"(saved {report['tokens_saved']}, dropped {report['turns_dropped']} turns)")
+    return messages
+
+def shares_answers(scope):
+    # Answers drawn from filtered corpora or the session's own uploads are not for other users
+    scope = scope or {}
+    return not scope.get("filters") and not session_documents.has_documents(scope.get("session_id"))
+
+def lookup_cached_answer(conversation_history, scope=None):
+    """Return (question_embedding, cached_answer); both None when the cache is off"""
+    if not answer_cache.enabled or not shares_answers(scope):
+        return None, None
+    # Retrieval embeds the same question right after; the embedding cache makes that free
+    question_embedding = get_embedding(get_last_user_message(conversation_history))
+    return question_embedding, answer_cache.lookup(question_embedding, conversation_history)
 
-        # Prepend system prompt from usecase_prompt
-        system_prompt = {"role": "system", "content": usecase_prompt()}
-        final_history = [system_prompt] + modified_history
+def fetch_ai_response(client, conversation_history, use_answer_cache=True, scope=None):
+    """The answer, from the semantic cache or Groq; raises upstream.UpstreamError when Groq
+    cannot be reached within the request's budget"""
+    question_embedding = None
+    if use_answer_cache:
+        question_embedding, cached_answer = lookup_cached_answer(conversation_history, scope)
+        if cached_answer:
+            return cached_answer
 
-        # Send to Groq
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=final_history
-        )
+    final_history = build_messages(conversation_history, scope)
 
-        return response.choices[0].message.content
+    # Send to Groq
+    with stage("llm"):
+        response = upstream.call(groq_breaker, lambda timeout: client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=final_history,
+            timeout=timeout
+        ), "llm")
+    tracing.record_usage(response.usage)
 
+    answer = response.choices[0].message.content
+    tokens = response.usage.total_tokens if response.usage else 0
+    answer_cache.store(question_embedding, conversation_history, answer, tokens)
+    return answer
+
+def degraded_answer(conversation_history, scope=None):
+    """Answer without Groq: (a cached answer to a close question, "cached"), else (the
+    retrieved passages, "retrieval-only"), else (None, None)"""
+    question = get_last_user_message(conversation_history)
+    try:
+        if answer_cache.enabled and shares_answers(scope):
+            cached = answer_cache.lookup(get_embedding(question), conversation_history,
+                                         threshold=DEGRADED_CACHE_THRESHOLD)
+            if cached:
+                metrics.DEGRADED_ANSWERS.inc(kind="cached")
+                return cached, "cached"
+        context = get_context_from_chroma(question, scope)
     except Exception as e:
-        print(f"Error communicating with Groq API: {str(e)}")
-        return None
+        print(f"Error retrieving a fallback answer: {str(e)}")
+        return None, None
+    if context == NO_CONTEXT:
+        return None, None
+    metrics.DEGRADED_ANSWERS.inc(kind="retrieval-only")
+    return DEGRADED_PREFIX + context, "retrieval-only"
 
-def extract_text_from_pdf(file_path):
-    with open(file_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-    return text
-
-def extract_text_from_docx(file_path):
-    doc = docx.Document(file_path)
-    text = ""
-    for para in doc.paragraphs:
-        text += para.text + "\n"
-    return text
-
-def process_uploaded_file(file_path, file_type):
-    if file_type == "text/plain":
-        with open(file_path, 'r') as file:
-            return file.read()
-    
-    elif file_type == "application/pdf":
-        return extract_text_from_pdf(file_path)
-    
-    elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return extract_text_from_docx(file_path)
+def degraded_response(error, conversation_history, scope, session_id):
+    print(f"Error communicating with Groq API: {str(error)}")
+    answer, kind = degraded_answer(conversation_history, scope)
+    if answer is None:
+        return jsonify({"error": "Failed to get AI response"}), error.status
+    # Not recorded in the session, so the question reaches the model once it is back
+    result = {"response": answer, "degraded": kind}
+    if session_id:
+        result["session_id"] = session_id
+    return jsonify(result)
 
-    return "Unsupported file type."
+def stream_ai_response(client, conversation_history, response_key, metadata=None, use_answer_cache=True,
+                       on_complete=None, scope=None, degrade=False):
+    """Yield server-sent events: a "token" event per Groq delta, then one "done" event
+    carrying the full response and metadata (or an "error" event). on_complete is called
+    with the full response before the "done" event. With `degrade`, a Groq outage before the
+    first token is answered with degraded_answer instead of an error"""
+    # Flush headers straight away so the client sees the stream open before retrieval runs
+    yield ": stream open\n\n"
+    try:
+        question_embedding = None
+        if use_answer_cache:
+            question_embedding, cached_answer = lookup_cached_answer(conversation_history, scope)
+            if cached_answer:
+                yield sse_event("token", {"content": cached_answer})
+                done = dict(metadata or {})
+                done[response_key] = cached_answer
+                done["cached"] = True
+                if on_complete:
+                    on_complete(cached_answer)
+                yield sse_event("done", done)
+                return
+
+        final_history = build_messages(conversation_history, scope)
+        with stage("llm"):
+            llm_started = time.perf_counter()
+            # Retries and the breaker cover opening the stream; once tokens flow, a failure ends it
+            stream = upstream.call(groq_breaker, lambda timeout: client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=final_history,
+                stream=True,
+                timeout=timeout
+            ), "llm")
+
+            parts = []
+            usage = None
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        metrics.FIRST_TOKEN_SECONDS.observe(time.perf_counter() - llm_started)
+                    parts.append(delta)
+                    yield sse_event("token", {"content": delta})
+                chunk_usage = chunk.usage or (chunk.x_groq.usage if chunk.x_groq else None)
+                if chunk_usage:
+                    usage = chunk_usage.model_dump()
+        tracing.record_usage(usage)
+
+        done = dict(metadata or {})
+        done[response_key] = "".join(parts)
+        done["usage"] = usage
+        answer_cache.store(question_embedding, conversation_history, done[response_key],
+                           usage["total_tokens"] if usage else 0)
+        if on_complete:
+            on_complete(done[response_key])
+        yield sse_event("done", done)
+
+    except upstream.UpstreamError as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        answer, kind = degraded_answer(conversation_history, scope) if degrade else (None, None)
+        if answer is None:
+            yield sse_event("error", {"error": "Failed to get AI response"})
+            return
+        yield sse_event("token", {"content": answer})
+        done = dict(metadata or {})
+        done[response_key] = answer
+        done["degraded"] = kind
+        yield sse_event("done", done)
+
+    except Exception as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        yield sse_event("error", {"error": "Failed to get AI response"})
 
 # Initialize Groq client
-groq_client = setup_groq_client(os.getenv("GROQ_API_KEY"))
+groq_client = LazyResource("groq", lambda: setup_groq_client(os.getenv("GROQ_API_KEY")))
+# Opens after BREAKER_FAILURES consecutive failed calls; chats then get degraded answers
+groq_breaker = upstream.CircuitBreaker("groq")
+# While Groq is unreachable, chats get a cached answer to a question this close, or failing
+# that the passages retrieval found
+DEGRADED_CACHE_THRESHOLD = float(os.getenv("DEGRADED_CACHE_THRESHOLD", "0.9"))
+DEGRADED_PREFIX = ("The AI model is unavailable right now, so this is not a generated answer. "
+                   "These are the most relevant passages found for your question:\n\n")
+
+def complete_once(messages, max_tokens=None):
+    """One non-streamed Groq call for the document analysis; returns (text, total tokens)"""
+    options = {"max_tokens": max_tokens} if max_tokens else {}
+    messages, _ = context_builder.fit(messages)
+    response = upstream.call(groq_breaker, lambda timeout: groq_client.chat.completions.create(
+        model=GROQ_MODEL, messages=messages, timeout=timeout, **options), "llm")
+    tracing.record_usage(response.usage)
+    return response.choices[0].message.content, response.usage.total_tokens if response.usage else 0
+
+# Uploads over the document budget are cut to the excerpts most similar to the question and
+# answered in one call. With "map-reduce", those too long for the model to read at once
+# (over MAP_REDUCE_MIN_TOKENS; llama-3.3-70b reads 128k) have every part analysed instead
+LONG_DOCUMENT_MODE = os.getenv("LONG_DOCUMENT_MODE", "map-reduce").lower()
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "100000"))
+document_analyzer = MapReduceAnalyzer(complete_once, GROQ_MODEL, analysis_cache_from_env())
+
+# Uploads sent with async=1: a SQLite queue shared by the workers, UPLOAD_QUEUE_MAX deep
+upload_jobs = upload_queue_from_env(run_upload_job)
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "10"))
+UPLOAD_JOB_POLL_SECONDS = float(os.getenv("UPLOAD_JOB_POLL_SECONDS", "0.5"))
+UPLOAD_JOB_KEEPALIVE_SECONDS = float(os.getenv("UPLOAD_JOB_KEEPALIVE_SECONDS", "5"))
+
+startup_resources = [retriever, groq_client]
+initialize(startup_resources)
+
+def retrieval_stats():
+    warm = retriever.peek()
+    return warm.stats() if warm else None
+
+# Component counters show up in /api/metrics as gauges next to the request metrics
+metrics.REGISTRY.add_stats("chatbot_embedding_cache", embedding_cache.stats)
+metrics.REGISTRY.add_stats("chatbot_answer_cache", answer_cache.stats)
+metrics.REGISTRY.add_stats("chatbot_conversations", conversation_store.stats)
+metrics.REGISTRY.add_stats("chatbot_embedding_client", embedding_client.stats)
+metrics.REGISTRY.add_stats("chatbot_retrieval", retrieval_stats)
+metrics.REGISTRY.add_stats("chatbot_session_documents", session_documents.stats)
+metrics.REGISTRY.add_stats("chatbot_upload_jobs", upload_jobs.stats)
+metrics.REGISTRY.add_stats("chatbot_document_analysis", document_analyzer.stats)
+metrics.REGISTRY.add_stats("chatbot_groq_breaker", groq_breaker.stats)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
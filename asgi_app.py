@@ -0,0 +1,319 @@
+"""Asyncio serving mode for the chat backend.
+
+    uvicorn asgi_app:app --workers 2
+
+/api/chat runs natively on the event loop: completions go over a pooled keep-alive (HTTP/2
+when h2 is installed) httpx client, embeddings through the app's micro-batching client, and
+the Chroma query runs in a thread pool, so one process can hold hundreds of chats waiting on upstream I/O.
+Upload job progress (/api/upload/jobs/<id>/events) is streamed from the event loop too. Every
+other route (/api/upload, /api/health, /) is served by the Flask app through a WSGI bridge.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+import app as backend
+import metrics
+import tracing
+import upstream
+from corpus_registry import parse_filters
+from embedding_client import EmbeddingError
+from tracing import stage
+
+try:
+    import h2  # noqa: F401
+    HTTP2_ENABLED = os.getenv("UPSTREAM_HTTP2", "1") == "1"
+except ImportError:
+    HTTP2_ENABLED = False
+
+VECTOR_SEARCH_THREADS = int(os.getenv("VECTOR_SEARCH_THREADS", "8"))
+
+# Created in the lifespan handler so they are bound to the serving event loop
+clients = {}
+search_pool = ThreadPoolExecutor(max_workers=VECTOR_SEARCH_THREADS, thread_name_prefix="vector-search")
+
+
+def pooled_http_client():
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        verify=certifi.where(),
+        # UPSTREAM_MAX_CONNECTIONS / UPSTREAM_MAX_KEEPALIVE, shared with the Flask client
+        limits=upstream.http_limits(),
+        timeout=upstream.http_timeout(),
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    from groq import AsyncGroq
+
+    # Retries happen in upstream.call_async, inside the request's budget
+    clients["groq"] = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=pooled_http_client(),
+                                max_retries=0)
+    try:
+        yield
+    finally:
+        await clients.pop("groq").close()
+
+
+async def get_embedding_async(text):
+    cached = backend.embedding_cache.get(backend.embedding_client.model, text)
+    if cached is not None:
+        return cached
+    # Shares the coalescing client with the Flask routes, so concurrent chats ride one batch.
+    # Shielded: giving up at the embed deadline must not cancel a future the batch resolves
+    try:
+        with stage("embed"):
+            embedding = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(
+                backend.embedding_client.submit(text))), timeout=upstream.timeout_for("embed"))
+    except asyncio.TimeoutError:
+        print("Error getting embedding: timed out")
+        upstream.abandon("embed")
+        return None
+    except (EmbeddingError, upstream.DeadlineExceeded) as e:
+        print(f"Error getting embedding: {str(e)}")
+        return None
+    backend.embedding_cache.put(backend.embedding_client.model, text, embedding)
+    return embedding
+
+
+async def get_context_async(question, scope=None):
+    loop = asyncio.get_running_loop()
+    scope = scope or {}
+    filters, session_id = scope.get("filters"), scope.get("session_id")
+    embedding = None
+    # Questions naming an article or schedule skip the embedding call entirely. The retriever
+    # is touched only inside the pool, so a cold vector store never opens on the event loop
+    with stage("retrieve"):
+        documents = await loop.run_in_executor(search_pool, lambda: backend.retriever.lookup(question, filters))
+    if not documents:
+        embedding = await get_embedding_async(question)
+        with stage("retrieve"):
+            documents = await loop.run_in_executor(
+                search_pool, lambda: backend.retriever.search(question, embedding, filters))
+    excerpts = []
+    if await asyncio.to_thread(backend.session_documents.has_documents, session_id):
+        if embedding is None:
+            embedding = await get_embedding_async(question)
+        with stage("retrieve"):
+            excerpts = await loop.run_in_executor(
+                search_pool, backend.session_documents.search, session_id, question, embedding)
+    return backend.context_from_documents(documents, excerpts)
+
+
+def wants_stream(request, data):
+    flag = request.query_params.get("stream", data.get("stream"))
+    if flag in (True, 1) or str(flag).lower() in ("1", "true", "yes"):
+        return True
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+async def lookup_cached_answer(conversation_history, question, scope=None):
+    if not backend.answer_cache.enabled or not await asyncio.to_thread(backend.shares_answers, scope):
+        return None, None
+    question_embedding = await get_embedding_async(question)
+    return question_embedding, backend.answer_cache.lookup(question_embedding, conversation_history)
+
+
+async def stream_events(conversation_history, question, session_id=None, trace=None, trace_token=None,
+                        scope=None):
+    # Mirrors app.stream_ai_response: "token" events, then a single "done" or "error"
+    yield ": stream open\n\n"
+    done = {"session_id": session_id} if session_id else {}
+    status = 200
+    try:
+        question_embedding, cached_answer = await lookup_cached_answer(conversation_history, question, scope)
+        if cached_answer:
+            await asyncio.to_thread(backend.record_turn, session_id, question, cached_answer)
+            yield backend.sse_event("token", {"content": cached_answer})
+            yield backend.sse_event("done", dict(done, response=cached_answer, cached=True))
+            return
+
+        context = await get_context_async(question, scope)
+        messages = backend.assemble_messages(conversation_history, question, context)
+        with stage("llm"):
+            llm_started = time.perf_counter()
+            stream = await upstream.call_async(
+                backend.groq_breaker,
+                lambda timeout: clients["groq"].chat.completions.create(
+                    model=backend.GROQ_MODEL, messages=messages, stream=True, timeout=timeout),
+                "llm")
+            parts = []
+            usage = None
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        metrics.FIRST_TOKEN_SECONDS.observe(time.perf_counter() - llm_started)
+                    parts.append(delta)
+                    yield backend.sse_event("token", {"content": delta})
+                chunk_usage = chunk.usage or (chunk.x_groq.usage if chunk.x_groq else None)
+                if chunk_usage:
+                    usage = chunk_usage.model_dump()
+        tracing.record_usage(usage)
+        answer = "".join(parts)
+        backend.answer_cache.store(question_embedding, conversation_history, answer,
+                                   usage["total_tokens"] if usage else 0)
+        await asyncio.to_thread(backend.record_turn, session_id, question, answer)
+        yield backend.sse_event("done", dict(done, response=answer, usage=usage))
+    except upstream.UpstreamError as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        answer, kind = await asyncio.to_thread(backend.degraded_answer, conversation_history, scope)
+        if answer is None:
+            status = e.status
+            yield backend.sse_event("error", {"error": "Failed to get AI response"})
+        else:
+            yield backend.sse_event("token", {"content": answer})
+            yield backend.sse_event("done", dict(done, response=answer, degraded=kind))
+    except Exception as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        status = 500
+        yield backend.sse_event("error", {"error": "Failed to get AI response"})
+    finally:
+        if trace is not None:
+            tracing.end(trace, trace_token, "POST", status)
+
+
+async def chat(request):
+    if request.method == "OPTIONS":
+        # Real preflights are answered by CORSMiddleware before reaching here
+        return Response(status_code=204)
+    # One event loop thread serves every request, so the sampling profiler stays off here
+    trace, trace_token = tracing.begin("/api/chat", profile=False)
+    # A stream keeps the budget: the response iterates it in this task after we return
+    budget_token = upstream.start_budget()
+    response = None
+    try:
+        response = await handle_chat(request, trace, trace_token)
+        return response
+    finally:
+        if not isinstance(response, StreamingResponse):
+            upstream.end_budget(budget_token)
+            status = response.status_code if response is not None else 500
+            if response is not None and tracing.SERVER_TIMING:
+                response.headers["Server-Timing"] = trace.server_timing()
+            tracing.end(trace, trace_token, "POST", status)
+
+
+async def handle_chat(request, trace, trace_token):
+    with stage("parse"):
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return JSONResponse({"error": "Invalid conversation history"}, status_code=400)
+        session_id = None
+        if "message" in data or "session_id" in data:
+            if not data.get("message"):
+                return JSONResponse({"error": "Missing message"}, status_code=400)
+            # SQLite-backed stores block briefly on disk; keep that off the event loop
+            session_id, conversation_history = await asyncio.to_thread(
+                backend.open_session, data.get("session_id"))
+            if conversation_history is None:
+                return JSONResponse({"error": "Unknown or expired session"}, status_code=404)
+            conversation_history.append({"role": "user", "content": data["message"]})
+        else:
+            conversation_history = data.get("conversation_history", [])
+
+        if not conversation_history or conversation_history[-1]["role"] != "user":
+            return JSONResponse({"error": "Invalid conversation history"}, status_code=400)
+
+        try:
+            filters = parse_filters(data.get("filters"))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+    question = conversation_history[-1]["content"]
+    result = {"session_id": session_id} if session_id else {}
+    scope = {"session_id": session_id, "filters": filters}
+
+    if wants_stream(request, data):
+        # The trace ends when the stream does
+        return StreamingResponse(
+            stream_events(conversation_history, question, session_id, trace, trace_token, scope),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        question_embedding, cached_answer = await lookup_cached_answer(conversation_history, question, scope)
+        if cached_answer:
+            await asyncio.to_thread(backend.record_turn, session_id, question, cached_answer)
+            return JSONResponse(dict(result, response=cached_answer))
+
+        context = await get_context_async(question, scope)
+        messages = backend.assemble_messages(conversation_history, question, context)
+        with stage("llm"):
+            response = await upstream.call_async(
+                backend.groq_breaker,
+                lambda timeout: clients["groq"].chat.completions.create(
+                    model=backend.GROQ_MODEL, messages=messages, timeout=timeout),
+                "llm")
+        tracing.record_usage(response.usage)
+        answer = response.choices[0].message.content
+        backend.answer_cache.store(question_embedding, conversation_history, answer,
+                                   response.usage.total_tokens if response.usage else 0)
+        await asyncio.to_thread(backend.record_turn, session_id, question, answer)
+        with stage("serialize"):
+            return JSONResponse(dict(result, response=answer))
+    except upstream.UpstreamError as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        answer, kind = await asyncio.to_thread(backend.degraded_answer, conversation_history, scope)
+        if answer is None:
+            return JSONResponse({"error": "Failed to get AI response"}, status_code=e.status)
+        return JSONResponse(dict(result, response=answer, degraded=kind))
+    except Exception as e:
+        print(f"Error communicating with Groq API: {str(e)}")
+        return JSONResponse({"error": "Failed to get AI response"}, status_code=500)
+
+
+async def upload_job_events(request):
+    job_id = request.path_params["job_id"]
+    if await asyncio.to_thread(backend.upload_jobs.get, job_id) is None:
+        return JSONResponse({"error": "Unknown or expired job"}, status_code=404)
+
+    async def events():
+        # The same events as the Flask route, with the wait between polls on the event loop
+        # instead of in a sleeping worker thread
+        yield ": stream open\n\n"
+        state = {"last": None, "sent": time.monotonic()}
+        while True:
+            text, finished = await asyncio.to_thread(backend.poll_job_events, job_id, state)
+            if text:
+                yield text
+            if finished:
+                return
+            await asyncio.sleep(backend.UPLOAD_JOB_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+cors_chat = CORSMiddleware(
+    request_response(chat),
+    allow_origins=backend.CORS_ORIGINS,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+    allow_credentials=True,
+)
+
+app = Starlette(
+    routes=[
+        Route("/api/chat", cors_chat, methods=["POST", "OPTIONS"]),
+        Route("/api/upload/jobs/{job_id}/events", CORSMiddleware(
+            request_response(upload_job_events), allow_origins=backend.CORS_ORIGINS,
+            allow_methods=["GET"], allow_credentials=True), methods=["GET"]),
+        Mount("/", WSGIMiddleware(backend.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,64 @@
+"""Token-budgeted prompt fitting and document chunking.
+
+    python benchmarks/bench_context_builder.py --turns 100
+
+Fits a long synthetic conversation into the prompt budget and reports the tokens saved and
+the time per fit. Then splits documents that stress the chunker: ordinary paragraphs, one
+paragraph with no line breaks, and words longer than a whole chunk (base64, hashes). Each
+must finish, stay within the chunk size and lose no text.
+"""
+import argparse
+import base64
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_builder import ContextBuilder, count_tokens, split_into_chunks  # noqa: E402
+
+
+def split_with_timeout(text, chunk_tokens, seconds=10):
+    result = []
+    worker = threading.Thread(target=lambda: result.append(split_into_chunks(text, chunk_tokens)), daemon=True)
+    worker.start()
+    worker.join(seconds)
+    assert result, f"split_into_chunks did not finish in {seconds}s"
+    return result[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--chunk-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    builder = ContextBuilder()
+    history = [{"role": "system", "content": "You are a legal assistant."}]
+    started = time.perf_counter()
+    for turn in range(args.turns):
+        history.append({"role": "user", "content": f"Question {turn} about Article {turn + 1}. " * 20})
+        messages, report = builder.fit(history)
+        assert sum(count_tokens(m["content"]) for m in messages) <= builder.budget
+        history.append({"role": "assistant", "content": f"Answer {turn} citing Article {turn + 1}. " * 40})
+    elapsed = time.perf_counter() - started
+    print(f"{args.turns} fits in {elapsed * 1000:.1f}ms; {builder.stats()}")
+
+    documents = {
+        "paragraphs": "\n".join(f"Clause {i}. The tenant shall pay rent monthly." for i in range(500)),
+        "one paragraph": " ".join(f"clause {i} rent" for i in range(3000)),
+        "long token": "A" * 1600,
+        "base64 blob": base64.b64encode(os.urandom(30000)).decode("ascii"),
+        "blob in text": "Signed by the parties.\n" + "f" * 5000 + " hash follows\nEnd of agreement.",
+    }
+    for name, text in documents.items():
+        chunks = split_with_timeout(text, args.chunk_tokens)
+        largest = max(count_tokens(chunk) for chunk in chunks)
+        print(f"{name:<14} {len(text):>7} chars -> {len(chunks):>4} chunks, largest {largest} tokens")
+        assert largest <= args.chunk_tokens, f"{name}: chunk of {largest} tokens"
+        # Chunks only drop the whitespace they were split on
+        assert "".join("".join(chunks).split()) == "".join(text.split()), f"{name}: text lost"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Corpus routing, metadata filters and session uploads, on two small corpora.
+
+    python benchmarks/bench_corpus_routing.py --repeats 200
+
+Seeds a Constitution corpus and a Contract Act corpus and registers both through
+CORPORA_CONFIG. The fake Cloudflare embeds by words, so a question's vector lands near the
+corpus it is about. Checks that questions are routed to the right corpus (by keyword, by
+centroid, or to both and merged), that filters narrow the corpora, and that a follow-up
+question in a session retrieves from the document uploaded to that session and to no
+other. Reports the time to route and search each kind of question.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_services  # noqa: E402
+
+CONSTITUTION = [
+    # Headed like the ingested Constitution, so "Article 12" resolves without a search
+    f"{i}. The President, Parliament and the State legislature shall protect the "
+    f"fundamental rights of every citizen, and the Supreme Court may enforce them by writ {i}."
+    for i in range(1, 41)
+]
+CONTRACT_ACT = [
+    f"Section {i}. When a contract has been broken, the party who suffers losses by the breach "
+    f"is entitled to compensation and damages from the party who broke the promise {i}."
+    for i in range(1, 41)
+]
+CORPORA = [
+    {"name": "constitution", "collection": "constitution_embeddings", "jurisdiction": "IN",
+     "doc_type": "constitution", "date": "1950-01-26",
+     "keywords": ["constitution", "article", "parliament", "fundamental right"], "default": True},
+    {"name": "contract_act", "collection": "contract_act_embeddings", "jurisdiction": "IN",
+     "doc_type": "statute", "date": "1872-04-25", "keywords": ["contract", "breach"]},
+]
+LEASE = "\n".join(
+    f"Clause {i}. The tenant shall pay rent of {i * 100} rupees and keep the premises in repair."
+    for i in range(1, 200)
+) + "\nClause 200. This lease is governed by the law of Gujarat; disputes go to arbitration in Ahmedabad."
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=200, help="timed searches per question")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-corpus-routing-")
+    _, groq = fake_services.stub_environment(workdir, cloudflare_latency=0.0, groq_latency=0.0,
+                                             completion_tokens=5, corpus=CONSTITUTION, word_vectors=True)
+    fake_services.seed_chroma(os.environ["CHROMA_PATH"], CONTRACT_ACT, collection_name="contract_act_embeddings",
+                              embed=fake_services.word_vector)
+    config = os.path.join(workdir, "corpora.json")
+    with open(config, "w") as f:
+        json.dump(CORPORA, f)
+    os.environ.update({"CORPORA_CONFIG": config, "STARTUP_MODE": "eager", "ANSWER_CACHE_SIZE": "0"})
+    import app  # noqa: E402
+
+    retriever = app.retriever.get()
+    origin = {text: "constitution" for text in CONSTITUTION}
+    origin.update({text: "contract_act" for text in CONTRACT_ACT})
+
+    def sources(question, filters=None):
+        routed = [corpus.name for corpus, _ in retriever._route(question, filters, app.get_embedding(question))]
+        found = {origin[text] for text in retriever.retrieve(question, app.get_embedding, filters)}
+        return routed, found
+
+    checks = [
+        # (name, question, filters, corpora routed to, corpora the chunks come from)
+        ("keyword", "What is the remedy for breach of a contract?", None,
+         ["contract_act"], {"contract_act"}),
+        ("article lookup", "What does Article 12 say?", None, ["constitution"], {"constitution"}),
+        ("centroid", "Who pays compensation for losses when a promise is broken?", None,
+         ["contract_act"], {"contract_act"}),
+        ("centroid, default corpus", "Can the Supreme Court enforce rights by writ?", None,
+         ["constitution"], {"constitution"}),
+        ("both corpora", "Can a citizen claim damages from the State when Parliament is in breach?", None,
+         ["constitution", "contract_act"], {"constitution", "contract_act"}),
+        ("filter doc_type", "What is the remedy for breach of a contract?", {"doc_type": "constitution"},
+         ["constitution"], {"constitution"}),
+        ("filter date_to", "Can a citizen claim damages from the State when Parliament is in breach?", {"date_to": "1900"},
+         ["contract_act"], {"contract_act"}),
+        ("filter corpus", "What does Article 12 say?", {"corpus": ["contract_act"]},
+         ["contract_act"], {"contract_act"}),
+        ("filter excludes all", "What is the remedy for breach of a contract?", {"jurisdiction": "UK"}, [], set()),
+    ]
+    for name, question, filters, routed_to, found_in in checks:
+        routed, found = sources(question, filters)
+        timings = []
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            retriever.retrieve(question, app.get_embedding, filters)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{name:<26} -> {','.join(routed) or '-':<25} p50 {statistics.median(timings):6.2f}ms")
+        assert sorted(routed) == sorted(routed_to), f"{name}: routed to {routed}"
+        assert found == found_in, f"{name}: chunks from {found}"
+    stats = retriever.stats()
+    assert stats["fanned_out"] > 0 and stats["filtered_out"] > 0, stats
+    assert retriever.lookup("What does Article 12 say?")[0].startswith("12. "), "Article 12 was not looked up"
+
+    client = app.app.test_client()
+    bad = client.post("/api/chat", json={"message": "Is breach a crime?", "filters": {"court": "SC"}})
+    assert bad.status_code == 400 and "Unknown filter" in bad.get_json()["error"], bad.get_json()
+
+    def follow_up(session_id, question):
+        response = client.post("/api/chat", json={"session_id": session_id, "message": question})
+        assert response.status_code == 200, response.get_json()
+        return "\n".join(m["content"] for m in groq.last_payload["messages"])
+
+    question = "Which law governs disputes under the lease, and where is the arbitration held?"
+    uploader = client.post("/api/chat", json={"message": "I am about to upload my lease."}).get_json()["session_id"]
+    other = client.post("/api/chat", json={"message": "I have a question about my lease."}).get_json()["session_id"]
+    upload = client.post("/api/upload", data={"file": (io.BytesIO(LEASE.encode()), "lease.txt", "text/plain"),
+                                              "session_id": uploader}, content_type="multipart/form-data")
+    assert upload.status_code == 200, upload.get_json()
+    prompt = follow_up(uploader, question)
+    assert "From the user's uploaded document" in prompt and "Gujarat" in prompt, "follow-up missed the upload"
+    # The stored turn is a stub; the follow-up must not carry the whole lease again
+    assert prompt.count("The tenant shall pay rent") < len(LEASE.splitlines()) / 2, \
+        "the whole upload was re-sent with the follow-up"
+    assert "Gujarat" not in follow_up(other, question), "another session's upload leaked"
+    print(f"session follow-up          -> upload excerpts, {app.session_documents.stats()}")
+    print({key: value for key, value in retriever.stats().items() if not key.startswith("bm25")})
+
+
+if __name__ == "__main__":
+    main()
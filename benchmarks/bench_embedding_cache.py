@@ -0,0 +1,124 @@
+"""Measure the embedding cache against a local fake Cloudflare endpoint.
+
+    python benchmarks/bench_embedding_cache.py --requests 500 --latency 0.1
+
+Replays a skewed question mix (a few hot questions, a long tail) through the cache,
+then starts a second "worker" on the same SQLite file to show restart/shared hits. Asserts
+that each distinct question (after case and whitespace normalization) costs exactly one
+upstream call, that the second worker makes none, that the LRU evicts the least recently
+used entry, and that a vector read back from the SQLite tier after reopening is unchanged.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_cache import EmbeddingCache, normalize_text  # noqa: E402
+from benchmarks import fake_services  # noqa: E402
+
+MODEL = "@cf/baai/bge-large-en-v1.5"
+
+
+def make_fetch(base_url):
+    session = requests.Session()
+
+    def fetch(text):
+        response = session.post(f"{base_url}/accounts/test/ai/run/{MODEL}", json={"text": text})
+        return response.json()["result"]["data"][0]
+    return fetch
+
+
+def workload(n, distinct, seed=7):
+    rng = random.Random(seed)
+    questions = [f"What does Article {i} of the Constitution say?" for i in range(1, distinct + 1)]
+    # Zipf-like: traffic is dominated by a handful of questions
+    weights = [1 / rank for rank in range(1, distinct + 1)]
+    picks = rng.choices(questions, weights=weights, k=n)
+    # Casing/whitespace variants should still hit
+    return [q.upper() if rng.random() < 0.1 else f"  {q} " if rng.random() < 0.1 else q for q in picks]
+
+
+def run(cache, fetch, questions):
+    latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        cache.get_or_compute(MODEL, question, fetch)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def report(label, latencies, cache, server):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label}: p50={statistics.median(ordered):.2f}ms p95={p95:.2f}ms "
+          f"upstream_calls={server.calls} stats={cache.stats()}")
+
+
+def check_lru_and_reopen(tmp):
+    cache = EmbeddingCache(max_entries=2)
+    cache.put(MODEL, "a", [1.0])
+    cache.put(MODEL, "b", [2.0])
+    assert cache.get(MODEL, "  A ") == [1.0], "normalized text missed"
+    cache.put(MODEL, "c", [3.0])
+    assert cache.get(MODEL, "b") is None, "the least recently used entry was not evicted"
+    assert cache.get(MODEL, "a") == [1.0] and cache.get(MODEL, "c") == [3.0]
+    assert cache.get("another-model", "a") is None, "entries leaked across models"
+    stats = cache.stats()
+    assert (stats["evictions"], stats["hits"], stats["misses"]) == (1, 3, 2), stats
+
+    path = os.path.join(tmp, "reopen.sqlite3")
+    vector = [0.5, -1.25, 3.0]
+    EmbeddingCache(max_entries=8, path=path).put(MODEL, "persisted", vector)
+    reopened = EmbeddingCache(max_entries=8, path=path)
+    assert reopened.get(MODEL, "persisted") == vector, "the SQLite tier lost the vector on reopen"
+    assert reopened.get(MODEL, "persisted") == vector
+    stats = reopened.stats()
+    assert (stats["disk_hits"], stats["hits"], stats["misses"]) == (1, 1, 0), stats
+    print("LRU eviction and SQLite reopen: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=100)
+    parser.add_argument("--lru-size", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake endpoint latency in seconds")
+    args = parser.parse_args()
+
+    server = fake_services.start_cloudflare(latency=args.latency)
+    fetch = make_fetch(server.base_url)
+    questions = workload(args.requests, args.distinct)
+
+    distinct = len({normalize_text(question) for question in questions})
+
+    uncached = EmbeddingCache(max_entries=0)
+    report("no cache (first 50)", run(uncached, fetch, questions[:50]), uncached, server)
+    assert server.calls == 50, "a zero-size cache without a disk tier still answered"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embeddings.sqlite3")
+        server.calls = 0
+        first = EmbeddingCache(max_entries=args.lru_size, path=path)
+        report("worker 1 (cold)", run(first, fetch, questions), first, server)
+        stats = first.stats()
+        assert server.calls == stats["misses"] == distinct, f"{server.calls} calls for {distinct} distinct questions"
+        assert stats["hits"] + stats["disk_hits"] == len(questions) - distinct, stats
+
+        server.calls = 0
+        second = EmbeddingCache(max_entries=args.lru_size, path=path)
+        report("worker 2 (shared disk tier)", run(second, fetch, questions), second, server)
+        assert server.calls == 0 and second.stats()["misses"] == 0, "the shared disk tier missed"
+
+        check_lru_and_reopen(tmp)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
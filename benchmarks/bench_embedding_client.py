@@ -0,0 +1,115 @@
+"""Measure embeddings/sec and tail latency of the coalescing embedding client.
+
+    python benchmarks/bench_embedding_client.py --callers 64 --per-caller 20
+
+Runs against the fake Cloudflare endpoint in its own process. "per-text" is the old
+fetch_embedding: one un-pooled requests.post per text. "coalesced" is EmbeddingClient.embed
+from the same caller threads. The bulk rows compare ingestion's old serial 50-text batches
+with embed_many, and the last row repeats the bulk run with every 5th call rate-limited.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import fake_services  # noqa: E402
+from embedding_client import EmbeddingClient  # noqa: E402
+
+MODEL = "@cf/baai/bge-large-en-v1.5"
+
+
+def old_fetch(base_url, texts):
+    response = requests.post(f"{base_url}/accounts/benchmark/ai/run/{MODEL}",
+                             headers={"Authorization": "Bearer benchmark"}, json={"text": texts})
+    return response.json()["result"]["data"]
+
+
+def run_callers(callers, per_caller, embed):
+    latencies = []
+    lock = threading.Lock()
+
+    def caller(worker):
+        mine = []
+        for i in range(per_caller):
+            started = time.perf_counter()
+            embed(f"caller {worker} question {i} about Article {i + worker}")
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=caller, args=(w,)) for w in range(callers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def report(name, elapsed, count, latencies=None, calls=None):
+    line = f"{name:<22} {count / elapsed:8.0f} emb/s"
+    if latencies:
+        line += (f"  p50={statistics.median(latencies) * 1000:7.1f}ms"
+                 f"  p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f}ms"
+                 f"  p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms")
+    if calls is not None:
+        line += f"  api calls={calls}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=64)
+    parser.add_argument("--per-caller", type=int, default=20)
+    parser.add_argument("--bulk", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.03, help="fixed seconds per API call")
+    parser.add_argument("--item-latency", type=float, default=0.0005, help="extra seconds per text")
+    args = parser.parse_args()
+
+    server = fake_services.start_cloudflare(latency=args.latency, item_latency=args.item_latency, isolated=True)
+    limited = fake_services.start_cloudflare(latency=args.latency, item_latency=args.item_latency,
+                                             isolated=True, rate_limit_every=5)
+    try:
+        total = args.callers * args.per_caller
+        print(f"{args.callers} callers x {args.per_caller} texts; {args.latency * 1000:.0f}ms per call "
+              f"+ {args.item_latency * 1000:.1f}ms per text")
+
+        elapsed, latencies = run_callers(args.callers, args.per_caller, lambda t: old_fetch(server.base_url, t))
+        report("online per-text", elapsed, total, latencies, calls=total)
+
+        client = EmbeddingClient(MODEL, api_base=server.base_url, account_id="benchmark", api_token="benchmark")
+        elapsed, latencies = run_callers(args.callers, args.per_caller, client.embed)
+        stats = client.stats()
+        report("online coalesced", elapsed, total, latencies, calls=stats["api_calls"])
+        print(f"{'':<22} mean batch size {stats['mean_batch_size']}")
+
+        texts = [f"Chunk {i} of the Constitution text" for i in range(args.bulk)]
+        started = time.perf_counter()
+        for i in range(0, len(texts), 50):
+            old_fetch(server.base_url, texts[i:i + 50])
+        report("bulk serial batches", time.perf_counter() - started, len(texts), calls=-(-len(texts) // 50))
+
+        client = EmbeddingClient(MODEL, api_base=server.base_url, account_id="benchmark", api_token="benchmark")
+        started = time.perf_counter()
+        client.embed_many(texts)
+        report("bulk embed_many", time.perf_counter() - started, len(texts), calls=client.stats()["api_calls"])
+
+        client = EmbeddingClient(MODEL, api_base=limited.base_url, account_id="benchmark", api_token="benchmark")
+        started = time.perf_counter()
+        vectors = client.embed_many(texts)
+        assert len(vectors) == len(texts)
+        stats = client.stats()
+        report("bulk with 429s", time.perf_counter() - started, len(texts), calls=stats["api_calls"])
+        print(f"{'':<22} retries={stats['retries']} errors={stats['errors']}")
+    finally:
+        server.shutdown()
+        limited.shutdown()
+
+
+if __name__ == "__main__":
+    main()
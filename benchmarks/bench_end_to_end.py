@@ -0,0 +1,319 @@
+"""End-to-end latency, throughput and memory of /api/chat and /api/upload.
+
+    python benchmarks/bench_end_to_end.py --concurrency 1,8,32 --requests 64
+    python benchmarks/bench_end_to_end.py --output new.json --compare baseline.json
+
+Each server (the Flask app, as one single-threaded gunicorn sync worker would run it, and
+the ASGI app as one uvicorn worker) runs in its own process. Both talk to the fake Groq and
+Cloudflare services, with latency and token rates set on the command line, and to a
+throwaway Chroma store seeded from Worker_AI_RAG/embedding_results.json plus synthetic
+article chunks. Every request asks a distinct question, so the caches do not hide the
+upstream calls. upload-async submits with async=1 and polls the job until it finishes, so
+its latency includes time spent queued behind UPLOAD_JOB_WORKERS.
+
+For each server, scenario and concurrency level the suite reports:
+- throughput;
+- p50/p95/p99 latency (and time to first token when streaming);
+- the worker's resident and peak memory.
+
+Every request must succeed with a non-empty answer. Results are written as JSON, then
+compared with the newest earlier run in the same directory that used the same load settings
+(or with --compare FILE); the script exits non-zero when any request failed, or when p95
+latency or throughput is worse than that run by more than --max-regression, so CI can gate on
+it. --no-compare skips the comparison.
+"""
+import argparse
+import asyncio
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks import fake_services  # noqa: E402
+from benchmarks.load_test import _serve_asgi, _serve_flask, serve  # noqa: E402
+
+SERVERS = {"flask": _serve_flask, "asgi": _serve_asgi}
+SCENARIOS = ["chat", "chat-stream", "upload", "upload-async"]
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * fraction)) - 1))]
+
+
+def worker_memory(pid):
+    """(resident MB, peak resident MB) of a server process, from /proc on Linux"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields[key] = value.strip()
+    except OSError:
+        return None, None
+    to_mb = lambda field: round(int(fields[field].split()[0]) / 1024, 1) if field in fields else None
+    return to_mb("VmRSS"), to_mb("VmHWM")
+
+
+def question(scenario, i):
+    # Alternate questions that name an article (direct lookup) with free-text ones (hybrid search)
+    if i % 2:
+        return f"[{scenario} {i}] What does Article {i % 500 + 1} say about Parliament?"
+    return f"[{scenario} {i}] Which provisions protect the freedom of a citizen against the State?"
+
+
+def contract_docx(paragraphs):
+    import docx
+
+    document = docx.Document()
+    for i in range(paragraphs):
+        document.add_paragraph(f"Clause {i + 1}. The tenant shall pay rent monthly and keep the premises in repair. "
+                               "Either party may terminate this agreement with thirty days written notice.")
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+async def request_once(client, base_url, scenario, i, upload):
+    """Returns (latency, time to first token or None, ok); ok needs a 2xx and a non-empty answer"""
+    started = time.perf_counter()
+    if scenario == "upload":
+        history = [{"role": "user", "content": question(scenario, i)}]
+        response = await client.post(
+            f"{base_url}/api/upload",
+            files={"file": (f"contract-{i}.docx", upload, DOCX_TYPE)},
+            data={"conversation_history": json.dumps(history)},
+        )
+        ok = response.status_code == 200 and bool(response.json().get("ai_response", "").strip())
+        return time.perf_counter() - started, None, ok
+
+    if scenario == "upload-async":
+        # Latency runs until the background job finishes, polled the way a client would
+        history = [{"role": "user", "content": question(scenario, i)}]
+        response = await client.post(
+            f"{base_url}/api/upload",
+            files={"file": (f"contract-{i}.docx", upload, DOCX_TYPE)},
+            data={"conversation_history": json.dumps(history), "async": "1"},
+        )
+        if response.status_code != 202:
+            return time.perf_counter() - started, None, False
+        status_url = base_url + response.json()["status_url"]
+        while True:
+            job = (await client.get(status_url)).json()
+            if job.get("status") in ("done", "failed", None):
+                ok = job.get("status") == "done" and bool(job["result"].get("ai_response", "").strip())
+                return time.perf_counter() - started, None, ok
+            await asyncio.sleep(0.05)
+
+    history = [{"role": "user", "content": question(scenario, i)}]
+    if scenario == "chat":
+        response = await client.post(f"{base_url}/api/chat", json={"conversation_history": history})
+        ok = response.status_code == 200 and bool(response.json().get("response", "").strip())
+        return time.perf_counter() - started, None, ok
+
+    first_token = None
+    ok = False
+    event = None
+    async with client.stream("POST", f"{base_url}/api/chat",
+                             json={"conversation_history": history, "stream": True}) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+            elif line.startswith("data: ") and event == "done":
+                answer = json.loads(line[len("data: "):]).get("response", "")
+                ok = response.status_code == 200 and bool(answer.strip())
+    return time.perf_counter() - started, first_token, ok
+
+
+async def drive(base_url, scenario, total, concurrency, upload):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_tokens = [], []
+    errors = 0
+
+    async def one(client, i):
+        nonlocal errors
+        async with semaphore:
+            try:
+                latency, first_token, ok = await request_once(client, base_url, scenario, i, upload)
+            except httpx.HTTPError:
+                errors += 1
+                return
+        latencies.append(latency)
+        if first_token is not None:
+            first_tokens.append(first_token)
+        errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    first_tokens.sort()
+    ms = lambda seconds: round(seconds * 1000, 1) if seconds is not None else None
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "first_token_p50_ms": ms(percentile(first_tokens, 0.50)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Arguments that change the load itself; runs are only compared when these match
+LOAD_ARGUMENTS = ["requests", "seed_chunks", "cloudflare_latency", "groq_latency", "tokens_per_second",
+                  "completion_tokens", "upload_paragraphs"]
+
+
+def previous_results(output, args):
+    """The newest earlier results file next to `output` that was run under the same load"""
+    candidates = [path for path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(output)), "*.json"))
+                  if os.path.abspath(path) != os.path.abspath(output)]
+    for path in sorted(candidates, key=os.path.getmtime, reverse=True):
+        try:
+            with open(path) as f:
+                arguments = json.load(f)["meta"]["arguments"]
+        except (OSError, ValueError, KeyError):
+            continue
+        if all(arguments.get(name) == getattr(args, name) for name in LOAD_ARGUMENTS):
+            return path
+    return None
+
+
+def compare(results, baseline_path, max_regression):
+    """Print the change against a previous run; returns the regressions found"""
+    with open(baseline_path) as f:
+        baseline = {(r["server"], r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\ncompared with {baseline_path}:")
+    for result in results:
+        key = (result["server"], result["scenario"], result["concurrency"])
+        old = baseline.get(key)
+        if not old:
+            continue
+        p95_change = result["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        throughput_change = result["throughput_rps"] / old["throughput_rps"] - 1 if old["throughput_rps"] else 0.0
+        print(f"  {'/'.join(map(str, key)):<24} p95 {p95_change:+7.1%}  throughput {throughput_change:+7.1%}")
+        if p95_change > max_regression or throughput_change < -max_regression:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", default="flask,asgi", help="comma-separated: flask, asgi")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="requests per scenario and concurrency level")
+    parser.add_argument("--seed-chunks", type=int, default=1500, help="synthetic chunks in the Chroma store")
+    parser.add_argument("--cloudflare-latency", type=float, default=0.08)
+    parser.add_argument("--groq-latency", type=float, default=0.4, help="seconds to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--upload-paragraphs", type=int, default=200, help="size of the uploaded .docx")
+    parser.add_argument("--output", default=os.path.join(
+        ROOT, "benchmarks", "results", f"e2e-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"))
+    parser.add_argument("--compare", help="previous results JSON to compare against "
+                                          "(default: the newest run with the same load in the output directory)")
+    parser.add_argument("--no-compare", action="store_true", help="skip the comparison with a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed fractional p95/throughput regression against the previous run")
+    args = parser.parse_args()
+
+    servers = args.servers.split(",")
+    scenarios = args.scenarios.split(",")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    upload = contract_docx(args.upload_paragraphs)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        upstreams = fake_services.stub_environment(
+            tmp, cloudflare_latency=args.cloudflare_latency, groq_latency=args.groq_latency,
+            tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens,
+            isolated=True, seed_chunks=args.seed_chunks)
+        # Keep the runs comparable: no answer cache hits, no warm-up racing the first requests
+        os.environ.update({"ANSWER_CACHE_SIZE": "0", "STARTUP_MODE": "eager"})
+        try:
+            for server in servers:
+                process, base_url = serve(SERVERS[server])
+                idle_rss, _ = worker_memory(process.pid)
+                try:
+                    for scenario in scenarios:
+                        for concurrency in levels:
+                            result = asyncio.run(drive(base_url, scenario, args.requests, concurrency, upload))
+                            rss, peak = worker_memory(process.pid)
+                            result.update(server=server, scenario=scenario, concurrency=concurrency,
+                                          idle_rss_mb=idle_rss, rss_mb=rss, peak_rss_mb=peak)
+                            results.append(result)
+                            first_token = (f"  ttft={result['first_token_p50_ms']:6.0f}ms"
+                                           if result["first_token_p50_ms"] is not None else "")
+                            print(f"{server:<6} {scenario:<12} c={concurrency:<3} {result['throughput_rps']:7.1f} req/s"
+                                  f"  p50={result['p50_ms']:7.0f}ms  p95={result['p95_ms']:7.0f}ms"
+                                  f"  p99={result['p99_ms']:7.0f}ms{first_token}  rss={rss}MB"
+                                  f"  errors={result['errors']}")
+                finally:
+                    process.terminate()
+                    process.join()
+        finally:
+            for upstream in upstreams:
+                upstream.shutdown()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "arguments": vars(args),
+            },
+            "results": results,
+        }, f, indent=2)
+    print(f"results written to {args.output}")
+
+    failed = [result for result in results if result["errors"]]
+    for result in failed:
+        print(f"{result['server']}/{result['scenario']}/{result['concurrency']}: "
+              f"{result['errors']} request(s) failed or returned an empty answer")
+
+    regressions = []
+    if not args.no_compare:
+        baseline = args.compare or previous_results(args.output, args)
+        if baseline:
+            regressions = compare(results, baseline, args.max_regression)
+            if regressions:
+                print(f"{len(regressions)} regression(s) beyond {args.max_regression:.0%}")
+        else:
+            print("no earlier run with the same load to compare against")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Compare upload text extraction before and after document_extraction.py.
+
+    python benchmarks/bench_extraction.py --pages 200 400 --repeat 3
+
+Generates multi-hundred-page PDFs and DOCX files in memory. The "legacy" column is the
+old app.py path: save to a temp file, walk pages serially, build the result with +=.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import docx
+import PyPDF2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import document_extraction  # noqa: E402
+
+LINES_PER_PAGE = 45
+SENTENCE = "The Licensee shall indemnify the Licensor against all claims arising under clause {}."
+
+
+def make_pdf(pages):
+    """Minimal multi-page PDF with Helvetica text, written by hand to avoid a writer dependency"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [SENTENCE.format(f"{page + 1}.{line + 1}") for line in range(LINES_PER_PAGE)]
+        text = "".join(f"({line}) Tj T* " for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 40 800 Td {text}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def make_docx(pages):
+    document = docx.Document()
+    for page in range(pages):
+        for line in range(LINES_PER_PAGE):
+            document.add_paragraph(SENTENCE.format(f"{page + 1}.{line + 1}"))
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def legacy_extract(data, file_type):
+    # The pre-change app.py path, kept here as the baseline
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        tmp.write(data)
+    try:
+        if file_type == document_extraction.PDF_TYPE:
+            with open(tmp.name, "rb") as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                text = ""
+                for page in pdf_reader.pages:
+                    text += page.extract_text()
+            return text
+        doc = docx.Document(tmp.name)
+        text = ""
+        for para in doc.paragraphs:
+            text += para.text + "\n"
+        return text
+    finally:
+        os.remove(tmp.name)
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 300, 500])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Pay the process-pool start-up once, as a long-lived worker would
+    document_extraction.extract_pdf(make_pdf(document_extraction.PARALLEL_MIN_PAGES))
+    print(f"workers={document_extraction.EXTRACTION_WORKERS}")
+
+    for pages in args.pages:
+        for label, file_type, data in (
+            ("pdf", document_extraction.PDF_TYPE, make_pdf(pages)),
+            ("docx", document_extraction.DOCX_TYPE, make_docx(pages)),
+        ):
+            legacy_best, _, legacy_text = best_of(args.repeat, lambda: legacy_extract(data, file_type))
+            new_best, _, new_text = best_of(
+                args.repeat, lambda: document_extraction.extract_text(io.BytesIO(data), file_type))
+            assert new_text == legacy_text, f"{label} output differs from the legacy extractor"
+            print(f"{label:<4} {pages:>4} pages {len(data) / 1e6:6.1f} MB  legacy={legacy_best * 1000:8.1f}ms  "
+                  f"new={new_best * 1000:8.1f}ms  speedup={legacy_best / new_best:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
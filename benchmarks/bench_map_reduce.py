@@ -0,0 +1,111 @@
+"""Map-reduce document analysis against one call with the whole document, on a stub LLM.
+
+    python benchmarks/bench_map_reduce.py --paragraphs 2000 --concurrency 4
+
+The stub answers after a latency modelled on Groq's: a fixed overhead, prompt tokens at
+--prefill-rate and completion tokens at --decode-rate (per second). A prompt over
+--context-window tokens fails, as the real API would. Reports wall time and total tokens
+for the single call, the map-reduce analysis with a cold chunk cache and the same upload
+again (every chunk cached), and checks the concurrency limit and the cache.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from context_builder import count_tokens  # noqa: E402
+from document_analysis import ChunkNoteCache, MapReduceAnalyzer  # noqa: E402
+from prompt_utils import with_system_prompt  # noqa: E402
+
+
+class StubLLM:
+    def __init__(self, overhead, prefill_rate, decode_rate, completion_tokens, context_window):
+        self.overhead = overhead
+        self.prefill_rate = prefill_rate
+        self.decode_rate = decode_rate
+        self.completion_tokens = completion_tokens
+        self.context_window = context_window
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def complete(self, messages, max_tokens=None):
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        if prompt_tokens > self.context_window:
+            raise ValueError(f"prompt of {prompt_tokens} tokens exceeds the {self.context_window}-token context")
+        completion = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.overhead + prompt_tokens / self.prefill_rate + completion / self.decode_rate)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        return " ".join(["note"] * completion), prompt_tokens + completion
+
+
+def contract(paragraphs):
+    return "\n".join(
+        f"Clause {i + 1}. The supplier shall deliver the goods listed in Schedule {i % 7 + 1} within "
+        f"{(i % 9 + 1) * 5} days of each purchase order; late delivery accrues liquidated damages of "
+        f"{(i % 4 + 1) / 2}% of the order value per week, capped at ten percent."
+        for i in range(paragraphs)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, default=2000, help="clauses in the synthetic contract")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunk-tokens", type=int, default=3000)
+    parser.add_argument("--overhead", type=float, default=0.2, help="seconds per call")
+    parser.add_argument("--prefill-rate", type=float, default=20000, help="prompt tokens per second")
+    parser.add_argument("--decode-rate", type=float, default=250, help="completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=600)
+    parser.add_argument("--context-window", type=int, default=128000)
+    args = parser.parse_args()
+
+    text = contract(args.paragraphs)
+    question = "What are the supplier's delivery obligations and the penalties for delay?"
+    print(f"document: {count_tokens(text)} tokens, {args.paragraphs} clauses")
+    stub = lambda: StubLLM(args.overhead, args.prefill_rate, args.decode_rate,
+                           args.completion_tokens, args.context_window)
+
+    single = stub()
+    started = time.perf_counter()
+    try:
+        _, single_tokens = single.complete(with_system_prompt([{"role": "user", "content": text + "\n\n" + question}]))
+        single_seconds = time.perf_counter() - started
+        print(f"single call      {single_seconds:6.2f}s  {single_tokens:7d} tokens")
+    except ValueError as e:
+        single_seconds = single_tokens = None
+        print(f"single call      fails: {e}")
+
+    llm = stub()
+    analyzer = MapReduceAnalyzer(llm.complete, "stub", ChunkNoteCache(), chunk_tokens=args.chunk_tokens,
+                                 concurrency=args.concurrency)
+    runs = {}
+    for name in ("map-reduce cold", "map-reduce warm"):
+        calls_before = llm.calls
+        started = time.perf_counter()
+        report = analyzer.analyze(text, question)
+        runs[name] = report
+        seconds = time.perf_counter() - started
+        speedup = f"  {single_seconds / seconds:5.1f}x vs single" if single_seconds else ""
+        cost = f"  {report['tokens'] / single_tokens:5.2f}x tokens" if single_tokens else ""
+        print(f"{name:<16} {seconds:6.2f}s  {report['tokens']:7d} tokens  {llm.calls - calls_before:3d} calls  "
+              f"{report['cached_chunks']}/{report['chunks']} chunks cached{speedup}{cost}")
+
+    assert llm.max_in_flight <= args.concurrency, f"{llm.max_in_flight} calls in flight, limit {args.concurrency}"
+    assert runs["map-reduce warm"]["cached_chunks"] == runs["map-reduce warm"]["chunks"], "re-upload missed the cache"
+    print(f"max calls in flight: {llm.max_in_flight} (limit {args.concurrency})")
+
+
+if __name__ == "__main__":
+    main()
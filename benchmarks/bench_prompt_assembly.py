@@ -0,0 +1,81 @@
+"""Check that the system prompt stays byte-identical across turns, and compare its size with
+the old injection path.
+
+    python benchmarks/bench_prompt_assembly.py --turns 50
+
+The "legacy" column replays the pre-change app.py: add_formatting_prompt appended to any
+system message in the history, then fetch_ai_response prepended another usecase_prompt().
+A client that echoes the history back (as the API allows) grows the prompt every turn.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompt_utils import SYSTEM_PROMPT, usecase_prompt, with_system_prompt  # noqa: E402
+
+LEGACY_SUFFIX = (
+    "\n\nPlease ensure your response preserves formatting like spacing, indentation, and structure, "
+    "especially for content like emails, code, or formal documents. Use proper paragraph breaks "
+    "and maintain the intended layout."
+)
+
+
+def legacy_messages(conversation_history):
+    # Mutates the history in place, exactly as chat() did
+    for msg in reversed(conversation_history):
+        if msg["role"] == "system":
+            msg["content"] += LEGACY_SUFFIX
+            break
+    else:
+        conversation_history.insert(0, {"role": "system", "content": usecase_prompt() + LEGACY_SUFFIX})
+    return [{"role": "system", "content": usecase_prompt()}] + conversation_history
+
+
+def system_prefix(messages):
+    return "".join(m["content"] for m in messages if m["role"] == "system")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+
+    legacy_history, history = [], []
+    legacy_total = new_total = 0
+    first_prefix = None
+    started = time.perf_counter()
+    for turn in range(args.turns):
+        question = {"role": "user", "content": f"Question {turn} about Article {turn + 1}?"}
+        legacy_history.append(dict(question))
+        history.append(dict(question))
+
+        legacy_prefix = system_prefix(legacy_messages(legacy_history))
+        messages = with_system_prompt(history)
+        prefix = system_prefix(messages)
+
+        # Stable prefix: same bytes on every turn, and injection is idempotent
+        first_prefix = first_prefix or prefix
+        assert prefix == first_prefix == SYSTEM_PROMPT, f"system prompt changed on turn {turn}"
+        assert with_system_prompt(messages) == messages, "injection is not idempotent"
+        assert messages[0]["role"] == "system" and sum(m["role"] == "system" for m in messages) == 1
+
+        legacy_total += len(legacy_prefix)
+        new_total += len(prefix)
+        if turn in (0, args.turns // 2, args.turns - 1):
+            print(f"turn {turn + 1:>4}  legacy system chars={len(legacy_prefix):>8}  new={len(prefix):>6}")
+
+        answer = {"role": "assistant", "content": f"Answer {turn}."}
+        legacy_history.append(dict(answer))
+        history.append(dict(answer))
+        # The new path must leave the caller's history alone
+        assert all(m["role"] != "system" for m in history)
+
+    elapsed = time.perf_counter() - started
+    print(f"{args.turns} turns: legacy sent {legacy_total:,} system chars, new sent {new_total:,} "
+          f"({legacy_total / new_total:.1f}x less); {elapsed * 1000:.1f}ms total")
+
+
+if __name__ == "__main__":
+    main()
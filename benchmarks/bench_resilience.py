@@ -0,0 +1,207 @@
+"""Upstream failure handling against fault-injecting fakes of Groq and Cloudflare.
+
+    python benchmarks/bench_resilience.py
+
+Drives /api/chat through Flask's test client while the fakes fail, stall or straggle, and
+checks that each fault is absorbed the way upstream.py intends: transient 5xx retried,
+a hung Groq answered with a retrieval-only fallback inside the request budget, the breaker
+opening so later chats fail fast, then closing once Groq recovers, a stalled Cloudflare
+falling back to BM25 within the embed stage, and hedged embedding calls cutting the tail.
+Errors that are not the upstream's must still answer with a JSON body. Last, a half-open
+breaker must not stay stuck when its probe never reports back: the budget spent before the
+call, the call cancelled, or the caller gone.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_services  # noqa: E402
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=3.0, help="REQUEST_BUDGET_SECONDS")
+    parser.add_argument("--llm-timeout", type=float, default=1.5, help="LLM_STAGE_TIMEOUT")
+    parser.add_argument("--embed-timeout", type=float, default=1.0, help="EMBED_STAGE_TIMEOUT")
+    parser.add_argument("--hedge-ms", type=float, default=100)
+    parser.add_argument("--embeds", type=int, default=200, help="calls per hedging run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-resilience-")
+    cloudflare, groq = fake_services.stub_environment(workdir, cloudflare_latency=0.02, groq_latency=0.05,
+                                                      completion_tokens=20)
+    os.environ.update({
+        "REQUEST_BUDGET_SECONDS": str(args.budget),
+        "LLM_STAGE_TIMEOUT": str(args.llm_timeout),
+        "EMBED_STAGE_TIMEOUT": str(args.embed_timeout),
+        "UPSTREAM_RETRIES": "2",
+        "BREAKER_FAILURES": "3",
+        "BREAKER_RESET_SECONDS": "1",
+        "STARTUP_MODE": "eager",
+    })
+    import app  # noqa: E402
+    from embedding_client import EmbeddingClient, EmbeddingError  # noqa: E402
+    import upstream  # noqa: E402
+    from upstream import CircuitBreaker  # noqa: E402
+
+    client = app.app.test_client()
+    asked = iter(range(10 ** 6))
+
+    def chat(stream=False):
+        # A new question each time, so neither cache answers it
+        question = f"What does Article {next(asked)} of the Constitution say about elections?"
+        started = time.perf_counter()
+        response = client.post("/api/chat", json={
+            "conversation_history": [{"role": "user", "content": question}], "stream": stream})
+        body = response.get_data(as_text=True)
+        seconds = time.perf_counter() - started
+        if stream:
+            done = [json.loads(line[6:]) for line in body.splitlines() if line.startswith("data: ")][-1]
+            return response.status_code, done, seconds
+        return response.status_code, json.loads(body), seconds
+
+    def report(name, status, body, seconds, calls_before):
+        kind = body.get("degraded") or ("error" if "error" in body else "answered")
+        print(f"{name:<26} {status}  {kind:<15} {seconds:6.2f}s  {groq.calls - calls_before} Groq calls  "
+              f"breaker {app.groq_breaker.state}")
+
+    before = groq.calls
+    status, body, seconds = chat()
+    report("healthy", status, body, seconds, before)
+    assert status == 200 and "degraded" not in body
+
+    groq.options["fail_next"] = 2
+    before = groq.calls
+    status, body, seconds = chat()
+    report("two 503s, then healthy", status, body, seconds, before)
+    assert status == 200 and "degraded" not in body, "transient 5xx were not retried"
+    assert groq.calls - before == 3
+
+    groq.options["hang_seconds"] = 30
+    before = groq.calls
+    status, body, seconds = chat()
+    report("Groq hangs", status, body, seconds, before)
+    assert status == 200 and body.get("degraded") == "retrieval-only", body
+    assert seconds < args.budget + 0.5, f"fallback took {seconds:.2f}s, budget {args.budget}s"
+
+    before = groq.calls
+    status, body, seconds = chat()
+    report("Groq hangs, again", status, body, seconds, before)
+    assert app.groq_breaker.state == "open", "breaker did not open"
+
+    before = groq.calls
+    status, body, seconds = chat()
+    report("breaker open", status, body, seconds, before)
+    assert body.get("degraded") == "retrieval-only" and groq.calls == before
+    assert seconds < 0.5, f"open breaker still took {seconds:.2f}s"
+
+    before = groq.calls
+    status, done, seconds = chat(stream=True)
+    report("breaker open, streamed", status, done, seconds, before)
+    assert done.get("degraded") == "retrieval-only" and groq.calls == before
+
+    groq.options["hang_seconds"] = 0
+    time.sleep(app.groq_breaker.reset_after)
+    before = groq.calls
+    status, body, seconds = chat()
+    report("Groq back, probe", status, body, seconds, before)
+    assert status == 200 and "degraded" not in body and app.groq_breaker.state == "closed"
+
+    cloudflare.options["hang_seconds"] = 5
+    before = groq.calls
+    status, body, seconds = chat()
+    report("Cloudflare hangs", status, body, seconds, before)
+    assert status == 200 and "degraded" not in body
+    assert seconds < args.embed_timeout + 1.0, f"embedding stall took {seconds:.2f}s"
+    cloudflare.options["hang_seconds"] = 0
+    print(f"Groq breaker: {app.groq_breaker.stats()}")
+
+    # Errors that are not the upstream's still answer with the JSON body the frontend reads
+    response = client.post("/api/chat", json={"conversation_history": [{"role": "user", "content": ["not text"]}]})
+    print(f"{'non-upstream error':<26} {response.status_code}  {response.content_type}")
+    assert response.status_code == 500 and response.is_json and "error" in response.get_json()
+
+    # Embedding breaker: a failing Cloudflare is left alone after three failed batches
+    cloudflare.options["error_rate"] = 1.0
+    breaking = EmbeddingClient(api_base=cloudflare.base_url, max_retries=0,
+                               breaker=CircuitBreaker("embeddings", failures=3, reset_after=60))
+    calls_before = cloudflare.calls
+    failures = 0
+    for i in range(10):
+        try:
+            breaking.embed(f"breaker probe {i}")
+        except EmbeddingError:
+            failures += 1
+    cloudflare.options["error_rate"] = 0.0
+    print(f"embedding breaker          {failures}/10 failed, {cloudflare.calls - calls_before} Cloudflare calls, "
+          f"breaker {breaking.breaker.state}")
+    assert failures == 10 and cloudflare.calls - calls_before == 3 and breaking.breaker.state == "open"
+
+    # Hedging: one call in ten straggles for half a second
+    cloudflare.options.update(slow_rate=0.1, slow_seconds=0.5)
+    results = {}
+    for name, hedge in (("unhedged", 0.0), ("hedged", args.hedge_ms / 1000)):
+        embedder = EmbeddingClient(api_base=cloudflare.base_url, hedge_delay=hedge)
+        calls_before = cloudflare.calls
+        latencies = []
+        for i in range(args.embeds):
+            started = time.perf_counter()
+            embedder.embed(f"{name} hedging sample {i}")
+            latencies.append(time.perf_counter() - started)
+        results[name] = latencies
+        print(f"embed {name:<20} p50 {percentile(latencies, 0.5) * 1000:6.1f}ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:6.1f}ms  p99 {percentile(latencies, 0.99) * 1000:6.1f}ms  "
+              f"{cloudflare.calls - calls_before} calls for {args.embeds} texts")
+    cloudflare.options["slow_rate"] = 0.0
+    assert percentile(results["hedged"], 0.95) < 0.5 * percentile(results["unhedged"], 0.95), \
+        "hedging did not cut the p95"
+
+    # Half-open probes that never report back
+    breaker = CircuitBreaker("probe", failures=1, reset_after=0.2)
+
+    def reopen():
+        breaker.record_failure()
+        time.sleep(breaker.reset_after)
+
+    reopen()
+    token = upstream.start_budget(0)
+    try:
+        upstream.call(breaker, lambda timeout: "unreachable", "llm")
+    except upstream.DeadlineExceeded:
+        pass
+    upstream.end_budget(token)
+    assert upstream.call(breaker, lambda timeout: "ok", "llm") == "ok" and breaker.state == "closed", \
+        "a spent budget took the probe slot"
+
+    async def cancelled(timeout):
+        raise asyncio.CancelledError()
+
+    reopen()
+    try:
+        asyncio.run(upstream.call_async(breaker, cancelled, "llm"))
+    except asyncio.CancelledError:
+        pass
+    assert upstream.call(breaker, lambda timeout: "ok", "llm") == "ok", "a cancelled probe kept the breaker half-open"
+
+    reopen()
+    assert breaker.allow() and breaker.state == "half-open"  # the caller never reports back
+    assert not breaker.allow()
+    time.sleep(breaker.reset_after)
+    assert upstream.call(breaker, lambda timeout: "ok", "llm") == "ok", "a lost probe kept the breaker half-open"
+    print(f"half-open probe recovery   ok; {breaker.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Compare recall and latency of dense-only retrieval with the hybrid retriever.
+
+    python benchmarks/bench_retrieval.py                 # local stand-in embeddings
+    python benchmarks/bench_retrieval.py --cloudflare    # real bge-large-en-v1.5 (needs .env)
+
+Chunks the Constitution PDF with Worker_AI_RAG/chroma.py into a throwaway Chroma collection
+and runs a fixed question set, each labelled with the article or schedule that answers it.
+"dense" is the old get_context_from_chroma path (top 3 by embedding). Without --cloudflare the
+embeddings are hashed TF-IDF vectors, which are lexical rather than semantic, so they show
+how the fusion and direct lookup behave but understate what bge gets wrong on identifiers.
+Asserts that the hybrid retrievers recall at least as much as dense alone, and that every
+question naming an article or schedule is answered by direct lookup with that section.
+"""
+import argparse
+import collections
+import math
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Worker_AI_RAG"))
+
+from hybrid_retrieval import HybridRetriever, LexicalReranker, referenced_sections, section_of  # noqa: E402
+
+# (question, section that answers it)
+QUESTIONS = [
+    ("What does Article 370 say?", "Article 370"),
+    ("Explain Article 21A", "Article 21A"),
+    ("What is in Schedule VII?", "Seventh Schedule"),
+    ("Summarise Article 368", "Article 368"),
+    ("What are the grounds in Article 356?", "Article 356"),
+    ("Which languages are listed in the Eighth Schedule?", "Eighth Schedule"),
+    ("Compare Articles 14 and 15", "Article 14"),
+    ("Which article abolishes untouchability?", "Article 17"),
+    ("What remedies exist for enforcement of fundamental rights?", "Article 32"),
+    ("How is the Finance Commission constituted?", "Article 280"),
+    ("Who superintends and controls elections?", "Article 324"),
+    ("What happens on failure of constitutional machinery in a State?", "Article 356"),
+    ("How can Parliament amend the Constitution?", "Article 368"),
+    ("What is the official language of the Union?", "Article 343"),
+    ("Is freedom of speech and expression protected?", "Article 19"),
+    ("Is everyone equal before the law?", "Article 14"),
+    ("Can the State confer titles?", "Article 18"),
+    ("Protection of life and personal liberty", "Article 21"),
+    ("Free and compulsory education for children aged six to fourteen", "Article 21A"),
+    ("What is a Money Bill?", "Article 110"),
+    ("How is the Supreme Court established and constituted?", "Article 124"),
+    ("Who is the Attorney-General for India?", "Article 76"),
+    ("How is the Governor of a State appointed?", "Article 155"),
+    ("Who is the Comptroller and Auditor-General?", "Article 148"),
+    ("When can a Proclamation of Emergency be issued?", "Article 352"),
+    ("Disqualification on ground of defection", "Tenth Schedule"),
+    ("What are the fundamental duties of citizens?", "Article 51A"),
+    ("Power of the President to grant pardons", "Article 72"),
+    ("Power of High Courts to issue certain writs", "Article 226"),
+    ("Matters to be entrusted to Panchayats", "Eleventh Schedule"),
+]
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class HashedEmbedder:
+    """Deterministic 1024-d TF-IDF vectors via feature hashing; a stand-in for bge"""
+
+    def __init__(self, texts, dim=1024):
+        self.dim = dim
+        frequencies = collections.Counter(t for text in texts for t in set(TOKEN.findall(text.lower())))
+        self.idf = {t: math.log(len(texts) / n) + 1 for t, n in frequencies.items()}
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token, count in collections.Counter(TOKEN.findall(text.lower())).items():
+            vector[zlib.crc32(token.encode()) % self.dim] += (1 + math.log(count)) * self.idf.get(token, 1.0)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class CloudflareEmbedder:
+    def __init__(self):
+        import chroma
+        self.client = chroma.embedding_client
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return self.client.embed(text)
+
+    def many(self, texts):
+        return self.client.embed_many(texts)
+
+
+def build_collection(path, chunks, embedder):
+    import chromadb
+    texts = [chunk["text"] for chunk in chunks]
+    if hasattr(embedder, "many"):
+        embeddings = embedder.many(texts)
+    else:
+        embeddings = [embedder(text) for text in texts]
+    collection = chromadb.PersistentClient(path=path).create_collection("constitution_embeddings")
+    for i in range(0, len(chunks), 500):
+        collection.add(
+            ids=[chunk["hash"] for chunk in chunks[i:i + 500]],
+            embeddings=embeddings[i:i + 500],
+            documents=texts[i:i + 500],
+            metadatas=[chunk["metadata"] for chunk in chunks[i:i + 500]],
+        )
+    embedder.calls = 0
+    return collection
+
+
+def evaluate(name, retrieve, embedder, sections_by_text):
+    hits = 0
+    reciprocal_ranks = []
+    timings = []
+    calls_before = embedder.calls
+    for question, expected in QUESTIONS:
+        started = time.perf_counter()
+        documents = retrieve(question)
+        timings.append(time.perf_counter() - started)
+        found = [sections_by_text.get(document) for document in documents]
+        rank = next((i for i, section in enumerate(found, start=1) if section == expected), None)
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    timings.sort()
+    print(f"{name:<15} recall@3={hits / len(QUESTIONS):5.2f}  mrr={statistics.mean(reciprocal_ranks):5.2f}  "
+          f"mean={statistics.mean(timings) * 1000:7.2f}ms  p95={timings[int(len(timings) * 0.95) - 1] * 1000:7.2f}ms  "
+          f"embedding calls={embedder.calls - calls_before}")
+    return hits / len(QUESTIONS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cloudflare", action="store_true", help="embed with the real Cloudflare model")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-retrieval-")
+    # chroma.py opens a client at CHROMA_PATH on import; keep it away from the real store
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "ingest")
+    import chroma
+
+    started = time.perf_counter()
+    chunks = list({c["hash"]: c for c in chroma.iter_chunks(chroma.iter_pages(chroma.pdf_path), "Constitution.pdf")}.values())
+    embedder = CloudflareEmbedder() if args.cloudflare else HashedEmbedder([c["text"] for c in chunks])
+    collection = build_collection(os.path.join(workdir, "bench"), chunks, embedder)
+    sections_by_text = {c["text"]: section_of(c["text"], c["metadata"]) for c in chunks}
+    print(f"{len(chunks)} chunks indexed in {time.perf_counter() - started:.1f}s; {len(QUESTIONS)} questions")
+
+    def dense(question):
+        result = collection.query(query_embeddings=[embedder(question)], n_results=3)
+        return result["documents"][0]
+
+    hybrid = HybridRetriever(collection)
+    reranked = HybridRetriever(collection, reranker=LexicalReranker())
+    # Build the BM25 indexes up front, as a warm worker would have
+    hybrid.lookup("Article 1")
+    reranked.lookup("Article 1")
+
+    recall = {
+        "dense": evaluate("dense", dense, embedder, sections_by_text),
+        "hybrid": evaluate("hybrid", lambda q: hybrid.retrieve(q, embedder), embedder, sections_by_text),
+        "hybrid+rerank": evaluate("hybrid+rerank", lambda q: reranked.retrieve(q, embedder), embedder,
+                                  sections_by_text),
+    }
+    print(f"direct section lookups: {hybrid.stats()['direct'] - 1} of {len(QUESTIONS)}")
+    for name in ("hybrid", "hybrid+rerank"):
+        assert recall[name] >= recall["dense"], f"{name} recall@3 {recall[name]:.2f} < dense {recall['dense']:.2f}"
+
+    named = [(question, expected) for question, expected in QUESTIONS if referenced_sections(question)]
+    assert named, "no question names a section"
+    for question, expected in named:
+        documents = hybrid.lookup(question) or []
+        found = [sections_by_text.get(document) for document in documents]
+        assert expected in found, f"direct lookup for {question!r} returned {found}, expected {expected}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Answer-cache lookup cost and reuse rules, on synthetic embeddings.
+
+    python benchmarks/bench_semantic_cache.py --entries 1000 --dim 1024
+
+Fills a SemanticCache to capacity and times lookups. Then checks the rules that keep a
+cached answer from reaching the wrong question. Near-identical vectors for questions naming
+different articles must miss, as must the same question in a different thread. A rephrased
+question naming the same article must hit.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from semantic_cache import SemanticCache  # noqa: E402
+
+
+def ask(question, earlier=()):
+    return list(earlier) + [{"role": "user", "content": question}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    cache = SemanticCache(threshold=0.95, max_entries=args.entries)
+    vectors = rng.standard_normal((args.entries, args.dim)).astype(np.float32)
+    for i, vector in enumerate(vectors):
+        cache.store(vector, ask(f"Question {i} about Article {i % 400 + 1}"), f"answer {i}")
+
+    timings = []
+    for i in range(args.lookups):
+        query = vectors[i % args.entries] + 0.01 * rng.standard_normal(args.dim).astype(np.float32)
+        started = time.perf_counter()
+        cache.lookup(query, ask(f"Question {i % args.entries} about Article {i % args.entries % 400 + 1}"))
+        timings.append((time.perf_counter() - started) * 1e6)
+    print(f"lookup over {args.entries} entries: p50 {statistics.median(timings):.0f}us  "
+          f"max {max(timings):.0f}us  hit ratio {cache.stats()['hit_ratio']}")
+
+    # Stand-in for bge scoring "Article 21" and "Article 22" questions above the threshold
+    article_21 = rng.standard_normal(args.dim).astype(np.float32)
+    article_22 = article_21 + 0.01 * rng.standard_normal(args.dim).astype(np.float32)
+    cache.store(article_21, ask("What is Article 21?"), "Article 21 protects life and liberty.")
+    checks = [
+        ("other article", cache.lookup(article_22, ask("What is Article 22?")), None),
+        ("other thread", cache.lookup(article_22, ask("What is Article 21?", [
+            {"role": "user", "content": "Tell me about contracts"},
+            {"role": "assistant", "content": "..."}])), None),
+        ("same article, reworded", cache.lookup(article_22, ask("what does article 21 say")),
+         "Article 21 protects life and liberty."),
+        ("looser threshold, other article",
+         cache.lookup(article_22, ask("What is Article 22?"), threshold=0.9), None),
+    ]
+    for name, got, expected in checks:
+        print(f"{name:<32} {'hit' if got else 'miss'}")
+        assert got == expected, f"{name}: got {got!r}"
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Guard the cold-start cost of importing app.py.
+
+    python benchmarks/bench_startup.py --budget-ms 900
+
+Each measurement runs in a fresh interpreter against a seeded throwaway Chroma store and
+the fake Groq/Cloudflare services. `python -X importtime -c "import app"` must stay under
+the budget with STARTUP_MODE=lazy and must not pull in chromadb, groq or the document
+parsers; the script exits non-zero if either check fails. It then reports, per startup
+mode, how long until the app can answer a liveness probe and until it reports ready.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks import fake_services  # noqa: E402
+
+# Modules that only the first request (or the warm-up thread) should import
+DEFERRED = ["chromadb", "groq", "PyPDF2", "docx", "onnxruntime"]
+
+PROBE = """
+import json, os, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+client = app.app.test_client()
+assert client.get("/api/health/live").status_code == 200
+live = time.perf_counter() - started
+while client.get("/api/health/ready").status_code != 200:
+    if os.environ["STARTUP_MODE"] == "lazy":
+        app.retriever.get(), app.groq_client.get()
+    time.sleep(0.005)
+print(json.dumps({"import": imported, "live": live, "ready": time.perf_counter() - started}))
+"""
+
+
+def import_times(env):
+    """{module: cumulative microseconds} for `import app`, from -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "900")),
+                        help="maximum cumulative import time of app.py with STARTUP_MODE=lazy")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    cloudflare, groq = fake_services.stub_environment(workdir, isolated=True)
+    try:
+        env = dict(os.environ, STARTUP_MODE="lazy")
+        times = import_times(env)
+        total_ms = times["app"] / 1000
+        print(f"import app: {total_ms:.0f}ms (budget {args.budget_ms:.0f}ms)")
+        direct = {name: us for name, us in times.items() if "." not in name and name != "app"}
+        for name, us in sorted(direct.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {name:<28} {us / 1000:7.1f}ms")
+
+        failures = []
+        if total_ms > args.budget_ms:
+            failures.append(f"import took {total_ms:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+        loaded = [name for name in DEFERRED if name in times]
+        if loaded:
+            failures.append(f"imported at startup: {', '.join(loaded)}")
+
+        for mode in ("eager", "background", "lazy"):
+            result = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True,
+                                    env=dict(os.environ, STARTUP_MODE=mode), check=True)
+            timings = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{mode:<11} import={timings['import'] * 1000:7.0f}ms  live={timings['live'] * 1000:7.0f}ms  "
+                  f"ready={timings['ready'] * 1000:7.0f}ms")
+    finally:
+        cloudflare.shutdown()
+        groq.shutdown()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compare time-to-first-byte of streaming and non-streaming /api/chat and /api/upload.
+
+    python benchmarks/bench_streaming.py --groq-latency 0.3 --tokens-per-second 200
+
+Runs app.py on a local werkzeug server against the fake Cloudflare and Groq services.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import fake_services  # noqa: E402
+
+
+def serve(flask_app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def read_events(response):
+    """Parse an SSE body into (event, data) pairs, timing the first token"""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+
+
+def timed_request(method, url, stream, **kwargs):
+    started = time.perf_counter()
+    if not stream:
+        response = method(url, **kwargs)
+        first = time.perf_counter() - started
+        response.raise_for_status()
+        return first, time.perf_counter() - started, response.json()
+
+    first = None
+    done = None
+    with method(url, stream=True, headers={"Accept": "text/event-stream"}, **kwargs) as response:
+        response.raise_for_status()
+        for event, data in read_events(response):
+            if event == "token" and first is None:
+                first = time.perf_counter() - started
+            elif event == "done":
+                done = data
+            elif event == "error":
+                raise RuntimeError(data)
+    return first, time.perf_counter() - started, done
+
+
+def chat(base_url, stream):
+    history = [{"role": "user", "content": "What does Article 21 protect?"}]
+    return timed_request(requests.post, f"{base_url}/api/chat", stream,
+                         json={"conversation_history": history})
+
+
+def upload(base_url, stream):
+    files = {"file": ("contract.txt", b"This agreement is made between the parties." * 50, "text/plain")}
+    return timed_request(requests.post, f"{base_url}/api/upload", stream,
+                         files=files, data={"conversation_history": "[]"})
+
+
+def report(label, runs, response_key):
+    firsts = [r[0] * 1000 for r in runs]
+    totals = [r[1] * 1000 for r in runs]
+    body = runs[-1][2]
+    print(f"{label:<22} ttfb p50={statistics.median(firsts):7.1f}ms  "
+          f"total p50={statistics.median(totals):7.1f}ms  chars={len(body[response_key])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--groq-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fake_services.stub_environment(tmp, groq_latency=args.groq_latency,
+                                       tokens_per_second=args.tokens_per_second,
+                                       completion_tokens=args.completion_tokens)
+        # Every run asks the same question; the answer cache would turn them into cache hits
+        os.environ["ANSWER_CACHE_SIZE"] = "0"
+        import app
+
+        server, base_url = serve(app.app)
+        for label, call, key in (("chat", chat, "response"), ("upload", upload, "ai_response")):
+            for stream in (False, True):
+                runs = [call(base_url, stream) for _ in range(args.runs)]
+                if stream:
+                    assert runs[-1][2]["usage"]["completion_tokens"] == args.completion_tokens
+                report(f"{label} ({'sse' if stream else 'json'})", runs, key)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
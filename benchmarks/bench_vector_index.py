@@ -0,0 +1,101 @@
+"""Compare the memory-mapped vector index with Chroma: accuracy, latency, RSS and cold open.
+
+    python benchmarks/bench_vector_index.py --chunks 1523
+    python benchmarks/bench_vector_index.py --chunks 50000 --ivf-lists 256
+
+Seeds a throwaway Chroma collection with synthetic article chunks (1523 is the size of the
+ingested Constitution) and exports it as float16, int8 and, with --ivf-lists, an IVF index.
+The fake vectors are uniformly random, the worst case for IVF; real bge vectors cluster.
+Cold open and RSS are measured in a fresh interpreter per store, as a new worker would see
+them: time to import, open and answer one query, and the RSS that adds on top of numpy.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks import fake_services  # noqa: E402
+from vector_index import MappedCollection, export, verify  # noqa: E402
+
+COLD_OPEN = """
+import json, sys, time
+import numpy as np
+def rss():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS")) / 1024
+before = rss()
+started = time.perf_counter()
+kind, path = sys.argv[1], sys.argv[2]
+if kind == "chroma":
+    import chromadb
+    collection = chromadb.PersistentClient(path=path).get_collection("constitution_embeddings")
+else:
+    from vector_index import MappedCollection
+    collection = MappedCollection(path)
+query = np.random.default_rng(1).standard_normal(int(sys.argv[3])).astype(np.float32) / 30
+collection.query(query_embeddings=[query.tolist()], n_results=20)
+print(json.dumps({"open_ms": (time.perf_counter() - started) * 1000, "rss_mb": rss() - before}))
+"""
+
+
+def cold_open(kind, path, dim):
+    result = subprocess.run([sys.executable, "-c", COLD_OPEN, kind, path, str(dim)], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=1523)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--ivf-lists", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-vector-index-")
+    chroma_path = os.path.join(workdir, "chroma")
+    started = time.perf_counter()
+    collection = fake_services.seed_chroma(chroma_path, fake_services.synthetic_articles(args.chunks), dim=args.dim)
+    print(f"{args.chunks} chunks seeded into Chroma in {time.perf_counter() - started:.1f}s "
+          f"({directory_size(chroma_path) / 1e6:.1f} MB on disk)")
+
+    stores = [("chroma", "chroma", chroma_path)]
+    variants = [("float16", "float16", 0), ("int8", "int8", 0)]
+    if args.ivf_lists:
+        variants.append((f"float16+ivf{args.ivf_lists}", "float16", args.ivf_lists))
+    for name, dtype, lists in variants:
+        path = os.path.join(workdir, name)
+        started = time.perf_counter()
+        export(collection, path, dtype, lists)
+        print(f"exported {name:<16} in {time.perf_counter() - started:5.1f}s  ({directory_size(path) / 1e6:.1f} MB)")
+        stores.append((name, "mapped", path))
+
+    # Same query vectors for every store: blends of stored chunks, as in vector_index.verify
+    for name, kind, path in stores[1:]:
+        print(f"{name:<16}", end=" ")
+        recall = verify(collection, MappedCollection(path), args.queries, args.k)
+        # IVF trades recall for speed (raise VECTOR_INDEX_NPROBE); the flat scans must be near exact
+        if "ivf" not in name:
+            assert recall >= 0.95, f"{name} misses exact neighbours: top-{args.k} recall {recall:.3f}"
+
+    print()
+    for name, kind, path in stores:
+        runs = [cold_open(kind, path, args.dim) for _ in range(3)]
+        print(f"{name:<16} cold open + first query {np.median([r['open_ms'] for r in runs]):7.0f}ms  "
+              f"RSS +{np.median([r['rss_mb'] for r in runs]):6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
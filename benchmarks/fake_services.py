@@ -0,0 +1,339 @@
+"""Local stand-ins for the upstream APIs the backend talks to.
+
+Each fake runs an http.server in a daemon thread and only speaks enough of the real
+protocol for app.py: point CLOUDFLARE_API_BASE and GROQ_BASE_URL at the fakes instead
+of api.cloudflare.com and api.groq.com.
+
+Both fakes can inject faults, set at start or changed on a running server through
+`server.options` (in-process servers only):
+  fail_next     answer the next N calls with `error_status` (default 503)
+  error_rate    answer this fraction of calls with `error_status`
+  hang_seconds  stall every call this long before answering, as a stuck upstream does
+  slow_rate     stall this fraction of calls for `slow_seconds`, a long latency tail
+
+The fake Cloudflare embeds each text as a random vector seeded by the text, or with
+`word_vectors` as the sum of one such vector per word, so that texts sharing words are
+similar, for benchmarks that check where retrieval goes rather than how fast.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 1024
+# A saved Cloudflare bge response for Constitution.pdf, as written by process_markdown.py
+EMBEDDING_RESULTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "Worker_AI_RAG", "embedding_results.json")
+
+
+def fake_vector(text, dim=EMBEDDING_DIM):
+    # Deterministic per text so cache and retrieval behaviour is reproducible. Values are
+    # multiples of 1/2000 in [-0.064, 0.064]: short float reprs keep JSON encoding cheap.
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    return [v / 2000 for v in array("b", rng.randbytes(dim))]
+
+
+@lru_cache(maxsize=65536)
+def _word_bytes(word, dim):
+    return array("b", random.Random(hashlib.sha256(word.encode("utf-8")).digest()).randbytes(dim))
+
+
+def word_vector(text, dim=EMBEDDING_DIM):
+    # A bag of words: texts that share words point the same way, as real embeddings of
+    # texts on one subject do
+    words = re.findall(r"[a-z]{3,}", text.lower()) or [text]
+    totals = [0] * dim
+    for word in words:
+        for i, value in enumerate(_word_bytes(word, dim)):
+            totals[i] += value
+    scale = len(words) ** 0.5
+    return [round(total / scale) / 2000 for total in totals]
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+    def __init__(self, handler, latency=0.0, **options):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.options = options
+        # The last request body, for benchmarks that check what was sent upstream
+        self.last_payload = None
+        self.calls = 0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up on stalled calls; that is the point, not an error
+        pass
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, items=1):
+        with self.lock:
+            self.calls += 1
+            self.items += items
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def inject_fault(self):
+        """Apply the server's fault options; True when the call was answered with an error"""
+        options = self.server.options
+        with self.server.lock:
+            fail = options.get("fail_next", 0) > 0
+            if fail:
+                options["fail_next"] -= 1
+        if fail or random.random() < options.get("error_rate", 0.0):
+            self.send_json({"success": False, "errors": [{"message": "injected fault"}],
+                            "error": {"message": "injected fault"}}, status=options.get("error_status", 503))
+            return True
+        if options.get("hang_seconds"):
+            time.sleep(options["hang_seconds"])
+        elif random.random() < options.get("slow_rate", 0.0):
+            time.sleep(options.get("slow_seconds", 1.0))
+        return False
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeCloudflareHandler(QuietHandler):
+    """POST /accounts/<id>/ai/run/<model> with {"text": str | [str]}.
+
+    A call takes `latency` plus `item_latency` per text; with `rate_limit_every` set, every
+    Nth call is answered with a 429. Faults as in the module docstring.
+    """
+
+    def do_POST(self):
+        payload = self.read_json()
+        texts = payload.get("text", "")
+        texts = texts if isinstance(texts, list) else [texts]
+        self.server.count(len(texts))
+        every = self.server.options.get("rate_limit_every")
+        if every and self.server.calls % every == 0:
+            self.send_json({"success": False, "errors": [{"message": "rate limited"}]}, status=429)
+            return
+        if self.inject_fault():
+            return
+        time.sleep(self.server.latency + self.server.options.get("item_latency", 0.0) * len(texts))
+        dim = self.server.options.get("dim", EMBEDDING_DIM)
+        embed = word_vector if self.server.options.get("word_vectors") else fake_vector
+        self.send_json({
+            "success": True,
+            "errors": [],
+            "result": {"shape": [len(texts), dim], "data": [embed(t, dim) for t in texts]},
+        })
+
+
+class FakeGroqHandler(QuietHandler):
+    """POST /openai/v1/chat/completions, streaming or not.
+
+    `latency` is the time to first token; tokens then arrive at `tokens_per_second`.
+    Faults as in the module docstring.
+    """
+
+    def do_POST(self):
+        payload = self.read_json()
+        self.server.count()
+        self.server.last_payload = payload
+        if self.inject_fault():
+            return
+        prompt_tokens = sum(len(m.get("content") or "") for m in payload.get("messages", [])) // 4
+        completion_tokens = self.server.options.get("completion_tokens", 200)
+        interval = 1.0 / self.server.options.get("tokens_per_second", 500)
+        tokens = [f"token{i} " for i in range(completion_tokens)]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": payload.get("model", "fake")}
+
+        time.sleep(self.server.latency)
+        if not payload.get("stream"):
+            # A non-streaming caller still waits for the whole generation
+            time.sleep(interval * completion_tokens)
+            self.send_json(dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }]))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(interval)
+            self.write_event(dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "delta": {"content": token}, "finish_reason": None,
+            }]))
+        self.write_event(dict(base, object="chat.completion.chunk", x_groq={"id": "req-fake", "usage": usage},
+                              choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_event(self, payload):
+        self.write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def start(handler, latency=0.0, **options):
+    server = FakeServer(handler, latency=latency, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class IsolatedServer:
+    """A fake running in its own process, so its CPU work does not compete for our GIL.
+
+    Call counters are not shared back; use `start` when a benchmark needs them.
+    """
+
+    def __init__(self, process, base_url):
+        self.process = process
+        self.base_url = base_url
+
+    def shutdown(self):
+        self.process.terminate()
+        self.process.join()
+
+
+def _serve_isolated(handler, latency, options, ready):
+    server = FakeServer(handler, latency=latency, **options)
+    ready.put(server.base_url)
+    server.serve_forever()
+
+
+def start_isolated(handler, latency=0.0, **options):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=_serve_isolated, args=(handler, latency, options, ready), daemon=True)
+    process.start()
+    return IsolatedServer(process, ready.get(timeout=30))
+
+
+def start_cloudflare(latency=0.05, dim=EMBEDDING_DIM, isolated=False, item_latency=0.0, rate_limit_every=None,
+                     **faults):
+    return (start_isolated if isolated else start)(FakeCloudflareHandler, latency=latency, dim=dim,
+                                                   item_latency=item_latency, rate_limit_every=rate_limit_every,
+                                                   **faults)
+
+
+def start_groq(latency=0.3, tokens_per_second=500, completion_tokens=200, isolated=False, **faults):
+    return (start_isolated if isolated else start)(FakeGroqHandler, latency=latency,
+                                                   tokens_per_second=tokens_per_second,
+                                                   completion_tokens=completion_tokens, **faults)
+
+
+def seed_chroma(path, texts, collection_name="constitution_embeddings", dim=EMBEDDING_DIM, embed=fake_vector):
+    """Create a throwaway Chroma store whose vectors match what the fake Cloudflare returns"""
+    import chromadb
+
+    client = chromadb.PersistentClient(path=path)
+    collection = client.get_or_create_collection(name=collection_name)
+    # Chroma caps the size of one add
+    for start in range(0, len(texts), 5000):
+        batch = list(texts[start:start + 5000])
+        collection.add(
+            ids=[f"chunk-{i}" for i in range(start, start + len(batch))],
+            embeddings=[embed(text, dim) for text in batch],
+            documents=batch,
+            metadatas=[{"source": "benchmark"} for _ in batch],
+        )
+    return collection
+
+
+def synthetic_articles(count, words=160):
+    """Chunks shaped like the ingested Constitution: an article heading, then ~1000 chars"""
+    vocabulary = ("state parliament law citizen right court president union legislature order "
+                  "provision clause power authority election tax emergency freedom property").split()
+    rng = random.Random(count)
+    return [
+        f"{i}. Article {i} of the sample Constitution. " + " ".join(rng.choice(vocabulary) for _ in range(words))
+        for i in range(1, count + 1)
+    ]
+
+
+def seed_from_embedding_results(path, count=500, results_file=EMBEDDING_RESULTS):
+    """Seed a Chroma store like the production one from embedding_results.json.
+
+    The file holds a real bge response, which fixes the vector dimension and is stored
+    as-is alongside `count` synthetic article chunks embedded the way the fake Cloudflare
+    embeds them. Returns the dimension.
+    """
+    with open(results_file) as f:
+        results = json.load(f)
+    dim = results[0]["response"]["result"]["shape"][1]
+    collection = seed_chroma(path, synthetic_articles(count), dim=dim)
+    stored = [(entry["filename"], vector) for entry in results for vector in entry["response"]["result"]["data"]]
+    collection.add(
+        ids=[f"result-{i}" for i in range(len(stored))],
+        embeddings=[vector for _, vector in stored],
+        documents=[f"Embedded text of {filename}" for filename, _ in stored],
+        metadatas=[{"source": filename} for filename, _ in stored],
+    )
+    return dim
+
+
+def stub_environment(workdir, cloudflare_latency=0.05, groq_latency=0.3, tokens_per_second=500,
+                     completion_tokens=200, corpus=None, isolated=False, seed_chunks=None, word_vectors=False):
+    """Start both fakes, seed a Chroma store under `workdir` and point app.py at them.
+
+    With `seed_chunks` the store is seeded from embedding_results.json plus that many
+    synthetic chunks; otherwise from `corpus` (default: 50 one-line articles), embedded
+    with word_vector if `word_vectors` is set.
+    Must run before `import app`, which reads the environment at import time.
+    """
+    chroma_path = os.path.join(workdir, "chroma_db")
+    if seed_chunks:
+        dim = seed_from_embedding_results(chroma_path, seed_chunks)
+    else:
+        dim = EMBEDDING_DIM
+        seed_chroma(chroma_path, corpus or [f"Article {i}. Sample constitutional text number {i}." for i in range(1, 51)],
+                    embed=word_vector if word_vectors else fake_vector)
+    cloudflare = start_cloudflare(latency=cloudflare_latency, dim=dim, isolated=isolated, word_vectors=word_vectors)
+    groq = start_groq(latency=groq_latency, tokens_per_second=tokens_per_second,
+                      completion_tokens=completion_tokens, isolated=isolated)
+    os.environ.update({
+        "CLOUDFLARE_API_BASE": cloudflare.base_url,
+        "CLOUDFLARE_ACCOUNT_ID": "benchmark",
+        "CLOUDFLARE_API_TOKEN": "benchmark",
+        "GROQ_BASE_URL": groq.base_url,
+        "GROQ_API_KEY": "benchmark",
+        "CHROMA_PATH": chroma_path,
+        "UPLOAD_JOBS_DIR": os.path.join(workdir, "upload_jobs"),
+        "CONVERSATION_STORE_PATH": os.path.join(workdir, "conversations.sqlite3"),
+    })
+    return cloudflare, groq
@@ -0,0 +1,122 @@
+"""Throughput of the sync Flask path vs the asyncio ASGI path at the same concurrency.
+
+    python benchmarks/load_test.py --concurrency 100 --requests 400
+
+Each server runs in its own process against the fake Cloudflare and Groq services. The
+Flask server is single-threaded, matching one gunicorn sync worker; the ASGI server is a
+single uvicorn worker. Every request must return 200 with a non-empty answer, and the ASGI
+server must reach --min-gain times the Flask throughput; otherwise the script exits non-zero.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks import fake_services  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_flask(port):
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    make_server("127.0.0.1", port, app.app, threaded=False).serve_forever()
+
+
+def _serve_asgi(port):
+    import uvicorn
+
+    uvicorn.run("asgi_app:app", host="127.0.0.1", port=port, log_level="warning")
+
+
+def serve(target):
+    """Run a server in its own process, like a single gunicorn/uvicorn worker would be"""
+    port = free_port()
+    process = multiprocessing.get_context("spawn").Process(target=target, args=(port,), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return process, f"http://127.0.0.1:{port}"
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{target.__name__} did not start")
+
+
+async def drive(base_url, total, concurrency, label):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(client, i):
+        nonlocal errors
+        # Unique questions so the embedding cache cannot hide upstream latency
+        history = [{"role": "user", "content": f"[{label}] What does Article {i} say?"}]
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(f"{base_url}/api/chat", json={"conversation_history": history})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200 or not response.json().get("response", "").strip():
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    print(f"{label:<6} {total / elapsed:8.1f} req/s  p50={statistics.median(ordered) * 1000:7.0f}ms  "
+          f"p95={ordered[int(len(ordered) * 0.95) - 1] * 1000:7.0f}ms  errors={errors}")
+    assert errors == 0, f"{label}: {errors} request(s) failed or returned an empty answer"
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--sync-requests", type=int, default=40,
+                        help="the sync path is slow; measure it on fewer requests")
+    parser.add_argument("--cloudflare-latency", type=float, default=0.08)
+    parser.add_argument("--groq-latency", type=float, default=0.4)
+    parser.add_argument("--min-gain", type=float, default=2.0,
+                        help="fail unless the ASGI path is at least this many times faster")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fake_services.stub_environment(tmp, cloudflare_latency=args.cloudflare_latency,
+                                       groq_latency=args.groq_latency, tokens_per_second=2000,
+                                       isolated=True)
+        flask_process, flask_url = serve(_serve_flask)
+        asgi_process, asgi_url = serve(_serve_asgi)
+
+        try:
+            sync_rate = asyncio.run(drive(flask_url, args.sync_requests, args.concurrency, "sync"))
+            async_rate = asyncio.run(drive(asgi_url, args.requests, args.concurrency, "asgi"))
+        finally:
+            flask_process.terminate()
+            asgi_process.terminate()
+        print(f"throughput gain: {async_rate / sync_rate:.1f}x")
+        assert async_rate >= sync_rate * args.min_gain, \
+            f"ASGI throughput gain {async_rate / sync_rate:.1f}x is below --min-gain {args.min_gain}x"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import re
+import threading
+
+import numpy as np
+
+# Words, numbers and single punctuation marks; long words cost roughly one token per 4 chars.
+# Within ~10% of the Llama 3 tokenizer on English legal text, at regex speed.
+TOKEN_PIECE = re.compile(r"\w+|[^\w\s]")
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+DOCUMENT_TOKEN_BUDGET = int(os.getenv("DOCUMENT_TOKEN_BUDGET", "4000"))
+DOCUMENT_CHUNK_TOKENS = 300
+# Queried against an upload when the user has not asked anything specific yet
+DOCUMENT_REVIEW_QUERY = (
+    "parties, obligations, payment terms, term and termination, liability, indemnity, "
+    "confidentiality, governing law, dispute resolution and unusual or risky clauses"
+)
+TRUNCATION_MARKER = " …[truncated]"
+
+
+def count_tokens(text):
+    return sum(1 + len(piece) // 5 for piece in TOKEN_PIECE.findall(text or ""))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    pieces = 0
+    for match in TOKEN_PIECE.finditer(text):
+        pieces += 1 + len(match.group()) // 5
+        if pieces > max_tokens:
+            return text[:match.start()].rstrip() + TRUNCATION_MARKER
+    return text
+
+
+def split_into_chunks(text, chunk_tokens=DOCUMENT_CHUNK_TOKENS):
+    """Group paragraphs into chunks of roughly chunk_tokens, splitting oversized paragraphs"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in (p.strip() for p in text.split("\n")):
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        while tokens > chunk_tokens:
+            head = truncate_to_tokens(paragraph, chunk_tokens)[:-len(TRUNCATION_MARKER)]
+            if not head:
+                # The first word alone is over the limit (base64, a hash): cut it by characters,
+                # about 4 per token, or the paragraph would never shrink
+                head = paragraph[:chunk_tokens * 4]
+            chunks.append(head)
+            paragraph = paragraph[len(head):].strip()
+            tokens = count_tokens(paragraph)
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def summarize_turns(messages, max_tokens):
+    """Extractive summary of dropped turns: the first sentence of each, newest kept first"""
+    lines = []
+    used = 0
+    for message in reversed(messages):
+        first_sentence = re.split(r"(?<=[.!?])\s", message["content"].strip(), maxsplit=1)[0]
+        line = f"- {message['role']}: {truncate_to_tokens(first_sentence, 60)}"
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    if not lines:
+        return None
+    return "Summary of earlier conversation:\n" + "\n".join(reversed(lines))
+
+
+class ContextBuilder:
+    """Fits each Groq request into a token budget and tracks how much it saved.
+
+    System prompts and the latest user message are always kept. Older turns are kept newest
+    first while they fit, each capped at a quarter of the budget. Turns that do not fit are
+    replaced by a short extractive summary.
+    """
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, document_budget=DOCUMENT_TOKEN_BUDGET):
+        self.budget = budget
+        self.document_budget = document_budget
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0,
+            "turns_dropped": 0, "turns_truncated": 0, "documents_trimmed": 0,
+        }
+
+    def fit(self, messages):
+        """Return (messages, report) with the messages trimmed to the budget"""
+        tokens_in = sum(count_tokens(m["content"]) for m in messages)
+        last_user = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=None)
+        system = [m for m in messages if m["role"] == "system"]
+        latest = messages[last_user] if last_user is not None else None
+        older = [m for i, m in enumerate(messages) if m["role"] != "system" and i != last_user]
+
+        remaining = self.budget - sum(count_tokens(m["content"]) for m in system)
+        if latest is not None:
+            latest_content = truncate_to_tokens(latest["content"], max(remaining, 0))
+            if latest_content != latest["content"]:
+                latest = {"role": latest["role"], "content": latest_content}
+            remaining -= count_tokens(latest_content)
+
+        # Reserve room for the summary only when something is going to be dropped
+        older_tokens = sum(count_tokens(m["content"]) for m in older)
+        summary_budget = min(400, self.budget // 10) if older_tokens > remaining else 0
+        remaining -= summary_budget
+
+        kept = []
+        truncated = 0
+        turn_cap = self.budget // 4
+        for index in range(len(older) - 1, -1, -1):
+            message = older[index]
+            content = truncate_to_tokens(message["content"], min(turn_cap, remaining))
+            tokens = count_tokens(content)
+            if not content or tokens > remaining:
+                break
+            if content != message["content"]:
+                truncated += 1
+                message = {"role": message["role"], "content": content}
+            kept.append(message)
+            remaining -= tokens
+        kept.reverse()
+        dropped = older[:len(older) - len(kept)]
+
+        fitted = list(system)
+        summary = summarize_turns(dropped, summary_budget) if dropped else None
+        if summary:
+            fitted.append({"role": "system", "content": summary})
+        fitted.extend(kept)
+        if latest is not None:
+            fitted.append(latest)
+
+        tokens_out = sum(count_tokens(m["content"]) for m in fitted)
+        report = {
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "tokens_saved": max(tokens_in - tokens_out, 0),
+            "turns_dropped": len(dropped),
+            "turns_truncated": truncated,
+        }
+        self._record(report)
+        return fitted, report
+
+    def select_document(self, text, query, embed_many):
+        """Return the document itself if it fits the document budget, otherwise the chunks
+        most similar to `query`, in document order. `embed_many` maps a list of texts to a
+        list of vectors (or None on failure)."""
+        if count_tokens(text) <= self.document_budget:
+            return text
+        chunks = split_into_chunks(text)
+        vectors = embed_many([query or DOCUMENT_REVIEW_QUERY] + chunks)
+        with self._lock:
+            self._counters["documents_trimmed"] += 1
+
+        if not vectors or any(v is None for v in vectors):
+            # No embeddings: fall back to the head of the document
+            return truncate_to_tokens(text, self.document_budget)
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+        scores = matrix[1:] @ matrix[0]
+
+        selected = []
+        used = 0
+        for index in np.argsort(-scores):
+            tokens = count_tokens(chunks[index])
+            if used + tokens > self.document_budget:
+                continue
+            selected.append(index)
+            used += tokens
+        excerpts = "\n[...]\n".join(chunks[i] for i in sorted(selected))
+        return f"[Most relevant excerpts from a longer document]\n{excerpts}"
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["budget"] = self.budget
+        stats["document_budget"] = self.document_budget
+        return stats
+
+    def _record(self, report):
+        with self._lock:
+            self._counters["requests"] += 1
+            for key in ("tokens_in", "tokens_out", "tokens_saved", "turns_dropped", "turns_truncated"):
+                self._counters[key] += report[key]
@@ -0,0 +1,253 @@
+import hashlib
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def new_session_id():
+    return secrets.token_urlsafe(18)
+
+
+def document_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class MemoryConversationStore:
+    """Per-process conversation store with LRU eviction.
+
+    Turns are kept as (role, content, document_key) tuples; uploaded documents are stored
+    once by content hash and referenced from the turns that use them. Sessions are only
+    visible to the worker that created them, so use the SQLite store with several workers.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=86400, max_turns=100):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "creates": 0, "lookups": 0, "misses": 0, "records": 0, "evictions": 0, "expirations": 0,
+        }
+
+    def create(self):
+        session_id = new_session_id()
+        with self._lock:
+            self._sessions[session_id] = {"turns": [], "updated": time.time()}
+            self._counters["creates"] += 1
+            while len(self._sessions) > self.max_sessions:
+                _, oldest = self._sessions.popitem(last=False)
+                self._release(oldest["turns"])
+                self._counters["evictions"] += 1
+        return session_id
+
+    def history(self, session_id):
+        """Return the session's messages, or None if it is unknown or expired"""
+        with self._lock:
+            self._counters["lookups"] += 1
+            session = self._sessions.get(session_id)
+            if session is not None and session["updated"] + self.ttl <= time.time():
+                del self._sessions[session_id]
+                self._release(session["turns"])
+                self._counters["expirations"] += 1
+                session = None
+            if session is None:
+                self._counters["misses"] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return [
+                {"role": role, "content": self._documents[key][0] if key else content}
+                for role, content, key in session["turns"]
+            ]
+
+    def record(self, session_id, user_content, answer, document=False):
+        """Append a question (or uploaded document) and its answer to the session"""
+        key = document_key(user_content) if document else None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            if key:
+                entry = self._documents.setdefault(key, [user_content, 0])
+                entry[1] += 1
+                session["turns"].append(("user", None, key))
+            else:
+                session["turns"].append(("user", user_content, None))
+            session["turns"].append(("assistant", answer, None))
+            if len(session["turns"]) > self.max_turns:
+                self._release(session["turns"][:-self.max_turns])
+                del session["turns"][:-self.max_turns]
+            session["updated"] = time.time()
+            self._sessions.move_to_end(session_id)
+            self._counters["records"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["sessions"] = len(self._sessions)
+            stats["documents"] = len(self._documents)
+        stats["backend"] = "memory"
+        return stats
+
+    def _release(self, turns):
+        # Caller holds the lock; drop documents no remaining turn refers to
+        for _, _, key in turns:
+            if key:
+                entry = self._documents[key]
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._documents[key]
+
+
+class SQLiteConversationStore:
+    """Conversation store in a SQLite file, shared by every worker that points at it.
+
+    WAL mode lets readers run alongside a writer; writes take an immediate lock so two
+    workers appending to the same session cannot interleave sequence numbers.
+    """
+
+    def __init__(self, path, max_sessions=100000, ttl=86400, max_turns=100):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self._counters = {
+            "creates": 0, "lookups": 0, "misses": 0, "records": 0, "evictions": 0, "expirations": 0,
+        }
+        self._pid = None
+        self._connection = None
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, updated REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);"
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT, "
+            "document TEXT, PRIMARY KEY (session_id, seq));"
+            "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, text TEXT NOT NULL);"
+        )
+
+    @property
+    def _db(self):
+        # One connection per process: a connection inherited across fork (gunicorn --preload)
+        # must not be used by the child
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False,
+                                               isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def create(self):
+        session_id = new_session_id()
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("INSERT INTO sessions (id, updated) VALUES (?, ?)", (session_id, now))
+                expired = self._delete_sessions(
+                    "SELECT id FROM sessions WHERE updated <= ?", (now - self.ttl,))
+                evicted = self._delete_sessions(
+                    "SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?", (self.max_sessions,))
+                if expired or evicted:
+                    self._db.execute(
+                        "DELETE FROM documents WHERE id NOT IN "
+                        "(SELECT document FROM turns WHERE document IS NOT NULL)")
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._counters["creates"] += 1
+            self._counters["expirations"] += expired
+            self._counters["evictions"] += evicted
+        return session_id
+
+    def history(self, session_id):
+        """Return the session's messages, or None if it is unknown or expired"""
+        with self._lock:
+            self._counters["lookups"] += 1
+            row = self._db.execute("SELECT updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or row[0] + self.ttl <= time.time():
+                self._counters["misses"] += 1
+                return None
+            rows = self._db.execute(
+                "SELECT t.role, COALESCE(d.text, t.content) FROM turns t "
+                "LEFT JOIN documents d ON d.id = t.document WHERE t.session_id = ? ORDER BY t.seq",
+                (session_id,),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def record(self, session_id, user_content, answer, document=False):
+        """Append a question (or uploaded document) and its answer to the session"""
+        key = document_key(user_content) if document else None
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._db.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                    self._db.execute("ROLLBACK")
+                    return
+                if key:
+                    self._db.execute("INSERT OR IGNORE INTO documents (id, text) VALUES (?, ?)", (key, user_content))
+                seq = self._db.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+                self._db.executemany(
+                    "INSERT INTO turns (session_id, seq, role, content, document) VALUES (?, ?, ?, ?, ?)",
+                    [(session_id, seq + 1, "user", None if key else user_content, key),
+                     (session_id, seq + 2, "assistant", answer, None)],
+                )
+                trimmed = self._db.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq <= ?",
+                    (session_id, seq + 2 - self.max_turns)).rowcount
+                if trimmed:
+                    self._db.execute(
+                        "DELETE FROM documents WHERE id NOT IN "
+                        "(SELECT document FROM turns WHERE document IS NOT NULL)")
+                self._db.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), session_id))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._counters["records"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["sessions"] = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            stats["documents"] = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        stats["backend"] = "sqlite"
+        return stats
+
+    def _delete_sessions(self, select, params):
+        # Caller holds the lock inside a transaction
+        ids = [row[0] for row in self._db.execute(select, params).fetchall()]
+        for session_id in ids:
+            self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        return len(ids)
+
+
+def conversation_store_path():
+    """CONVERSATION_STORE_PATH, by default a file under the temp dir; "memory" for none"""
+    return os.getenv("CONVERSATION_STORE_PATH",
+                     os.path.join(tempfile.gettempdir(), "legal-chatbot-conversations.sqlite3"))
+
+
+def conversation_store_from_env():
+    """SQLite under the temp dir by default, so every worker on the host sees each session;
+    CONVERSATION_STORE_PATH=memory keeps sessions per process (a single worker only)"""
+    ttl = int(os.getenv("CONVERSATION_TTL", "86400"))
+    max_turns = int(os.getenv("CONVERSATION_MAX_TURNS", "100"))
+    path = conversation_store_path()
+    if path != "memory":
+        return SQLiteConversationStore(
+            path, max_sessions=int(os.getenv("CONVERSATION_STORE_SIZE", "100000")),
+            ttl=ttl, max_turns=max_turns,
+        )
+    return MemoryConversationStore(
+        max_sessions=int(os.getenv("CONVERSATION_STORE_SIZE", "1000")), ttl=ttl, max_turns=max_turns,
+    )
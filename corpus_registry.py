@@ -0,0 +1,304 @@
+"""Several legal corpora (the Constitution, statutes, case law...) behind one retriever.
+
+CORPORA_CONFIG points at a JSON list of corpora, each its own Chroma collection (or
+vector_index.py export) with metadata used for filtering and routing:
+
+    [{"name": "constitution", "collection": "constitution_embeddings", "jurisdiction": "IN",
+      "doc_type": "constitution", "date": "1950-01-26", "keywords": ["article", "schedule"],
+      "default": true},
+     {"name": "contract_act", "collection": "contract_act_embeddings", "jurisdiction": "IN",
+      "doc_type": "statute", "date": "1872-04-25", "keywords": ["contract", "breach"]}]
+
+Without it the registry holds the single Constitution collection, as before. A request can
+narrow the corpora with filters, e.g. {"jurisdiction": "IN", "doc_type": ["statute"],
+"date_from": "1950-01-01"}; the router then picks the ones worth querying for the question.
+"""
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from hybrid_retrieval import HybridRetriever, referenced_sections
+
+FILTER_KEYS = ("corpus", "jurisdiction", "doc_type", "date_from", "date_to")
+# Stored vectors averaged into a corpus centroid for embedding routing
+CENTROID_SAMPLE = int(os.getenv("CORPUS_CENTROID_SAMPLE", "2000"))
+ROUTE_MAX_CORPORA = int(os.getenv("ROUTE_MAX_CORPORA", "2"))
+# Corpora whose centroid is this much less similar to the question than the best are skipped
+ROUTE_MARGIN = float(os.getenv("ROUTE_MARGIN", "0.05"))
+CORPUS_SEARCH_THREADS = int(os.getenv("CORPUS_SEARCH_THREADS", "4"))
+
+DEFAULT_CORPUS = {
+    "name": "constitution",
+    "collection": "constitution_embeddings",
+    "jurisdiction": "IN",
+    "doc_type": "constitution",
+    "date": "1950-01-26",
+    "keywords": ["constitution", "article", "schedule", "fundamental right", "directive principle",
+                 "parliament", "amendment"],
+    "default": True,
+}
+
+
+def as_list(value):
+    if value is None:
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+def parse_filters(value):
+    """Validate a request's "filters" object; raises ValueError with a message for the client"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError("filters must be an object")
+    unknown = sorted(set(value) - set(FILTER_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(unknown)}; expected {', '.join(FILTER_KEYS)}")
+    for key in ("corpus", "jurisdiction", "doc_type"):
+        items = value.get(key)
+        if items is not None and not all(isinstance(item, str) for item in as_list(items)):
+            raise ValueError(f"filters.{key} must be a string or a list of strings")
+    for key in ("date_from", "date_to"):
+        if value.get(key) is not None and not re.fullmatch(r"\d{4}(-\d{2}(-\d{2})?)?", str(value[key])):
+            raise ValueError(f"filters.{key} must be an ISO date (YYYY, YYYY-MM or YYYY-MM-DD)")
+    return value or None
+
+
+class Corpus:
+    def __init__(self, name, collection=None, vector_index=None, jurisdiction=None, doc_type=None,
+                 date=None, keywords=(), default=False):
+        self.name = name
+        self.collection_name = collection or f"{name}_embeddings"
+        self.vector_index = vector_index
+        self.jurisdiction = jurisdiction
+        self.doc_type = doc_type
+        self.date = date
+        self.keywords = [keyword.lower() for keyword in keywords]
+        self.default = default
+        self._keyword_pattern = (
+            re.compile(r"\b(?:" + "|".join(re.escape(k) for k in self.keywords) + r")s?\b")
+            if self.keywords else None
+        )
+        self.retriever = None
+        self.centroid = None
+
+    def matches(self, filters):
+        if not filters:
+            return True
+        for key in ("corpus", "jurisdiction", "doc_type"):
+            allowed = as_list(filters.get(key))
+            value = self.name if key == "corpus" else getattr(self, key)
+            if allowed is not None and value not in allowed:
+                return False
+        # ISO dates compare as strings; a corpus without a date passes date filters
+        if self.date and filters.get("date_from") and self.date < str(filters["date_from"]):
+            return False
+        if self.date and filters.get("date_to") and self.date[:len(str(filters["date_to"]))] > str(filters["date_to"]):
+            return False
+        return True
+
+    def keyword_hits(self, question):
+        if self._keyword_pattern is None:
+            return 0
+        return len(set(self._keyword_pattern.findall(question.lower())))
+
+    def open(self, chroma_client, reranker=None):
+        if self.vector_index:
+            from vector_index import MappedCollection
+            collection = MappedCollection(self.vector_index)
+        else:
+            collection = chroma_client().get_collection(name=self.collection_name)
+        sample = collection.get(limit=CENTROID_SAMPLE, include=["embeddings"])
+        vectors = np.asarray(sample["embeddings"], dtype=np.float32) if len(sample["ids"]) else None
+        if vectors is not None:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+            centroid = vectors.mean(axis=0)
+            self.centroid = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.retriever = HybridRetriever(collection, reranker=reranker)
+        return collection
+
+    @property
+    def dimension(self):
+        return len(self.centroid) if self.centroid is not None else None
+
+    def describe(self):
+        return {"collection": self.collection_name, "vector_index": self.vector_index,
+                "jurisdiction": self.jurisdiction, "doc_type": self.doc_type, "date": self.date,
+                "default": self.default, "open": self.retriever is not None}
+
+
+class CorpusRegistry:
+    def __init__(self, corpora, chroma_path="./chroma_db"):
+        if not corpora:
+            raise ValueError("The corpus registry needs at least one corpus")
+        names = [corpus.name for corpus in corpora]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate corpus names in {names}")
+        if not any(corpus.default for corpus in corpora):
+            corpora[0].default = True
+        self.corpora = corpora
+        self.chroma_path = chroma_path
+        self._chroma = None
+
+    def chroma_client(self):
+        # One client for every Chroma-backed corpus; chromadb is only imported if one is used
+        if self._chroma is None:
+            import chromadb
+            self._chroma = chromadb.PersistentClient(path=self.chroma_path)
+        return self._chroma
+
+    def open(self, reranker=None):
+        """Open every corpus; returns the embedding dimension they share"""
+        dimensions = {}
+        for corpus in self.corpora:
+            corpus.open(self.chroma_client, reranker)
+            if corpus.dimension is not None:
+                dimensions[corpus.name] = corpus.dimension
+        if len(set(dimensions.values())) > 1:
+            raise ValueError(f"Corpora were embedded with different dimensions: {dimensions}")
+        return next(iter(dimensions.values()), None)
+
+    def select(self, filters=None):
+        return [corpus for corpus in self.corpora if corpus.matches(filters)]
+
+    def describe(self):
+        return {corpus.name: corpus.describe() for corpus in self.corpora}
+
+
+def registry_from_env():
+    chroma_path = os.getenv("CHROMA_PATH", "./chroma_db")
+    path = os.getenv("CORPORA_CONFIG")
+    if not path:
+        # VECTOR_INDEX_PATH keeps serving the single-corpus deployment from an mmap export
+        return CorpusRegistry([Corpus(vector_index=os.getenv("VECTOR_INDEX_PATH") or None, **DEFAULT_CORPUS)],
+                              chroma_path)
+    with open(path) as f:
+        entries = json.load(f)
+    return CorpusRegistry([Corpus(**entry) for entry in entries], chroma_path)
+
+
+class CorpusRouter:
+    """Picks the corpora worth querying for a question, without a model call.
+
+    Corpora whose keywords appear in the question win; otherwise (and to rank keyword ties)
+    the question embedding is compared with each corpus centroid. Corpora more than `margin`
+    less similar than the best are skipped, and at most `max_corpora` are queried. Without
+    keywords or an embedding the default corpora are used.
+    """
+
+    def __init__(self, max_corpora=ROUTE_MAX_CORPORA, margin=ROUTE_MARGIN):
+        self.max_corpora = max_corpora
+        self.margin = margin
+
+    def route(self, question, corpora, embedding=None):
+        """[(corpus, weight)], best first; weight scales the corpus's scores when merging"""
+        if len(corpora) <= 1:
+            return [(corpus, 1.0) for corpus in corpora]
+        hits = [corpus.keyword_hits(question) for corpus in corpora]
+        if referenced_sections(question):
+            # "Article 21" / "Seventh Schedule" only resolve in corpora numbered that way
+            hits = [h + ("article" in c.keywords or "schedule" in c.keywords) for h, c in zip(hits, corpora)]
+        similarity = [None] * len(corpora)
+        if embedding is not None:
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            similarity = [float(c.centroid @ query) if c.centroid is not None and len(c.centroid) == len(query)
+                          else None for c in corpora]
+
+        candidates = [i for i, h in enumerate(hits) if h] or list(range(len(corpora)))
+        scored = [i for i in candidates if similarity[i] is not None]
+        if scored:
+            best = max(similarity[i] for i in scored)
+            candidates = [i for i in candidates if similarity[i] is None or similarity[i] >= best - self.margin]
+        elif not any(hits):
+            candidates = [i for i, corpus in enumerate(corpora) if corpus.default] or candidates
+
+        score = lambda i: hits[i] + (similarity[i] or 0.0)
+        ranked = sorted(candidates, key=score, reverse=True)[:self.max_corpora]
+        top = score(ranked[0])
+        return [(corpora[i], max(score(i), 0.0) / top if top > 0 else 1.0) for i in ranked]
+
+
+class MultiCorpusRetriever:
+    """HybridRetriever's interface over every corpus in the registry.
+
+    Each question is routed to a few corpora (after the request's metadata filters), which
+    are searched in parallel; their (RRF or reranker) scores are weighted by the router and
+    merged into one top-n list.
+    """
+
+    def __init__(self, registry, router=None, n_results=3, threads=CORPUS_SEARCH_THREADS):
+        self.registry = registry
+        self.router = router or CorpusRouter()
+        self.n_results = n_results
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="corpus-search")
+        self._lock = threading.Lock()
+        self._counters = {"routed": 0, "fanned_out": 0, "filtered_out": 0}
+        self._routed_to = {corpus.name: 0 for corpus in registry.corpora}
+
+    def lookup(self, question, filters=None):
+        """Chunks of the articles/schedules named in the question, from the first routed
+        corpus that has them, or None"""
+        if not referenced_sections(question):
+            return None
+        for corpus, _ in self._route(question, filters):
+            documents = corpus.retriever.lookup(question)
+            if documents:
+                return documents
+        return None
+
+    def search(self, question, embedding=None, filters=None):
+        return [text for text, _ in self.search_scored(question, embedding, filters)]
+
+    def search_scored(self, question, embedding=None, filters=None):
+        routed = self._route(question, filters, embedding)
+        if not routed:
+            return []
+        if len(routed) == 1:
+            return routed[0][0].retriever.search_scored(question, embedding)
+        futures = [(self._pool.submit(corpus.retriever.search_scored, question, embedding), weight)
+                   for corpus, weight in routed]
+        merged = {}
+        for future, weight in futures:
+            for text, score in future.result():
+                # The same chunk can live in two corpora (e.g. a statute quoting the Constitution)
+                merged[text] = max(merged.get(text, float("-inf")), score * weight)
+        ranked = sorted(merged.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:self.n_results]
+
+    def retrieve(self, question, embed, filters=None):
+        direct = self.lookup(question, filters)
+        if direct:
+            return direct
+        return self.search(question, embed(question), filters)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({f"routed_{name}": count for name, count in self._routed_to.items()})
+        stats["corpora"] = len(self.registry.corpora)
+        # Per-corpus HybridRetriever counters, summed
+        for corpus in self.registry.corpora:
+            if corpus.retriever is None:
+                continue
+            for key, value in corpus.retriever.stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats[key] = stats.get(key, 0) + value
+                elif key not in stats:
+                    stats[key] = value
+        return stats
+
+    def _route(self, question, filters, embedding=None):
+        corpora = [corpus for corpus in self.registry.select(filters) if corpus.retriever is not None]
+        routed = self.router.route(question, corpora, embedding)
+        with self._lock:
+            self._counters["routed"] += 1
+            self._counters["fanned_out"] += len(routed) > 1
+            self._counters["filtered_out"] += not corpora
+            for corpus, _ in routed:
+                self._routed_to[corpus.name] += 1
+        return routed
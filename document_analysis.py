@@ -0,0 +1,229 @@
+"""Map-reduce analysis of uploads too long for one prompt.
+
+The document is split into token-bounded chunks; each chunk is summarised into terse notes
+by its own Groq call (at most ANALYSIS_CONCURRENCY in flight), and the notes are reduced
+into the final answer, merging them in rounds first if they still exceed the reduce budget.
+The map prompt does not depend on the user's question, so a chunk's notes are cached by
+content hash and re-uploading a document (or one sharing most of its clauses) skips the
+map calls for every chunk seen before.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from context_builder import DOCUMENT_REVIEW_QUERY, count_tokens, split_into_chunks
+from prompt_utils import with_system_prompt
+from tracing import stage
+
+ANALYSIS_CHUNK_TOKENS = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "3000"))
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))
+# Cap on each chunk's notes, and on the notes handed to one reduce call
+ANALYSIS_NOTE_TOKENS = int(os.getenv("ANALYSIS_NOTE_TOKENS", "300"))
+ANALYSIS_REDUCE_TOKENS = int(os.getenv("ANALYSIS_REDUCE_TOKENS", "6000"))
+
+# Bump when the map prompt changes, so cached notes from the old prompt are not reused
+MAP_PROMPT_VERSION = "1"
+MAP_PROMPT = (
+    "You are reviewing one part of a longer legal document. Write terse notes on this part "
+    "only: parties, obligations, payment terms, dates and deadlines, term and termination, "
+    "liability and indemnity, confidentiality, governing law and dispute resolution, and any "
+    "unusual or risky clause. Cite clause numbers. Reply \"Nothing notable.\" if the part has "
+    "none of these.\n\nPart:\n{chunk}"
+)
+MERGE_PROMPT = (
+    "Merge these notes on consecutive parts of a legal document into one set of terse notes. "
+    "Keep every obligation, date, amount, risk and clause number; drop repetition.\n\n{notes}"
+)
+REDUCE_PROMPT = (
+    "Below are notes on every part of a document the user uploaded, in document order.\n\n"
+    "{notes}\n\nUsing these notes, {task}"
+)
+
+
+def chunk_key(model, chunk):
+    return hashlib.sha256(f"{model}\0{MAP_PROMPT_VERSION}\0{chunk}".encode("utf-8")).hexdigest()
+
+
+class ChunkNoteCache:
+    """Chunk notes by content hash: an in-process LRU backed by an optional SQLite file
+    (ANALYSIS_CACHE_PATH), shared by the workers like the embedding cache"""
+
+    def __init__(self, max_entries=4096, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._pid = None
+        self._connection = None
+
+    @property
+    def _db(self):
+        # Opened per process, like the embedding cache's
+        if self.path and self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_notes ("
+                "key TEXT PRIMARY KEY, notes TEXT NOT NULL, tokens INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """(notes, tokens the notes cost to produce), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry
+            if self._db is not None:
+                row = self._db.execute("SELECT notes, tokens FROM chunk_notes WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row)
+                    self._counters["disk_hits"] += 1
+                    return row
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key, notes, tokens):
+        with self._lock:
+            self._remember(key, (notes, tokens))
+            self._counters["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO chunk_notes (key, notes, tokens, created) VALUES (?, ?, ?, ?)",
+                    (key, notes, tokens, time.time()),
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        return stats
+
+    def _remember(self, key, entry):
+        # Caller holds the lock
+        self._entries[key] = tuple(entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+
+class MapReduceAnalyzer:
+    """`complete(messages, max_tokens)` makes one LLM call and returns (text, total tokens)"""
+
+    def __init__(self, complete, model, cache=None, chunk_tokens=ANALYSIS_CHUNK_TOKENS,
+                 concurrency=ANALYSIS_CONCURRENCY, note_tokens=ANALYSIS_NOTE_TOKENS,
+                 reduce_tokens=ANALYSIS_REDUCE_TOKENS):
+        self.complete = complete
+        self.model = model
+        self.cache = cache if cache is not None else ChunkNoteCache()
+        self.chunk_tokens = chunk_tokens
+        self.note_tokens = note_tokens
+        self.reduce_tokens = reduce_tokens
+        # The pool bounds the LLM calls in flight per process, across concurrent uploads
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="document-analysis")
+        self._lock = threading.Lock()
+        self._counters = {"documents": 0, "map_calls": 0, "merge_calls": 0, "reduce_calls": 0, "tokens": 0}
+
+    def analyze(self, text, question=None, history=(), on_progress=None):
+        """Returns {"answer", "chunks", "cached_chunks", "tokens", "map_seconds", "reduce_seconds"}.
+        on_progress(done, total) is called as chunk notes come in"""
+        chunks = split_into_chunks(text, self.chunk_tokens)
+        keys = [chunk_key(self.model, chunk) for chunk in chunks]
+        cached = [self.cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+        notes = [entry[0] if entry else None for entry in cached]
+        tokens = 0
+        done = len(chunks) - len(missing)
+        if on_progress:
+            on_progress(done, len(chunks))
+
+        started = time.perf_counter()
+        with stage("map"):
+            futures = {i: self._pool.submit(self._call, MAP_PROMPT.format(chunk=chunks[i]), "map_calls")
+                       for i in missing}
+            for i, future in futures.items():
+                notes[i], used = future.result()
+                self.cache.put(keys[i], notes[i], used)
+                tokens += used
+                done += 1
+                if on_progress:
+                    on_progress(done, len(chunks))
+        map_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with stage("reduce"):
+            labelled = [f"[Part {i + 1}]\n{note}" for i, note in enumerate(notes)
+                        if not (note or "").strip().lower().startswith("nothing notable")] or ["(No notable content.)"]
+            # Merge neighbouring notes until they fit one reduce prompt
+            while len(labelled) > 1 and count_tokens("\n\n".join(labelled)) > self.reduce_tokens:
+                groups = self._groups(labelled)
+                if len(groups) == len(labelled):
+                    break
+                merged = [self._pool.submit(self._call, MERGE_PROMPT.format(notes="\n\n".join(group)), "merge_calls")
+                          for group in groups]
+                labelled = []
+                for future in merged:
+                    merged_notes, used = future.result()
+                    labelled.append(merged_notes)
+                    tokens += used
+            task = (f"answer the user's request: {question}" if question
+                    else f"review the document for the user, covering: {DOCUMENT_REVIEW_QUERY}.")
+            prompt = REDUCE_PROMPT.format(notes="\n\n".join(labelled), task=task)
+            messages = with_system_prompt(list(history) + [{"role": "user", "content": prompt}])
+            answer, used = self.complete(messages, None)
+            tokens += used
+        with self._lock:
+            self._counters["documents"] += 1
+            self._counters["reduce_calls"] += 1
+            self._counters["tokens"] += tokens
+        return {
+            "answer": answer,
+            "chunks": len(chunks),
+            "cached_chunks": len(chunks) - len(missing),
+            "tokens": tokens,
+            "map_seconds": round(map_seconds, 3),
+            "reduce_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({f"cache_{key}": value for key, value in self.cache.stats().items()})
+        return stats
+
+    def _call(self, prompt, counter):
+        with self._lock:
+            self._counters[counter] += 1
+        return self.complete([{"role": "user", "content": prompt}], self.note_tokens)
+
+    def _groups(self, labelled):
+        # Consecutive notes packed into groups of at most half the reduce budget
+        groups, current, used = [], [], 0
+        for note in labelled:
+            tokens = count_tokens(note)
+            if current and used + tokens > self.reduce_tokens // 2:
+                groups.append(current)
+                current, used = [], 0
+            current.append(note)
+            used += tokens
+        groups.append(current)
+        return groups
+
+
+def analysis_cache_from_env():
+    return ChunkNoteCache(
+        max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", "4096")),
+        path=os.getenv("ANALYSIS_CACHE_PATH") or None,
+    )
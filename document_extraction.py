@@ -0,0 +1,104 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_MAX_PAGES = int(os.getenv("UPLOAD_MAX_PAGES", "500"))
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(os.cpu_count() or 1, 8))))
+# Below this many pages the pool's pickling overhead outweighs the parallelism
+PARALLEL_MIN_PAGES = int(os.getenv("EXTRACTION_PARALLEL_MIN_PAGES", "24"))
+
+PDF_TYPE = "application/pdf"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+TEXT_TYPE = "text/plain"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class DocumentTooLarge(Exception):
+    pass
+
+
+def get_pool():
+    # Created on first use so each gunicorn worker gets its own pool after forking
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def read_limited(stream, max_bytes=UPLOAD_MAX_BYTES):
+    """Read an upload stream into memory, refusing anything over max_bytes"""
+    data = stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise DocumentTooLarge(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+    return data
+
+
+def _extract_pdf_pages(data, start, stop):
+    # Runs in a pool process: each worker parses the document once and walks its page range
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def extract_pdf(data, max_pages=UPLOAD_MAX_PAGES, parallel=True):
+    # The parsers are imported on the first upload rather than at startup
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    if page_count > max_pages:
+        raise DocumentTooLarge(f"PDF has {page_count} pages; the limit is {max_pages}")
+
+    if not parallel or EXTRACTION_WORKERS < 2 or page_count < PARALLEL_MIN_PAGES:
+        return "".join(page.extract_text() or "" for page in reader.pages)
+
+    step = -(-page_count // EXTRACTION_WORKERS)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    pool = get_pool()
+    futures = [pool.submit(_extract_pdf_pages, data, start, stop) for start, stop in ranges]
+    return "".join(text for future in futures for text in future.result())
+
+
+def extract_docx(data):
+    import docx
+    document = docx.Document(io.BytesIO(data))
+    return "".join(paragraph.text + "\n" for paragraph in document.paragraphs)
+
+
+def extract_text(stream, file_type, max_bytes=UPLOAD_MAX_BYTES, max_pages=UPLOAD_MAX_PAGES, parallel=True):
+    """Extract text straight from an in-memory upload stream; raises DocumentTooLarge"""
+    data = read_limited(stream, max_bytes)
+
+    if file_type == TEXT_TYPE:
+        return data.decode("utf-8", errors="replace")
+
+    elif file_type == PDF_TYPE:
+        return extract_pdf(data, max_pages, parallel)
+
+    elif file_type == DOCX_TYPE:
+        return extract_docx(data)
+
+    return "Unsupported file type."
+
+
+def extract_file(path, file_type):
+    # Runs in a pool process for background upload jobs, which already parallelise across
+    # documents, so the pages of one document are not split further
+    with open(path, "rb") as f:
+        return extract_text(f, file_type, parallel=False)
+
+
+def extract_file_in_pool(path, file_type):
+    """extract_file in the process pool, or inline where no pool can be started (a
+    daemonic process, e.g. a server run by multiprocessing in the benchmarks)"""
+    if multiprocessing.current_process().daemon:
+        return extract_file(path, file_type)
+    return get_pool().submit(extract_file, path, file_type).result()
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    # bge-large-en is uncased, so case and whitespace differences produce the same vector
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: a bounded in-process LRU backed by an optional SQLite file.
+
+    The SQLite tier survives restarts and, in WAL mode, is shared by every gunicorn worker
+    pointing at the same path. Vectors are stored as packed float32.
+    """
+
+    def __init__(self, max_entries=2048, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+        self._pid = None
+        self._connection = None
+
+    @property
+    def _db(self):
+        # One connection per process, as in SQLiteConversationStore: a connection inherited
+        # across fork (gunicorn --preload) must not be used by the child
+        if self.path and self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, created REAL NOT NULL)"
+            )
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, model, text):
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return list(vector)
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = array("f")
+                    vector.frombytes(row[0])
+                    self._remember(key, vector)
+                    self._counters["disk_hits"] += 1
+                    return list(vector)
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, model, text, embedding):
+        key = cache_key(model, text)
+        vector = array("f", embedding)
+        with self._lock:
+            self._remember(key, vector)
+            self._counters["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, created) VALUES (?, ?, ?, ?)",
+                    (key, model, vector.tobytes(), time.time()),
+                )
+                self._db.commit()
+
+    def get_or_compute(self, model, text, compute):
+        embedding = self.get(model, text)
+        if embedding is None:
+            embedding = compute(text)
+            if embedding is not None:
+                self.put(model, text, embedding)
+        return embedding
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, vector):
+        # Caller holds the lock
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+
+def cache_from_env():
+    return EmbeddingCache(
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+        path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+    )
@@ -0,0 +1,229 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from upstream import CircuitBreaker, hedged
+
+CLOUDFLARE_API_BASE = os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4")
+EMBEDDING_MODEL = "@cf/baai/bge-large-en-v1.5"
+# Cloudflare accepts up to 100 texts per bge call
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "50"))
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "30"))
+# A call still unanswered after this many ms is sent again and the first answer wins; 0 is off
+EMBED_HEDGE_MS = float(os.getenv("EMBED_HEDGE_MS", "0"))
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+class EmbeddingClient:
+    """Cloudflare embedding client that coalesces concurrent requests into micro-batches.
+
+    Callers on any thread submit texts; a dispatcher thread gathers whatever arrives within
+    `window` seconds (up to `max_batch` texts) into one API call. At most `max_concurrency`
+    calls are in flight; while they are busy, new texts keep queueing and go out together,
+    so batches grow with load. 429s and 5xx responses are retried with jittered backoff.
+    A batch that still fails counts against a circuit breaker; while it is open, texts fail
+    at once and callers fall back to BM25 rather than queueing behind a dead upstream.
+    """
+
+    backend = "cloudflare"
+
+    def __init__(self, model=EMBEDDING_MODEL, api_base=None, account_id=None, api_token=None,
+                 max_batch=EMBED_MAX_BATCH, window=EMBED_BATCH_WINDOW_MS / 1000,
+                 max_concurrency=EMBED_MAX_CONCURRENCY, max_retries=EMBED_MAX_RETRIES, timeout=EMBED_TIMEOUT,
+                 expected_dimension=None, hedge_delay=EMBED_HEDGE_MS / 1000, breaker=None):
+        self.model = model
+        self.api_base = api_base or CLOUDFLARE_API_BASE
+        self.account_id = account_id
+        self.api_token = api_token
+        self.max_batch = max_batch
+        self.window = window
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker("embeddings")
+        # Vectors must match the Chroma collection they are queried against
+        self.expected_dimension = expected_dimension
+        self._pending = []
+        self._condition = None
+        self._slots = None
+        self._start_lock = threading.Lock()
+        self._counters = {"texts": 0, "batches": 0, "api_calls": 0, "retries": 0, "errors": 0, "coalesced": 0,
+                          "rejected": 0}
+        self._stats_lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._hedge_pool = None
+        self._session = None
+
+    def submit(self, text):
+        """Queue one text; returns a concurrent.futures.Future of its vector"""
+        future = Future()
+        self._ensure_started()
+        with self._condition:
+            self._pending.append((text, future))
+            self._condition.notify()
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    def embed_many(self, texts):
+        """Embed a list of texts (bulk ingestion); raises EmbeddingError if any batch fails"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats["backend"] = self.backend
+        stats["model"] = self.model
+        stats["mean_batch_size"] = round(stats["texts"] / stats["batches"], 2) if stats["batches"] else 0.0
+        breaker = self.breaker.stats()
+        stats["breaker_state"] = breaker["state"]
+        stats["breaker_open"] = breaker["open"]
+        stats["breaker_opened"] = breaker["opened"]
+        return stats
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, so each gunicorn worker runs its own dispatcher
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Fresh primitives: a lock copied across fork may be held by a thread that no longer exists
+            self._pending = []
+            self._condition = threading.Condition()
+            self._slots = threading.BoundedSemaphore(self.max_concurrency)
+            self._session = requests.Session()
+            # Hedged calls can double the connections in flight
+            pool_size = self.max_concurrency * (2 if self.hedge_delay else 1)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed")
+            self._hedge_pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="embed-hedge")
+            threading.Thread(target=self._dispatch, name="embed-dispatcher", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _dispatch(self):
+        while True:
+            # Wait for a free request slot first: texts that arrive meanwhile join the next batch
+            self._slots.acquire()
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        try:
+            if not self.breaker.allow():
+                with self._stats_lock:
+                    self._counters["rejected"] += len(batch)
+                error = EmbeddingError(f"{self.model} is failing; circuit open")
+                for _, future in batch:
+                    future.set_exception(error)
+                return
+            # Identical texts in one window share a slot in the request
+            unique = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                try:
+                    vectors = self._embed_batch(unique)
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                self.breaker.record_success()
+                if self.expected_dimension and len(vectors[0]) != self.expected_dimension:
+                    raise EmbeddingError(
+                        f"{self.model} returns {len(vectors[0])}-d vectors; "
+                        f"the collection expects {self.expected_dimension}")
+                vectors = dict(zip(unique, vectors))
+            except Exception as e:
+                with self._stats_lock:
+                    self._counters["errors"] += 1
+                error = e if isinstance(e, EmbeddingError) else EmbeddingError(str(e))
+                for _, future in batch:
+                    future.set_exception(error)
+                return
+            with self._stats_lock:
+                self._counters["texts"] += len(batch)
+                self._counters["batches"] += 1
+                self._counters["coalesced"] += len(batch) - len(unique)
+            for text, future in batch:
+                future.set_result(vectors[text])
+        finally:
+            self._slots.release()
+
+    def _embed_batch(self, texts):
+        # One Cloudflare call for the whole batch; subclasses swap in other backends
+        url = f"{self.api_base}/accounts/{self.account_id or os.getenv('CLOUDFLARE_ACCOUNT_ID')}/ai/run/{self.model}"
+        headers = {
+            "Authorization": f"Bearer {self.api_token or os.getenv('CLOUDFLARE_API_TOKEN')}",
+            "Content-Type": "application/json"
+        }
+        for attempt in range(self.max_retries + 1):
+            with self._stats_lock:
+                self._counters["api_calls"] += 1
+            try:
+                response = self._post(url, headers, texts)
+            except requests.RequestException as e:
+                status, error = None, e
+            else:
+                status, error = response.status_code, None
+                if status != 429 and status < 500:
+                    result = response.json()
+                    data = (result.get("result") or {}).get("data") if result.get("success") else None
+                    if data and len(data) == len(texts):
+                        return data
+                    raise EmbeddingError(f"Error getting embeddings: {result.get('errors', 'Unknown error')}")
+            if attempt == self.max_retries:
+                break
+            # Honour Retry-After when the rate limiter sends one; otherwise full-jitter backoff
+            retry_after = response.headers.get("Retry-After", "") if error is None else ""
+            if retry_after.replace(".", "", 1).isdigit():
+                delay = min(float(retry_after), 30.0)
+            else:
+                delay = random.uniform(0, min(8.0, 0.25 * 2 ** attempt))
+            print(f"Embedding call returned {status or error}, retrying in {delay:.2f}s")
+            with self._stats_lock:
+                self._counters["retries"] += 1
+            time.sleep(delay)
+        raise EmbeddingError(f"Embedding call failed after {self.max_retries + 1} attempts")
+
+    def _post(self, url, headers, texts):
+        post = lambda: self._session.post(url, headers=headers, json={"text": texts}, timeout=self.timeout)
+        if not self.hedge_delay:
+            return post()
+        # Embedding is idempotent, so a straggler can be raced by a second copy
+        return hedged(post, self.hedge_delay, self._hedge_pool)
+
+
+def embedding_client_from_env(api_base=None, expected_dimension=None, **cloudflare_options):
+    """EMBEDDING_BACKEND=cloudflare (default) or local (in-process ONNX bge)"""
+    backend = os.getenv("EMBEDDING_BACKEND", "cloudflare").lower()
+    if backend == "local":
+        from local_embeddings import LocalEmbeddingClient
+        return LocalEmbeddingClient(expected_dimension=expected_dimension)
+    if backend != "cloudflare":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; use cloudflare or local")
+    return EmbeddingClient(api_base=api_base, expected_dimension=expected_dimension, **cloudflare_options)
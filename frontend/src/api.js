@@ -1,14 +1,21 @@
 // const API_URL = 'http://localhost:5000/api';
 
-export const sendMessage = async (conversationHistory) => {
+// The server keeps the conversation; only the session id and the new message are sent
+export const sendMessage = async (message, sessionId) => {
   const response = await fetch('https://legal-chatbot-deploy-knhy.onrender.com/api/chat', {
     method: 'POST',
     credentials: 'include',
     headers: {
       'Content-Type': 'application/json',
     },
-    body: JSON.stringify({ conversation_history: conversationHistory }),
+    body: JSON.stringify({ message, session_id: sessionId }),
   });
+
+  // The session expired on the server: start a new one, and tell the caller the earlier
+  // conversation is gone
+  if (response.status === 404 && sessionId) {
+    return { ...(await sendMessage(message, null)), expired: true };
+  }
   
   if (!response.ok) {
     throw new Error('Failed to get response from API');
@@ -17,16 +24,22 @@ export const sendMessage = async (conversationHistory) => {
   return response.json();
 };
 
-export const uploadFile = async (file, conversationHistory) => {
+export const uploadFile = async (file, sessionId) => {
   const formData = new FormData();
   formData.append('file', file);
-  formData.append('conversation_history', JSON.stringify(conversationHistory));
+  if (sessionId) {
+    formData.append('session_id', sessionId);
+  }
   
   const response = await fetch('https://legal-chatbot-deploy-knhy.onrender.com/api/upload', {
     method: 'POST',
     credentials: 'include',
     body: formData,
   });
+
+  if (response.status === 404 && sessionId) {
+    return { ...(await uploadFile(file, null)), expired: true };
+  }
   
   if (!response.ok) {
     throw new Error('Failed to upload file');
@@ -2,12 +2,19 @@ import React, { useState, useEffect, useRef } from 'react';
 import { sendMessage } from '../api';
 import FileUploader from './FileUploader';
 
+// Shown when the server no longer has the session: earlier turns are not in the model's context
+const EXPIRED_NOTICE = {
+  role: 'assistant',
+  content: 'Your earlier conversation has expired on the server, so this answer does not take it into account.'
+};
+
 const Chat = () => {
   const [messages, setMessages] = useState([
     { role: 'assistant', content: 'Hello! I am your AI Assistant. How can I help you today?' }
   ]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  const [sessionId, setSessionId] = useState(null);
   const chatContainerRef = useRef(null);
 
   useEffect(() => {
@@ -104,10 +111,12 @@ const Chat = () => {
 
     try {
       const updatedHistory = [...messages, userMessage];
-      const { response } = await sendMessage(updatedHistory);
+      const { response, session_id, expired } = await sendMessage(input, sessionId);
+      setSessionId(session_id);
       
       setMessages([
         ...updatedHistory,
+        ...(expired ? [EXPIRED_NOTICE] : []),
         { role: 'assistant', content: response }
       ]);
     } catch (error) {
@@ -122,9 +131,11 @@ const Chat = () => {
     }
   };
 
-  const handleFileUploadResponse = (extractedText, aiResponse) => {
+  const handleFileUploadResponse = (extractedText, aiResponse, newSessionId, expired) => {
+    setSessionId(newSessionId);
     setMessages([
       ...messages,
+      ...(expired ? [EXPIRED_NOTICE] : []),
       { role: 'user', content: extractedText },
       { role: 'assistant', content: aiResponse }
     ]);
@@ -173,7 +184,7 @@ const Chat = () => {
       </form>
       
       <FileUploader 
-        conversationHistory={messages}
+        sessionId={sessionId}
         onUploadComplete={handleFileUploadResponse}
       />
     </div>
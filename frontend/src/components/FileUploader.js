@@ -1,7 +1,7 @@
 import React, { useState } from 'react';
 import { uploadFile } from '../api';
 
-const FileUploader = ({ conversationHistory, onUploadComplete }) => {
+const FileUploader = ({ sessionId, onUploadComplete }) => {
   const [file, setFile] = useState(null);
   const [uploading, setUploading] = useState(false);
 
@@ -15,8 +15,8 @@ const FileUploader = ({ conversationHistory, onUploadComplete }) => {
 
     setUploading(true);
     try {
-      const { extracted_text, ai_response } = await uploadFile(file, conversationHistory);
-      onUploadComplete(extracted_text, ai_response);
+      const { extracted_text, ai_response, session_id, expired } = await uploadFile(file, sessionId);
+      onUploadComplete(extracted_text, ai_response, session_id, expired);
       setFile(null);
     } catch (error) {
       console.error('Error uploading file:', error);
@@ -0,0 +1,282 @@
+import itertools
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can does do for from how i in is it its me of on or say says "
+    "tell that the this to under what when where which who why with".split()
+)
+
+ORDINALS = [
+    "first", "second", "third", "fourth", "fifth", "sixth",
+    "seventh", "eighth", "ninth", "tenth", "eleventh", "twelfth",
+]
+ROMAN = ["i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x", "xi", "xii"]
+
+# "Article 370", "art. 21A", "Articles 14 and 15"
+ARTICLE_REFERENCE = re.compile(
+    r"\bart(?:icle)?s?\.?\s+(\d{1,3}[a-z]{0,3})\b((?:\s*(?:,|and|&)\s*\d{1,3}[a-z]{0,3}\b)*)",
+    re.IGNORECASE,
+)
+# "Schedule VII", "7th Schedule", "Seventh Schedule"
+SCHEDULE_REFERENCE = re.compile(
+    r"\bschedule\s+(" + "|".join(ROMAN[::-1]) + r"|\d{1,2})\b"
+    r"|\b(" + "|".join(ORDINALS) + r"|\d{1,2}(?:st|nd|rd|th))\s+schedule\b",
+    re.IGNORECASE,
+)
+# Fallback for chunks stored without a "section" label
+ARTICLE_HEADING = re.compile(r"^(?:\d*\[)?(\d{1,3}[A-Z]{0,3})\.\s*(?:\d*\[)?[A-Z]")
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def schedule_name(reference):
+    """Map "VII", "7", "7th" or "seventh" to "Seventh Schedule"; None if out of range"""
+    reference = reference.lower()
+    if reference in ORDINALS:
+        index = ORDINALS.index(reference)
+    elif reference in ROMAN:
+        index = ROMAN.index(reference)
+    else:
+        index = int(re.match(r"\d+", reference).group()) - 1
+    if 0 <= index < len(ORDINALS):
+        return f"{ORDINALS[index].title()} Schedule"
+    return None
+
+
+def referenced_sections(question):
+    """Sections named in the question, e.g. ["Article 370", "Seventh Schedule"]"""
+    sections = []
+    for match in ARTICLE_REFERENCE.finditer(question):
+        numbers = [match.group(1)] + re.findall(r"\d{1,3}[a-z]{0,3}", match.group(2) or "", re.IGNORECASE)
+        sections.extend(f"Article {number.upper()}" for number in numbers)
+    for match in SCHEDULE_REFERENCE.finditer(question):
+        name = schedule_name(match.group(1) or match.group(2))
+        if name:
+            sections.append(name)
+    return list(dict.fromkeys(sections))
+
+
+def section_of(document, metadata):
+    section = (metadata or {}).get("section")
+    if section:
+        # "Seventh Schedule, item 12" belongs to the Seventh Schedule
+        return section.split(",")[0]
+    match = ARTICLE_HEADING.match(document)
+    return f"Article {match.group(1)}" if match else None
+
+
+class BM25Index:
+    """In-memory inverted index scored with Okapi BM25.
+
+    Postings are stored per term as numpy arrays of (document index, term frequency), so a
+    query costs one vectorised update per query term.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        lengths = np.zeros(self.size, dtype=np.float32)
+        postings = defaultdict(lambda: ([], []))
+        for index, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            lengths[index] = sum(counts.values())
+            for term, count in counts.items():
+                postings[term][0].append(index)
+                postings[term][1].append(count)
+        self.average_length = float(lengths.mean()) if self.size else 0.0
+        # Length normalisation is the same for every term, so fold it in once
+        self._norm = k1 * (1 - b + b * lengths / (self.average_length or 1))
+        self._postings = {
+            term: (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.float32))
+            for term, (ids, tfs) in postings.items()
+        }
+
+    def search(self, query, limit=20):
+        """Return [(document index, score)] for the best `limit` matches"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self._postings:
+                continue
+            ids, tfs = self._postings[term]
+            idf = math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[ids])
+        matched = np.flatnonzero(scores)
+        if len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit)[:limit]]
+        ranked = matched[np.argsort(-scores[matched])]
+        return [(int(index), float(scores[index])) for index in ranked]
+
+
+def reciprocal_rank_fusion(rankings, k=60, with_scores=False):
+    """Fuse several ranked lists of ids; an id ranked r in a list scores 1 / (k + r)"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    return (fused, scores) if with_scores else fused
+
+
+class LexicalReranker:
+    """Dependency-free reranker: query-term coverage plus adjacent-pair (phrase) matches"""
+
+    def score(self, query, documents):
+        terms = tokenize(query)
+        unique = set(terms)
+        pairs = set(zip(terms, terms[1:]))
+        scores = []
+        for document in documents:
+            tokens = tokenize(document)
+            present = unique.intersection(tokens)
+            phrase_hits = len(pairs.intersection(zip(tokens, tokens[1:])))
+            scores.append(len(present) / (len(unique) or 1) + 0.5 * phrase_hits / (len(pairs) or 1))
+        return scores
+
+
+class CrossEncoderReranker:
+    """Local cross-encoder (sentence-transformers); only loaded when RERANKER=cross-encoder"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name)
+
+    def score(self, query, documents):
+        return [float(s) for s in self.model.predict([(query, document) for document in documents])]
+
+
+def reranker_from_env():
+    kind = os.getenv("RERANKER", "").lower()
+    if kind == "lexical":
+        return LexicalReranker()
+    if kind == "cross-encoder":
+        try:
+            return CrossEncoderReranker(os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"))
+        except ImportError:
+            print("RERANKER=cross-encoder needs sentence-transformers; reranking disabled")
+    return None
+
+
+class HybridRetriever:
+    """BM25 + dense retrieval over the Chroma collection, fused with reciprocal rank fusion.
+
+    Questions that name an article or schedule are answered straight from a section index
+    without an embedding call. The BM25 and section indexes are built from the collection on
+    first use and rebuilt when its size changes (checked at most every `refresh_interval` s).
+    """
+
+    def __init__(self, collection, n_results=3, candidates=20, rrf_k=60, reranker=None, refresh_interval=60):
+        self.collection = collection
+        self.n_results = n_results
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._checked = 0.0
+        self._counters = {"direct": 0, "hybrid": 0, "sparse_only": 0, "builds": 0}
+
+    def lookup(self, question):
+        """Chunks of the articles/schedules named in the question, or None"""
+        sections = referenced_sections(question)
+        if not sections:
+            return None
+        index = self._ensure_index()
+        chunk_lists = [index["sections"][section] for section in sections if section in index["sections"]]
+        if not chunk_lists:
+            return None
+        with self._lock:
+            self._counters["direct"] += 1
+        # Round-robin over the named sections so "Articles 14 and 15" gets the opening chunk
+        # of each before the continuation chunks of either
+        found = [i for row in itertools.zip_longest(*chunk_lists) for i in row if i is not None]
+        return [index["documents"][i] for i in found[:max(self.n_results, len(chunk_lists))]]
+
+    def search(self, question, embedding=None):
+        """Fuse BM25 with the dense Chroma ranking; BM25 alone when there is no embedding"""
+        return [text for text, _ in self.search_scored(question, embedding)]
+
+    def search_scored(self, question, embedding=None):
+        """search(), with each text's fused (or reranker) score for merging across corpora"""
+        index = self._ensure_index()
+        sparse = [index["ids"][i] for i, _ in index["bm25"].search(question, self.candidates)]
+        rankings = [sparse]
+        documents = {}
+        if embedding is not None:
+            result = self.collection.query(query_embeddings=[embedding], n_results=self.candidates)
+            dense = result["ids"][0] if result["ids"] else []
+            documents.update(zip(dense, result["documents"][0] if result["documents"] else []))
+            rankings.insert(0, dense)
+        fused, fused_scores = reciprocal_rank_fusion(rankings, self.rrf_k, with_scores=True)
+        with self._lock:
+            self._counters["hybrid" if embedding is not None else "sparse_only"] += 1
+
+        positions = index["positions"]
+        kept = [i for i in fused[:self.candidates] if i in documents or i in positions]
+        texts = [documents.get(i) or index["documents"][positions[i]] for i in kept]
+        scores = [fused_scores[i] for i in kept]
+        if self.reranker and len(texts) > self.n_results:
+            scores = self.reranker.score(question, texts)
+            order = sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+            texts, scores = [texts[i] for i in order], [scores[i] for i in order]
+        return list(zip(texts, scores))[:self.n_results]
+
+    def retrieve(self, question, embed):
+        """Direct section lookup if the question names one, else hybrid search"""
+        direct = self.lookup(question)
+        if direct:
+            return direct
+        return self.search(question, embed(question))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["indexed_chunks"] = len(self._index["ids"]) if self._index else 0
+            stats["reranker"] = type(self.reranker).__name__ if self.reranker else None
+        return stats
+
+    def _ensure_index(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._index is not None and now - self._checked < self.refresh_interval:
+                return self._index
+            self._checked = now
+            current = self._index
+        if current is not None and self.collection.count() == len(current["ids"]):
+            return current
+        index = self._build()
+        with self._lock:
+            self._index = index
+            self._counters["builds"] += 1
+        return index
+
+    def _build(self):
+        data = self.collection.get(include=["documents", "metadatas"])
+        ids = data["ids"]
+        documents = data["documents"] or []
+        metadatas = data["metadatas"] or [None] * len(ids)
+        # Section chunks in reading order, so an article's opening chunk comes first
+        order = sorted(range(len(ids)), key=lambda i: (metadatas[i] or {}).get("seq", i))
+        sections = defaultdict(list)
+        for i in order:
+            section = section_of(documents[i], metadatas[i])
+            if section:
+                sections[section].append(i)
+        return {
+            "ids": ids,
+            "documents": documents,
+            "positions": {chunk_id: i for i, chunk_id in enumerate(ids)},
+            "sections": dict(sections),
+            "bm25": BM25Index(documents),
+        }
@@ -0,0 +1,161 @@
+"""In-process bge-large-en-v1.5 embeddings on CPU with onnxruntime.
+
+    EMBEDDING_BACKEND=local EMBEDDING_ONNX_DIR=./models/bge-large-en-v1.5 gunicorn app:app
+
+EMBEDDING_ONNX_DIR holds an ONNX export of BAAI/bge-large-en-v1.5 (model.onnx, or
+onnx/model.onnx as published on the Hugging Face hub) and its tokenizer.json. An int8
+copy is used when present; create one with
+
+    python local_embeddings.py quantize --model-dir ./models/bge-large-en-v1.5
+
+(needs the `onnx` package). Before switching a deployment over, check that the local
+vectors line up with the ones already stored in Chroma:
+
+    python local_embeddings.py check --chroma-path ./chroma_db
+"""
+import argparse
+import os
+import threading
+
+import numpy as np
+
+from embedding_client import EmbeddingClient, EmbeddingError
+
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "./models/bge-large-en-v1.5")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", str(min(os.cpu_count() or 1, 4))))
+EMBEDDING_LOCAL_BATCH = int(os.getenv("EMBEDDING_LOCAL_BATCH", "16"))
+# bge-large-en-v1.5 was trained on at most 512 tokens; Cloudflare truncates the same way
+MAX_TOKENS = 512
+
+
+def find_model_file(model_dir):
+    """Prefer the int8 model, then the float one, in the directory or its onnx/ subfolder"""
+    for name in ("model_quantized.onnx", "model.onnx"):
+        for folder in (model_dir, os.path.join(model_dir, "onnx")):
+            path = os.path.join(folder, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+class LocalEmbeddingClient(EmbeddingClient):
+    """EmbeddingClient whose batches run through a local ONNX model instead of Cloudflare.
+
+    The model is loaded on first use, once per process. Concurrent callers are still
+    coalesced into one batch; a single batch at a time uses `threads` intra-op threads.
+    """
+
+    backend = "local"
+
+    def __init__(self, model_dir=EMBEDDING_ONNX_DIR, threads=EMBEDDING_THREADS, batch_size=EMBEDDING_LOCAL_BATCH,
+                 expected_dimension=None):
+        self.model_dir = model_dir
+        self.model_path = os.getenv("EMBEDDING_ONNX_FILE") or find_model_file(model_dir)
+        self.threads = threads
+        self.batch_size = batch_size
+        quantized = bool(self.model_path) and "quantized" in os.path.basename(self.model_path)
+        super().__init__(
+            model="local/bge-large-en-v1.5" + ("-int8" if quantized else ""),
+            max_batch=batch_size * 4, window=0.002, max_concurrency=1, max_retries=0,
+            expected_dimension=expected_dimension, hedge_delay=0,
+        )
+        self._load_lock = threading.Lock()
+        self._loaded_pid = None
+        self._inference = None
+        self._tokenizer = None
+        self._input_names = ()
+
+    def _load(self):
+        if self._loaded_pid == os.getpid():
+            return
+        with self._load_lock:
+            if self._loaded_pid == os.getpid():
+                return
+            import onnxruntime
+            from tokenizers import Tokenizer
+
+            if not self.model_path:
+                raise EmbeddingError(f"No model.onnx or model_quantized.onnx under {self.model_dir}")
+            tokenizer_path = os.path.join(self.model_dir, "tokenizer.json")
+            if not os.path.exists(tokenizer_path):
+                raise EmbeddingError(f"No tokenizer.json under {self.model_dir}")
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._inference = onnxruntime.InferenceSession(
+                self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+            self._input_names = {i.name for i in self._inference.get_inputs()}
+
+            self._tokenizer = Tokenizer.from_file(tokenizer_path)
+            self._tokenizer.enable_truncation(max_length=MAX_TOKENS)
+            self._tokenizer.enable_padding()
+            print(f"Loaded {self.model_path} with {self.threads} threads")
+            self._loaded_pid = os.getpid()
+
+    def _embed_batch(self, texts):
+        self._load()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self._tokenizer.encode_batch(texts[start:start + self.batch_size])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            output = self._inference.run(None, {k: v for k, v in inputs.items() if k in self._input_names})[0]
+            # bge pools with the [CLS] token, then L2-normalises
+            pooled = output[:, 0] if output.ndim == 3 else output
+            pooled = pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(min=1e-12)
+            vectors.extend(pooled.astype(np.float32).tolist())
+        return vectors
+
+
+def quantize(model_dir):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = os.path.join(model_dir, "model.onnx")
+    if not os.path.exists(source):
+        source = os.path.join(model_dir, "onnx", "model.onnx")
+    target = os.path.join(os.path.dirname(source), "model_quantized.onnx")
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    print(f"Wrote {target} ({os.path.getsize(target) / 1e6:.0f} MB, was {os.path.getsize(source) / 1e6:.0f} MB)")
+
+
+def check(chroma_path, collection_name, samples, min_similarity):
+    """Embed stored chunks locally and compare with the vectors already in the collection"""
+    import chromadb
+
+    collection = chromadb.PersistentClient(path=chroma_path).get_collection(collection_name)
+    stored = collection.get(limit=samples, include=["documents", "embeddings"])
+    if not len(stored["ids"]):
+        raise SystemExit(f"{collection_name} is empty; nothing to compare against")
+    expected = np.asarray(stored["embeddings"], dtype=np.float32)
+    client = LocalEmbeddingClient(expected_dimension=expected.shape[1])
+    local = np.asarray(client.embed_many(stored["documents"]), dtype=np.float32)
+
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True).clip(min=1e-12)
+    similarity = np.sum(local * expected, axis=1)
+    print(f"{client.model}: {local.shape[1]}-d, collection {expected.shape[1]}-d; cosine with stored vectors "
+          f"mean={similarity.mean():.4f} min={similarity.min():.4f} over {len(similarity)} chunks")
+    if similarity.min() < min_similarity:
+        raise SystemExit(f"Local vectors diverge from the collection (min cosine < {min_similarity}); re-ingest first")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local ONNX embedding backend tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    quantize_parser = commands.add_parser("quantize", help="write an int8 copy of model.onnx")
+    quantize_parser.add_argument("--model-dir", default=EMBEDDING_ONNX_DIR)
+    check_parser = commands.add_parser("check", help="compare local vectors with the stored collection")
+    check_parser.add_argument("--chroma-path", default=os.getenv("CHROMA_PATH", "./chroma_db"))
+    check_parser.add_argument("--collection", default="constitution_embeddings")
+    check_parser.add_argument("--samples", type=int, default=32)
+    check_parser.add_argument("--min-similarity", type=float, default=0.9)
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        quantize(args.model_dir)
+    else:
+        check(args.chroma_path, args.collection, args.samples, args.min_similarity)
@@ -0,0 +1,134 @@
+"""Process-local counters and histograms rendered in the Prometheus text format.
+
+Each gunicorn/uvicorn worker keeps its own registry, so a scrape through the load balancer
+sees one worker; scrape the workers individually or sum per instance in the query.
+"""
+import bisect
+import math
+import threading
+
+# Seconds; the top buckets cover slow Groq completions and long uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name + "_total", format_labels(self.labelnames, key), value)
+                for key, value in sorted(values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        samples = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, [("le", format_value(bound))])
+                samples.append((self.name + "_bucket", labels, cumulative))
+            labels = format_labels(self.labelnames, key)
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix, stats):
+        """Export the numeric fields of a component's stats() dict as gauges on each scrape;
+        `stats` returns None while the component is not loaded"""
+        self._collectors.append((prefix, stats))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {format_value(value)}" for name, labels, value in metric.samples())
+        for prefix, stats in self._collectors:
+            for key, value in sorted((stats() or {}).items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("chatbot_requests", "HTTP requests handled", ["route", "method", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("chatbot_request_seconds", "End-to-end request latency", ["route"])
+STAGE_SECONDS = REGISTRY.histogram("chatbot_stage_seconds", "Time per pipeline stage within a request", ["stage"])
+FIRST_TOKEN_SECONDS = REGISTRY.histogram("chatbot_llm_first_token_seconds",
+                                         "Time from sending the Groq request to the first streamed token")
+LLM_TOKENS = REGISTRY.counter("chatbot_llm_tokens", "Tokens reported in Groq usage", ["kind"])
+DEGRADED_ANSWERS = REGISTRY.counter("chatbot_degraded_answers",
+                                    "Chats answered without Groq while it was unreachable", ["kind"])
+SLOW_REQUESTS = REGISTRY.counter("chatbot_slow_requests", "Requests over SLOW_REQUEST_MS", ["route"])
@@ -66,3 +66,27 @@ def usecase_prompt():
         "the platform is seamless and empowering. Aim to provide value at every step of their legal journey, "
         "from initial advice to ongoing compliance support."
     )
+
+
+FORMATTING_INSTRUCTIONS = (
+    "Please ensure your response preserves formatting like spacing, indentation, and structure, "
+    "especially for content like emails, code, or formal documents. Use proper paragraph breaks "
+    "and maintain the intended layout."
+)
+
+# Built once at import; every request starts with exactly these bytes so Groq's prompt
+# cache can reuse the prefix across turns and conversations
+SYSTEM_PROMPT = usecase_prompt() + "\n\n" + FORMATTING_INSTRUCTIONS
+
+
+def system_message():
+    return {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def with_system_prompt(conversation_history):
+    """Return a new history that starts with the one system prompt.
+
+    System messages sent by the client are dropped, so applying this any number of times
+    gives the same result and the history passed in is left untouched.
+    """
+    return [system_message()] + [m for m in conversation_history if m["role"] != "system"]
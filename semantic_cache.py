@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from hybrid_retrieval import referenced_sections
+
+
+def conversation_key(conversation_history):
+    """Hash of everything before the latest question, ignoring system prompts.
+
+    Answers are only reused between conversations whose earlier turns match, so a follow-up
+    like "and what about clause 2?" never gets an answer written for a different thread.
+    """
+    turns = [
+        (m["role"], m["content"]) for m in conversation_history
+        if m["role"] != "system"
+    ]
+    # Drop the latest user message; that is what the embedding lookup compares
+    for i in range(len(turns) - 1, -1, -1):
+        if turns[i][0] == "user":
+            del turns[i]
+            break
+    return hashlib.sha256(json.dumps(turns).encode("utf-8")).hexdigest()
+
+
+def question_sections(conversation_history):
+    """Articles and schedules the latest question names, in a fixed order.
+
+    "What is Article 21?" and "What is Article 22?" embed almost identically, so an answer
+    is only reused for a question naming exactly the same sections.
+    """
+    question = next((m["content"] for m in reversed(conversation_history) if m["role"] == "user"), "")
+    return tuple(sorted(referenced_sections(question)))
+
+
+class SemanticCache:
+    """Answer cache keyed by question embedding, earlier turns and the sections named.
+
+    Vectors live in a preallocated float32 matrix, so a lookup is one matrix-vector product
+    over at most `max_entries` rows. Entries expire after `ttl` seconds and the least recently
+    used one is evicted when the cache is full.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=1000, ttl=86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._matrix = None
+        self._entries = [None] * max_entries
+        self._lru = OrderedDict()
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._counters = {
+            "lookups": 0, "hits": 0, "misses": 0, "context_bypasses": 0, "section_bypasses": 0,
+            "stores": 0, "evictions": 0, "expirations": 0, "saved_tokens": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def lookup(self, embedding, conversation_history, threshold=None):
+        # A looser threshold serves near-misses when Groq is unreachable
+        threshold = self.threshold if threshold is None else threshold
+        if not self.enabled or embedding is None:
+            return None
+        query = self._normalize(embedding)
+        context = conversation_key(conversation_history)
+        sections = question_sections(conversation_history)
+        now = time.time()
+        with self._lock:
+            self._counters["lookups"] += 1
+            if self._matrix is None or not self._lru or query.shape[0] != self._matrix.shape[1]:
+                self._counters["misses"] += 1
+                return None
+            scores = self._matrix @ query
+            candidates = np.flatnonzero(scores >= threshold)
+            for slot in candidates[np.argsort(-scores[candidates])]:
+                entry = self._entries[slot]
+                if entry is None:
+                    continue
+                if entry["expires"] <= now:
+                    self._release(slot)
+                    self._counters["expirations"] += 1
+                    continue
+                if entry["context"] != context:
+                    self._counters["context_bypasses"] += 1
+                    continue
+                if entry["sections"] != sections:
+                    self._counters["section_bypasses"] += 1
+                    continue
+                self._lru.move_to_end(slot)
+                self._counters["hits"] += 1
+                self._counters["saved_tokens"] += entry["tokens"]
+                return entry["answer"]
+            self._counters["misses"] += 1
+            return None
+
+    def store(self, embedding, conversation_history, answer, tokens=0):
+        if not self.enabled or embedding is None or not answer:
+            return
+        vector = self._normalize(embedding)
+        entry = {
+            "answer": answer,
+            "context": conversation_key(conversation_history),
+            "sections": question_sections(conversation_history),
+            "tokens": tokens or 0,
+            "expires": time.time() + self.ttl,
+        }
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                # First store, or the embedding model changed: start over at the new dimension
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._entries = [None] * self.max_entries
+                self._lru.clear()
+                self._free = list(range(self.max_entries - 1, -1, -1))
+            if not self._free:
+                oldest, _ = self._lru.popitem(last=False)
+                self._release(oldest, in_lru=False)
+                self._counters["evictions"] += 1
+            slot = self._free.pop()
+            self._matrix[slot] = vector
+            self._entries[slot] = entry
+            self._lru[slot] = None
+            self._counters["stores"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._lru)
+        stats["hit_ratio"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        return stats
+
+    def _release(self, slot, in_lru=True):
+        # Caller holds the lock; zeroed rows score 0 and can never pass the threshold
+        self._matrix[slot] = 0
+        self._entries[slot] = None
+        if in_lru:
+            self._lru.pop(slot, None)
+        self._free.append(slot)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def answer_cache_from_env():
+    return SemanticCache(
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+        max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+        ttl=int(os.getenv("ANSWER_CACHE_TTL", "86400")),
+    )
@@ -0,0 +1,138 @@
+"""Ephemeral per-session index of uploaded documents.
+
+An upload in session mode is split into chunks and indexed here; follow-up questions then
+retrieve the few chunks they need instead of the whole document riding along in every
+prompt. Vectors are stored as float16. Chunks whose embedding failed are still found by the
+lexical scorer.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from conversation_store import conversation_store_path
+from hybrid_retrieval import LexicalReranker
+
+SESSION_INDEX_RESULTS = int(os.getenv("SESSION_INDEX_RESULTS", "4"))
+
+
+class SessionDocumentIndex:
+    """Chunks and vectors per session in SQLite, dropped with the session's TTL.
+
+    In a file next to the conversation store by default, so a follow-up question finds the
+    upload whichever worker (or upload job process) indexed it. In memory when the
+    conversation store is, since sessions are then per process anyway.
+    """
+
+    def __init__(self, path=":memory:", ttl=86400, max_chunks=2000, n_results=SESSION_INDEX_RESULTS):
+        self.path = path
+        self.ttl = ttl
+        self.max_chunks = max_chunks
+        self.n_results = n_results
+        self.scorer = LexicalReranker()
+        self._lock = threading.Lock()
+        self._counters = {"documents": 0, "chunks_added": 0, "searches": 0, "lexical_searches": 0, "expirations": 0}
+        self._pid = None
+        self._connection = None
+
+    @property
+    def _db(self):
+        # One connection per process, as in SQLiteConversationStore: a connection inherited
+        # across fork (gunicorn --preload) must not be used by the child
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False,
+                                               isolation_level=None)
+            if self.path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, filename TEXT, text TEXT NOT NULL, "
+                "vector BLOB, created REAL NOT NULL, PRIMARY KEY (session_id, seq));"
+                "CREATE INDEX IF NOT EXISTS chunks_created ON chunks (created);"
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def add(self, session_id, filename, chunks, vectors=None):
+        """Index a document's chunks for the session; `vectors` may be None (no embeddings)"""
+        now = time.time()
+        vectors = vectors or [None] * len(chunks)
+        blobs = [np.asarray(v, dtype=np.float16).tobytes() if v is not None else None for v in vectors]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._db.execute("DELETE FROM chunks WHERE created <= ?", (now - self.ttl,)).rowcount
+                seq = self._db.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM chunks WHERE session_id = ?", (session_id,)).fetchone()[0]
+                self._db.executemany(
+                    "INSERT INTO chunks (session_id, seq, filename, text, vector, created) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(session_id, seq + i + 1, filename, text, blob, now)
+                     for i, (text, blob) in enumerate(zip(chunks, blobs))],
+                )
+                # Keep the most recent uploads when a session exceeds max_chunks
+                self._db.execute("DELETE FROM chunks WHERE session_id = ? AND seq <= ?",
+                                 (session_id, seq + len(chunks) - self.max_chunks))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._counters["documents"] += 1
+            self._counters["chunks_added"] += len(chunks)
+            self._counters["expirations"] += expired
+
+    def has_documents(self, session_id):
+        if not session_id:
+            return False
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM chunks WHERE session_id = ? AND created > ? LIMIT 1",
+                                   (session_id, time.time() - self.ttl)).fetchone()
+        return row is not None
+
+    def search(self, session_id, question, embedding=None):
+        """The session's chunks most relevant to the question, in document order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, text, vector FROM chunks WHERE session_id = ? AND created > ? ORDER BY seq",
+                (session_id, time.time() - self.ttl),
+            ).fetchall()
+            self._counters["searches"] += 1
+        if not rows:
+            return []
+        scores = self.scorer.score(question, [text for _, text, _ in rows])
+        dimension = len(embedding) if embedding is not None else None
+        if dimension and all(blob is not None and len(blob) == 2 * dimension for _, _, blob in rows):
+            matrix = np.frombuffer(b"".join(blob for _, _, blob in rows), dtype=np.float16)
+            matrix = matrix.reshape(len(rows), dimension).astype(np.float32)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            query = np.asarray(embedding, dtype=np.float32)
+            # Cosine similarity, with the lexical score breaking near-ties
+            scores = matrix @ (query / (np.linalg.norm(query) or 1.0)) + 0.05 * np.asarray(scores)
+        else:
+            with self._lock:
+                self._counters["lexical_searches"] += 1
+        best = sorted(np.argsort(-np.asarray(scores))[:self.n_results])
+        return [rows[i][1] for i in best]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["sessions"], stats["chunks"] = self._db.execute(
+                "SELECT COUNT(DISTINCT session_id), COUNT(*) FROM chunks").fetchone()
+        stats["backend"] = "sqlite" if self.path != ":memory:" else "memory"
+        return stats
+
+
+def session_index_from_env():
+    path = os.getenv("SESSION_INDEX_PATH")
+    if not path:
+        conversations = conversation_store_path()
+        path = ":memory:" if conversations == "memory" else \
+            os.path.splitext(conversations)[0] + "-session-index.sqlite3"
+    return SessionDocumentIndex(
+        path,
+        ttl=int(os.getenv("CONVERSATION_TTL", "86400")),
+        max_chunks=int(os.getenv("SESSION_INDEX_MAX_CHUNKS", "2000")),
+    )
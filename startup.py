@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+# eager: open everything while importing (fail fast); lazy: on first use;
+# background: start opening in a warm-up thread straight away, without blocking the import
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background").lower()
+
+
+class LazyResource:
+    """A dependency (vector store, API client) built by `factory` on first use.
+
+    Built once per process: a worker forked after the parent built it builds its own
+    rather than sharing a client's sockets and locks. Failures are remembered for the
+    health report and retried on the next use.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+        self._error = None
+        self._load_seconds = None
+
+    def get(self):
+        if self._pid == os.getpid():
+            return self._value
+        with self._lock:
+            if self._pid != os.getpid():
+                started = time.perf_counter()
+                try:
+                    value = self.factory()
+                except Exception as e:
+                    self._error = str(e)
+                    raise
+                self._value, self._error = value, None
+                self._load_seconds = round(time.perf_counter() - started, 3)
+                print(f"{self.name} ready in {self._load_seconds}s")
+                self._pid = os.getpid()
+            return self._value
+
+    def peek(self):
+        """The value if it is already built in this process, without building it"""
+        return self._value if self.ready else None
+
+    @property
+    def ready(self):
+        return self._pid == os.getpid()
+
+    def status(self):
+        status = {"ready": self.ready, "load_seconds": self._load_seconds}
+        if self._error:
+            status["error"] = self._error
+        return status
+
+    # Lets a resource stand in for the old module-level client in attribute access
+    def __getattr__(self, attribute):
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+        return getattr(self.get(), attribute)
+
+
+def start_warmup(resources):
+    """Build the resources in a daemon thread; requests arriving first wait on the same lock"""
+
+    def warm():
+        for resource in resources:
+            try:
+                resource.get()
+            except Exception as e:
+                print(f"Warm-up of {resource.name} failed: {str(e)}")
+
+    thread = threading.Thread(target=warm, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def initialize(resources, mode=STARTUP_MODE):
+    if mode == "eager":
+        for resource in resources:
+            resource.get()
+    elif mode == "background":
+        start_warmup(resources)
+    elif mode != "lazy":
+        raise ValueError(f"Unknown STARTUP_MODE {mode!r}; use eager, lazy or background")
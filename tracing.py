@@ -0,0 +1,183 @@
+"""Request-scoped stage timers, Server-Timing headers and a profiler for slow requests.
+
+    with stage("retrieve"):
+        documents = retriever.search(question, embedding)
+
+A stage's time is added to the current request's trace (a contextvar, so it follows both
+WSGI threads and asyncio tasks) and feeds chatbot_stage_seconds when the request finishes.
+Outside a request it is observed directly.
+"""
+import collections
+import contextlib
+import contextvars
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+# Send a Server-Timing header with the per-stage breakdown (visible in browser devtools)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# Requests slower than this are counted, and profiled when PROFILE_SLOW_REQUESTS is on
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "5000"))
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS", "0") == "1"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+
+_current = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self.samples = collections.Counter()
+        self.duration = None
+
+    def add_stage(self, name, seconds):
+        # A stage can run more than once (e.g. two retrieval passes); report the total
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={(self.duration or time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def finish(self, method, status):
+        self.duration = time.perf_counter() - self.started
+        metrics.REQUESTS.inc(route=self.route, method=method, status=status)
+        metrics.REQUEST_SECONDS.observe(self.duration, route=self.route)
+        for name, seconds in self.stages.items():
+            metrics.STAGE_SECONDS.observe(seconds, stage=name)
+        if self.duration * 1000 >= SLOW_REQUEST_MS:
+            metrics.SLOW_REQUESTS.inc(route=self.route)
+            stages = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.stages.items())
+            print(f"Slow request {self.route}: {self.duration * 1000:.0f}ms ({stages})")
+            if self.samples:
+                report_profile(self)
+
+
+def current_trace():
+    return _current.get()
+
+
+def begin(route, profile=True):
+    """Start a trace for the current request; returns (trace, token for end()). Pass
+    profile=False on an event loop, where the thread is shared by every request"""
+    trace = RequestTrace(route)
+    token = _current.set(trace)
+    if profile and PROFILE_SLOW_REQUESTS:
+        profiler.watch(trace)
+    return trace, token
+
+
+def end(trace, token, method, status):
+    profiler.unwatch(trace)
+    trace.finish(method, status)
+    with contextlib.suppress(ValueError, RuntimeError):
+        # A streamed response may finish in another context than the one that began it
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace = _current.get()
+        if trace is not None:
+            trace.add_stage(name, seconds)
+        else:
+            metrics.STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def record_usage(usage):
+    """Count the prompt and completion tokens of a Groq usage object or dict"""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    trace = _current.get()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = usage.get(kind) or 0
+        metrics.LLM_TOKENS.inc(count, kind=kind.split("_")[0])
+        if trace is not None:
+            trace.tokens[kind] = trace.tokens.get(kind, 0) + count
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving traced requests every PROFILE_INTERVAL_MS.
+
+    Only runs while PROFILE_SLOW_REQUESTS=1; a request's samples are reported only if it
+    turns out slow. Sampling costs one sys._current_frames() call per tick, not per request.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def watch(self, trace):
+        with self._lock:
+            self._watched[threading.get_ident()] = trace
+            if self._pid != os.getpid():
+                # Started on first use, and again in each forked worker
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def unwatch(self, trace):
+        if not self._watched:
+            return
+        with self._lock:
+            for ident, watched in list(self._watched.items()):
+                if watched is trace:
+                    del self._watched[ident]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = dict(self._watched)
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for ident, trace in watched.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    trace.samples[folded_stack(frame)] += 1
+
+
+def folded_stack(frame):
+    """"outer;...;inner" in the collapsed format flamegraph.pl and speedscope read"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def report_profile(trace):
+    total = sum(trace.samples.values())
+    print(f"Profile of {trace.route} ({total} samples every {PROFILE_INTERVAL_MS:.0f}ms), hottest stacks:")
+    for stack, count in trace.samples.most_common(3):
+        print(f"  {count / total:5.1%}  {' > '.join(stack.split(';')[-3:])}")
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        route = (trace.route or "request").strip("/").replace("/", "_")
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(trace):x}-{route}"
+        path = os.path.join(PROFILE_DIR, name + ".folded")
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in trace.samples.items())
+        print(f"  full profile: {path}")
+
+
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000)
@@ -0,0 +1,229 @@
+"""Background processing for /api/upload with async=1.
+
+The request only saves the file and enqueues a job, so a large PDF no longer holds a web
+worker (or the proxy's timeout) for the whole extraction and Groq call. Jobs live in a
+SQLite queue under UPLOAD_JOBS_DIR, so every worker on the host shares one queue depth and
+any of them can report a job's progress. Each worker runs UPLOAD_JOB_WORKERS threads that
+claim queued jobs and hand them to the app's handler. Session-mode uploads need the SQLite
+conversation store when several workers share the queue, since any of them may run the job.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+from document_extraction import read_limited
+
+UPLOAD_JOBS_DIR = os.getenv("UPLOAD_JOBS_DIR", os.path.join(tempfile.gettempdir(), "legal-chatbot-upload-jobs"))
+# Queued plus running jobs; further uploads get 503 until the queue drains
+UPLOAD_QUEUE_MAX = int(os.getenv("UPLOAD_QUEUE_MAX", "32"))
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+# Finished jobs (and their results) are kept this long for polling
+UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", "3600"))
+# A running job not updated for this long belonged to a worker that died; it is retried once
+UPLOAD_JOB_STALE_SECONDS = int(os.getenv("UPLOAD_JOB_STALE_SECONDS", "600"))
+MAX_ATTEMPTS = 2
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UploadJobQueue:
+    """SQLite-backed job queue; `handler(job, progress)` returns the job's result dict and
+    reports progress with progress(stage, fraction)"""
+
+    def __init__(self, directory, handler, max_depth=UPLOAD_QUEUE_MAX, workers=UPLOAD_JOB_WORKERS,
+                 ttl=UPLOAD_JOB_TTL, stale_after=UPLOAD_JOB_STALE_SECONDS):
+        self.directory = directory
+        self.handler = handler
+        self.max_depth = max_depth
+        self.workers = workers
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._pid = None
+        self._counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "retried": 0}
+        self._db_pid = None
+        self._connection = None
+        os.makedirs(os.path.join(directory, "payloads"), exist_ok=True)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, progress REAL NOT NULL DEFAULT 0, "
+            "filename TEXT, content_type TEXT, params TEXT, result TEXT, error TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, updated REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);"
+        )
+
+    @property
+    def _db(self):
+        # One connection per process, as in SQLiteConversationStore: the queue is created at
+        # import, and a connection inherited across fork (gunicorn --preload) must not be used
+        if self._db_pid != os.getpid():
+            self._connection = sqlite3.connect(os.path.join(self.directory, "jobs.sqlite3"), timeout=10,
+                                               check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._db_pid = os.getpid()
+        return self._connection
+
+    def submit(self, stream, filename, content_type, params):
+        """Save the upload and enqueue it; raises QueueFull, or DocumentTooLarge from the read"""
+        data = read_limited(stream)
+        job_id = secrets.token_urlsafe(12)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge(now)
+                depth = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+                if depth >= self.max_depth:
+                    self._db.execute("ROLLBACK")
+                    self._counters["rejected"] += 1
+                    raise QueueFull(f"{depth} uploads are already waiting; try again shortly")
+                with open(self.payload_path(job_id), "wb") as f:
+                    f.write(data)
+                self._db.execute(
+                    "INSERT INTO jobs (id, status, stage, filename, content_type, params, created, updated) "
+                    "VALUES (?, 'queued', 'queued', ?, ?, ?, ?, ?)",
+                    (job_id, filename, content_type, json.dumps(params), now, now))
+                self._db.execute("COMMIT")
+            except QueueFull:
+                raise
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._counters["submitted"] += 1
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """The job's status, stage, progress and (once done) result or error; None if unknown"""
+        # Polling a job queued by a worker that has since restarted picks it up here
+        self.start()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, stage, progress, filename, result, error, created, updated "
+                "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row and row[1] == "queued":
+                position = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?", (row[7],)).fetchone()[0]
+            else:
+                position = None
+        if row is None:
+            return None
+        job = {"job_id": row[0], "status": row[1], "stage": row[2], "progress": round(row[3], 3),
+               "filename": row[4], "created": row[7], "updated": row[8]}
+        if position is not None:
+            job["queue_position"] = position
+        if row[5]:
+            job["result"] = json.loads(row[5])
+        if row[6]:
+            job["error"] = row[6]
+        return job
+
+    def payload_path(self, job_id):
+        return os.path.join(self.directory, "payloads", job_id)
+
+    def start(self):
+        # Started on first submit, and again in each forked worker
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"upload-job-{i}", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            for status, count in self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                stats[status] = count
+        stats["max_depth"] = self.max_depth
+        return stats
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            try:
+                result = self.handler(job, lambda stage, fraction: self._update(job["id"], stage, fraction))
+            except Exception as e:
+                print(f"Upload job {job['id']} failed: {str(e)}")
+                self._finish(job["id"], "failed", error=str(e) or type(e).__name__)
+            else:
+                self._finish(job["id"], "done", result=result)
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                stale = self._db.execute(
+                    "SELECT id, attempts FROM jobs WHERE status = 'running' AND updated <= ?",
+                    (now - self.stale_after,)).fetchall()
+                for job_id, attempts in stale:
+                    status = "queued" if attempts < MAX_ATTEMPTS else "failed"
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, stage = ?, error = ?, updated = ? WHERE id = ?",
+                        (status, status, None if status == "queued" else "Worker stopped while processing",
+                         now, job_id))
+                    self._counters["retried" if status == "queued" else "failed"] += 1
+                row = self._db.execute(
+                    "SELECT id, filename, content_type, params FROM jobs WHERE status = 'queued' "
+                    "ORDER BY created LIMIT 1").fetchone()
+                if row:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', stage = 'starting', attempts = attempts + 1, "
+                        "updated = ? WHERE id = ?", (now, row[0]))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "filename": row[1], "content_type": row[2], "params": json.loads(row[3]),
+                "path": self.payload_path(row[0])}
+
+    def _update(self, job_id, stage, fraction):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET stage = ?, progress = ?, updated = ? WHERE id = ?",
+                             (stage, fraction, time.time(), job_id))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = ?, result = ?, error = ?, updated = ? "
+                "WHERE id = ?",
+                (status, status, 1.0 if status == "done" else 0.0,
+                 json.dumps(result) if result is not None else None, error, time.time(), job_id))
+            self._counters["completed" if status == "done" else "failed"] += 1
+        try:
+            os.remove(self.payload_path(job_id))
+        except OSError:
+            pass
+
+    def _purge(self, now):
+        # Caller holds the lock inside a transaction
+        expired = [row[0] for row in self._db.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated <= ?", (now - self.ttl,))]
+        for job_id in expired:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            try:
+                os.remove(self.payload_path(job_id))
+            except OSError:
+                pass
+
+
+def upload_queue_from_env(handler):
+    return UploadJobQueue(UPLOAD_JOBS_DIR, handler)
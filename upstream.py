@@ -0,0 +1,295 @@
+"""Deadlines, retries and circuit breaking for the calls to Groq and Cloudflare.
+
+A chat request starts with a budget of REQUEST_BUDGET_SECONDS. Each upstream call's timeout
+is the smaller of its stage cap (LLM_STAGE_TIMEOUT, EMBED_STAGE_TIMEOUT) and whatever is left
+of that budget, so a slow embedding leaves less time for the completion instead of adding
+to the worst case. Transient failures (timeouts, dropped connections, 408/429/5xx) are
+retried with full-jitter backoff while the budget allows. A circuit breaker per upstream
+opens after BREAKER_FAILURES consecutive failures; while it is open, calls fail at once
+with UpstreamUnavailable and the routes fall back to a cached or retrieval-only answer
+instead of holding a worker until the upstream times out.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "60"))
+STAGE_TIMEOUTS = {
+    "embed": float(os.getenv("EMBED_STAGE_TIMEOUT", "5")),
+    "llm": float(os.getenv("LLM_STAGE_TIMEOUT", "45")),
+}
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+# Waiting for a free pooled connection counts as overload, not as a slow upstream
+POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.25"))
+RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "4"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+# httpcore scans the whole pool on every request, so a few dozen connections (each carrying
+# many HTTP/2 streams in production) outperform one connection per in-flight chat
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "32"))
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class UpstreamError(Exception):
+    """An upstream call failed for good; `status` is what the route should answer with"""
+    status = 502
+
+
+class UpstreamUnavailable(UpstreamError):
+    status = 503
+
+
+class DeadlineExceeded(UpstreamError):
+    status = 504
+
+
+# The request's deadline and the stages it has given up on; shared with the threads it
+# hands work to, which run in copies of the context
+_budget = contextvars.ContextVar("upstream_budget", default=None)
+
+
+def start_budget(seconds=REQUEST_BUDGET_SECONDS):
+    """Start the current request's budget; returns the token for end_budget"""
+    return _budget.set({"deadline": time.monotonic() + seconds, "abandoned": set()})
+
+
+def end_budget(token):
+    try:
+        _budget.reset(token)
+    except ValueError:
+        # A stream's generator finishes in a different context than the one it started in
+        _budget.set(None)
+
+
+def remaining():
+    """Seconds left in the request's budget, or None outside a budgeted request"""
+    budget = _budget.get()
+    return None if budget is None else budget["deadline"] - time.monotonic()
+
+
+def abandon(stage):
+    """Record that `stage` timed out, so the rest of the request skips it rather than
+    waiting out its timeout again (the cache lookup and retrieval both embed the question)"""
+    budget = _budget.get()
+    if budget is not None:
+        budget["abandoned"].add(stage)
+
+
+def timeout_for(stage):
+    """The timeout for one call of `stage`; raises DeadlineExceeded once the budget is spent
+    or the stage has been abandoned"""
+    cap = STAGE_TIMEOUTS[stage]
+    budget = _budget.get()
+    if budget is None:
+        return cap
+    left = budget["deadline"] - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded(f"Request budget spent before the {stage} call")
+    if stage in budget["abandoned"]:
+        raise DeadlineExceeded(f"The {stage} stage already timed out in this request")
+    return min(cap, left)
+
+
+def http_timeout(read=STAGE_TIMEOUTS["llm"]):
+    """Default httpx timeouts for the pooled upstream clients; calls pass tighter ones"""
+    import httpx
+
+    return httpx.Timeout(read, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT)
+
+
+def http_limits():
+    import httpx
+
+    return httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE, keepalive_expiry=60)
+
+
+def status_of(error):
+    # The HTTP status of a groq, httpx or requests error, without importing any of them
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    if isinstance(error, UpstreamError):
+        return False
+    status = status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+class CircuitBreaker:
+    """Closed until `failures` consecutive failures, then open: calls are refused for
+    `reset_after` seconds, after which one probe call is let through (half-open). The probe
+    succeeding closes the breaker; failing opens it again. A probe that never reports back
+    (its caller was cancelled or crashed) stops blocking others after another `reset_after`."""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if (self.state == "open" and now - self._opened_at >= self.reset_after) or \
+                    (self.state == "half-open" and now - self._probe_started >= self.reset_after):
+                self.state = "half-open"
+                self._probe_started = now
+                return True
+            self._counters["rejected"] += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise UpstreamUnavailable(f"{self.name} is failing; circuit open")
+
+    def record_success(self):
+        with self._lock:
+            self._counters["successes"] += 1
+            self._consecutive = 0
+            self.state = "closed"
+
+    def release(self):
+        """Give up a call that ended without an answer either way (cancelled), so a half-open
+        breaker lets the next call probe at once"""
+        with self._lock:
+            if self.state == "half-open":
+                self.state = "open"
+                self._opened_at = time.monotonic() - self.reset_after
+
+    def record_failure(self):
+        with self._lock:
+            self._counters["failures"] += 1
+            self._consecutive += 1
+            if self.state == "half-open" or (self.state == "closed" and self._consecutive >= self.failures):
+                if self.state == "closed":
+                    print(f"{self.name} circuit opened after {self._consecutive} consecutive failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._counters["opened"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["state"] = self.state
+            stats["open"] = int(self.state != "closed")
+        return stats
+
+
+def _backoff(attempt, stage):
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    left = remaining()
+    if left is not None and delay >= left:
+        raise DeadlineExceeded(f"Request budget spent retrying the {stage} call")
+    return delay
+
+
+def _rejected(breaker, error, stage):
+    # Not a sign the upstream is down (a 400, or a bug on our side), so it closes a half-open
+    # breaker rather than leaving it waiting for a probe that never reports back
+    breaker.record_success()
+    if status_of(error) is None:
+        raise error
+    raise UpstreamError(f"{breaker.name} rejected the {stage} call: {error}") from error
+
+
+def _failed(breaker, error, stage, attempts):
+    left = remaining()
+    if left is not None and left <= 0:
+        return DeadlineExceeded(f"{breaker.name} {stage} call ran out of time after {attempts} attempts: {error}")
+    return UpstreamError(f"{breaker.name} {stage} call failed after {attempts} attempts: {error}")
+
+
+def call(breaker, fn, stage, retries=UPSTREAM_RETRIES):
+    """`fn(timeout)` through the breaker, with the stage's deadline and jittered retries on
+    transient errors. Raises UpstreamError when the call fails for good or the upstream
+    rejects it; errors that are not the upstream's are raised as they are"""
+    for attempt in range(retries + 1):
+        # Before check(): a spent budget must not take the half-open probe slot with it
+        timeout = timeout_for(stage)
+        breaker.check()
+        try:
+            result = fn(timeout)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # Cancelled (a client leaving a stream) or interrupted: no verdict on the upstream
+                breaker.release()
+                raise
+            if not is_retryable(e):
+                _rejected(breaker, e, stage)
+            breaker.record_failure()
+            if attempt == retries:
+                raise _failed(breaker, e, stage, attempt + 1) from e
+            delay = _backoff(attempt, stage)
+            print(f"{breaker.name} {stage} call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+async def call_async(breaker, fn, stage, retries=UPSTREAM_RETRIES):
+    """`call` for coroutines: `fn(timeout)` returns an awaitable"""
+    for attempt in range(retries + 1):
+        # Before check(): a spent budget must not take the half-open probe slot with it
+        timeout = timeout_for(stage)
+        breaker.check()
+        try:
+            result = await fn(timeout)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # Cancelled (a client leaving a stream) or interrupted: no verdict on the upstream
+                breaker.release()
+                raise
+            if not is_retryable(e):
+                _rejected(breaker, e, stage)
+            breaker.record_failure()
+            if attempt == retries:
+                raise _failed(breaker, e, stage, attempt + 1) from e
+            delay = _backoff(attempt, stage)
+            print(f"{breaker.name} {stage} call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+def hedged(fn, delay, executor):
+    """Run `fn()`; if it has not returned after `delay` seconds, start a second copy and
+    take whichever succeeds first. Only for idempotent calls such as embeddings"""
+    first = executor.submit(fn)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    pending = {first, executor.submit(fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
@@ -0,0 +1,305 @@
+"""Read-only, memory-mapped copy of a Chroma collection for serving.
+
+    python vector_index.py export --chroma-path ./chroma_db --out ./vector_index
+    python vector_index.py verify --chroma-path ./chroma_db --index ./vector_index
+    VECTOR_INDEX_PATH=./vector_index gunicorn app:app
+
+The corpus does not change while serving, so instead of every worker opening a Chroma
+client, `export` writes the collection once to a directory:
+
+- vectors.npy: float16, or int8 with a float32 scale per row (scales.npy);
+- norms.npy: the squared norm of each original vector, for exact L2 ordering;
+- text.bin: all chunk texts in UTF-8, sliced by offsets.npy;
+- records.json: ids and metadatas;
+- meta.json: format, dimension and distance space.
+
+MappedCollection opens the arrays with mmap, so all workers share one copy through the OS
+page cache and opening costs no parsing. It answers the subset of the Chroma Collection API
+that the app uses (count, query, get), with Chroma's distances. Search is a blocked,
+vectorised dot product; exports with --ivf-lists also write an inverted-file index
+(k-means lists) so that large corpora only scan the `nprobe` closest lists.
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+# Rows scored per matrix product; bounds the temporary float32 copy of quantized rows
+SCAN_BLOCK = 32768
+
+
+def quantize(vectors, dtype):
+    """Return (stored vectors, per-row scales or None)"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unsupported dtype {dtype!r}; use float16 or int8")
+
+
+def kmeans(vectors, lists, iterations=10, seed=0):
+    """Plain Lloyd's k-means on a sample; returns (centroids, assignment of every row)"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), lists * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(sample, centroids)
+        for list_id in range(lists):
+            members = sample[assignment == list_id]
+            if len(members):
+                centroids[list_id] = members.mean(axis=0)
+    return centroids, nearest_centroid(vectors, centroids)
+
+
+def nearest_centroid(vectors, centroids):
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(vectors), SCAN_BLOCK):
+        block = vectors[start:start + SCAN_BLOCK]
+        assignment[start:start + SCAN_BLOCK] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return assignment
+
+
+def export(collection, out, dtype="float16", ivf_lists=0):
+    """Write `collection` (a Chroma collection) to the directory `out`, replacing it atomically"""
+    data = collection.get(include=["documents", "metadatas", "embeddings"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    if not len(vectors):
+        raise ValueError(f"Collection {collection.name} is empty")
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "cosine":
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    stored, scales = quantize(vectors, dtype)
+
+    staging = out.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    np.save(os.path.join(staging, "vectors.npy"), stored)
+    np.save(os.path.join(staging, "norms.npy"), (vectors ** 2).sum(axis=1).astype(np.float32))
+    if scales is not None:
+        np.save(os.path.join(staging, "scales.npy"), scales)
+
+    encoded = [(document or "").encode("utf-8") for document in data["documents"]]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    np.save(os.path.join(staging, "offsets.npy"), offsets)
+    with open(os.path.join(staging, "text.bin"), "wb") as f:
+        f.writelines(encoded)
+    with open(os.path.join(staging, "records.json"), "w") as f:
+        json.dump({"ids": data["ids"], "metadatas": data["metadatas"] or [None] * len(encoded)}, f)
+
+    if ivf_lists:
+        centroids, assignment = kmeans(vectors, ivf_lists)
+        order = np.argsort(assignment, kind="stable").astype(np.int32)
+        list_offsets = np.searchsorted(assignment[order], np.arange(ivf_lists + 1)).astype(np.int64)
+        np.save(os.path.join(staging, "ivf_centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(staging, "ivf_rows.npy"), order)
+        np.save(os.path.join(staging, "ivf_offsets.npy"), list_offsets)
+
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump({
+            "format": FORMAT_VERSION,
+            "collection": collection.name,
+            "count": len(vectors),
+            "dimension": vectors.shape[1],
+            "dtype": dtype,
+            "space": space,
+            "ivf_lists": ivf_lists,
+        }, f)
+
+    # Swap directories so a serving worker never opens a half-written index
+    previous = out.rstrip("/") + ".old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(out):
+        os.rename(out, previous)
+    os.rename(staging, out)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+class MappedCollection:
+    """Stands in for a Chroma collection, searching an exported index through mmap"""
+
+    def __init__(self, path, nprobe=VECTOR_INDEX_NPROBE):
+        self.path = path
+        self.nprobe = nprobe
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has index format {self.meta['format']}; re-export it")
+        self.name = self.meta["collection"]
+        self.metadata = {"hnsw:space": self.meta["space"]}
+        self.vectors = self._load("vectors.npy")
+        self.norms = self._load("norms.npy")
+        self.scales = self._load("scales.npy") if self.meta["dtype"] == "int8" else None
+        self.offsets = self._load("offsets.npy")
+        self.text = np.memmap(os.path.join(path, "text.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] else np.zeros(0, dtype=np.uint8)
+        if self.meta["ivf_lists"]:
+            self.centroids = self._load("ivf_centroids.npy")
+            self.ivf_rows = self._load("ivf_rows.npy")
+            self.ivf_offsets = self._load("ivf_offsets.npy")
+        self._records = None
+        self._records_lock = threading.Lock()
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    @property
+    def records(self):
+        # Ids and metadatas are only parsed when a result needs them
+        with self._records_lock:
+            if self._records is None:
+                with open(os.path.join(self.path, "records.json")) as f:
+                    self._records = json.load(f)
+        return self._records
+
+    def count(self):
+        return self.meta["count"]
+
+    def document(self, row):
+        return bytes(self.text[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def query(self, query_embeddings, n_results=10, include=("documents", "metadatas", "distances")):
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for embedding in query_embeddings:
+            rows, distances = self.search(np.asarray(embedding, dtype=np.float32), n_results)
+            result["ids"].append([self.records["ids"][row] for row in rows])
+            result["distances"].append(distances.tolist())
+            if "documents" in include:
+                result["documents"].append([self.document(row) for row in rows])
+            if "metadatas" in include:
+                result["metadatas"].append([self.records["metadatas"][row] for row in rows])
+        return result
+
+    def get(self, ids=None, limit=None, include=("documents", "metadatas")):
+        if ids is not None:
+            positions = {chunk_id: row for row, chunk_id in enumerate(self.records["ids"])}
+            rows = [positions[chunk_id] for chunk_id in ids if chunk_id in positions]
+        else:
+            rows = list(range(self.count() if limit is None else min(limit, self.count())))
+        result = {"ids": [self.records["ids"][row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.document(row) for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.records["metadatas"][row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = self.dequantize(np.asarray(rows, dtype=np.int64))
+        return result
+
+    def dequantize(self, rows):
+        # `rows` is an index array or a slice
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        return vectors * self.scales[rows][:, None] if self.scales is not None else vectors
+
+    def search(self, query, k):
+        """Rows of the k nearest chunks and their Chroma-style distances"""
+        space = self.meta["space"]
+        if space == "cosine":
+            query = query / (np.linalg.norm(query) or 1.0)
+        if self.meta["ivf_lists"]:
+            nearest_lists = np.argsort(((self.centroids - query) ** 2).sum(axis=1))[:self.nprobe]
+            rows = np.concatenate([self.ivf_rows[self.ivf_offsets[i]:self.ivf_offsets[i + 1]] for i in nearest_lists])
+            rows.sort()
+        else:
+            rows = None
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        candidates = self.count() if rows is None else len(rows)
+        for start in range(0, candidates, SCAN_BLOCK):
+            if rows is None:
+                # A contiguous slice of the mapping, not a gather
+                selection = slice(start, min(start + SCAN_BLOCK, candidates))
+                block_rows = np.arange(selection.start, selection.stop)
+            else:
+                selection = block_rows = rows[start:start + SCAN_BLOCK].astype(np.int64)
+            scores = self.dequantize(selection) @ query
+            if space == "l2":
+                # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2; ||q||^2 does not change the order
+                scores = 2 * scores - self.norms[selection]
+            best_rows = np.concatenate([best_rows, block_rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores)
+        best_rows, best_scores = best_rows[order], best_scores[order]
+        if space == "l2":
+            distances = float(query @ query) - best_scores
+        else:
+            distances = 1.0 - best_scores
+        return best_rows.tolist(), distances.astype(np.float32)
+
+
+def open_chroma(chroma_path, collection_name):
+    import chromadb
+    return chromadb.PersistentClient(path=chroma_path).get_collection(collection_name)
+
+
+def verify(collection, index, samples, k):
+    """Top-k agreement of the index with an exact float32 scan of the stored vectors, and with
+    collection.query (whose HNSW search is itself approximate). Returns the exact recall"""
+    rng = np.random.default_rng(0)
+    stored = collection.get(include=["embeddings"])
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    picks = rng.choice(len(vectors), size=min(samples, len(vectors)), replace=False)
+    # Blend two chunks so the query is not itself a stored vector
+    queries = vectors[picks] + 0.5 * vectors[rng.permutation(len(vectors))[:len(picks)]]
+    if index.meta["space"] == "cosine":
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    recall, overlap, index_time, chroma_time = [], [], 0.0, 0.0
+    for query in queries:
+        started = time.perf_counter()
+        expected = collection.query(query_embeddings=[query.tolist()], n_results=k)["ids"][0]
+        chroma_time += time.perf_counter() - started
+        started = time.perf_counter()
+        found = index.query(query_embeddings=[query], n_results=k)["ids"][0]
+        index_time += time.perf_counter() - started
+        if index.meta["space"] == "l2":
+            exact = np.argsort(((vectors - query) ** 2).sum(axis=1))[:k]
+        else:
+            exact = np.argsort(-(vectors @ query))[:k]
+        recall.append(len(set(found) & {stored["ids"][row] for row in exact}) / k)
+        overlap.append(len(set(found) & set(expected)) / max(len(expected), 1))
+    print(f"top-{k} over {len(queries)} queries: recall vs exact scan={np.mean(recall):.3f} "
+          f"(min {np.min(recall):.3f}), overlap with Chroma={np.mean(overlap):.3f}; "
+          f"query chroma={chroma_time / len(queries) * 1000:.2f}ms index={index_time / len(queries) * 1000:.2f}ms")
+    return float(np.mean(recall))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and check the memory-mapped vector index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("export", "verify"):
+        command = commands.add_parser(name)
+        command.add_argument("--chroma-path", default=os.getenv("CHROMA_PATH", "./chroma_db"))
+        command.add_argument("--collection", default="constitution_embeddings")
+    commands.choices["export"].add_argument("--out", default=os.getenv("VECTOR_INDEX_PATH", "./vector_index"))
+    commands.choices["export"].add_argument("--dtype", choices=["float16", "int8"], default="float16")
+    commands.choices["export"].add_argument("--ivf-lists", type=int, default=0,
+                                            help="k-means lists for an IVF index; 0 scans every vector")
+    commands.choices["verify"].add_argument("--index", default=os.getenv("VECTOR_INDEX_PATH", "./vector_index"))
+    commands.choices["verify"].add_argument("--samples", type=int, default=50)
+    commands.choices["verify"].add_argument("-k", type=int, default=20)
+    commands.choices["verify"].add_argument("--min-recall", type=float, default=0.95)
+    commands.choices["verify"].add_argument("--nprobe", type=int, default=VECTOR_INDEX_NPROBE)
+    args = parser.parse_args()
+
+    collection = open_chroma(args.chroma_path, args.collection)
+    if args.command == "export":
+        started = time.perf_counter()
+        export(collection, args.out, args.dtype, args.ivf_lists)
+        size = sum(os.path.getsize(os.path.join(args.out, name)) for name in os.listdir(args.out))
+        print(f"Exported {collection.count()} chunks to {args.out} ({size / 1e6:.1f} MB, {args.dtype}) "
+              f"in {time.perf_counter() - started:.1f}s")
+    elif verify(collection, MappedCollection(args.index, args.nprobe), args.samples, args.k) < args.min_recall:
+        raise SystemExit(f"Index recall is below {args.min_recall}; re-export it or raise --nprobe")